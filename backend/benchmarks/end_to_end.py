@@ -0,0 +1,330 @@
+# COMP90024 Team 75
+# Linying Wei (1638206)
+# Wangyang Wu (1641248)
+# Ziyu Wang (1560831)
+# Roger Zhang (1079986)
+
+"""
+    End-to-end harvest and ingest throughput against local fakes (see fake_services.py)
+    Scenarios, each run in a fresh child process against fresh fakes:
+      test1       fission/mastodon/test1.py main()          (incremental Mastodon harvest)
+      historical  history-mastodon harvest_historical_data  (last 24 hours, all hashtags)
+      reddit      reddit_harvester RedditHarvester.process_task for every subreddit x keyword
+      upload      processor/upload_to_es.py upload_lines    (seed posts and comments)
+    Reported per scenario: documents indexed (control, rollup and model indices excluded),
+    docs/sec, API calls per document, Elasticsearch requests, peak RSS of the child and the
+    seconds of time.sleep that were skipped (sleeps are not slept unless --real-sleeps).
+    Results are written as JSON; --compare prints the change against an earlier run.
+
+    python benchmarks/end_to_end.py
+    python benchmarks/end_to_end.py --scenarios reddit --comments-per-post 20
+    python benchmarks/end_to_end.py --output after.json --compare before.json
+"""
+
+import argparse
+import ast
+import builtins
+import contextlib
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from fake_services import FakeElasticsearch, FakeMastodon, FakeReddit
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+BASE_DIR = os.path.dirname(BACKEND)
+MASTODON_SEED = os.path.join(BASE_DIR, "data", "mastodon", "AU-ACT")
+REDDIT_SEEDS = [os.path.join(BACKEND, "utils", "reddit-Auspol-submissions.json"),
+                os.path.join(BACKEND, "utils", "reddit-sydney-comments.ndjson")]
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+SCENARIOS = ["test1", "historical", "reddit", "upload"]
+# Bookkeeping indices that are not harvested documents
+NOT_DOCUMENTS = ["*-control", "housing-rollups-daily", "housing-terms-daily", "topic-models"]
+FAKE_CONFIG = {
+    "ES_USERNAME": "elastic",
+    "ES_PASSWORD": "elastic",
+    "MASTODON_ACCESS_TOKEN": "benchmark",
+    "REDDIT_CLIENT_ID": "benchmark",
+    "REDDIT_CLIENT_SECRET": "benchmark",
+}
+
+
+# === seeds ===
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def read_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [line if line.endswith("\n") else line + "\n" for line in f if line.strip()]
+
+def mastodon_seed():
+    posts = [json.loads(line) for line in read_lines(os.path.join(MASTODON_SEED, "posts.json"))]
+    comments = [json.loads(line) for line in read_lines(os.path.join(MASTODON_SEED, "comments.json"))]
+    return posts, comments
+
+def reddit_seed():
+    # Seed files hold bulk actions (a JSON array or one per line); only the sources are used
+    posts = []
+    for path in REDDIT_SEEDS:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        actions = json.loads(text) if text.lstrip().startswith("[") else [json.loads(l) for l in text.splitlines() if l.strip()]
+        posts.extend(a["_source"] for a in actions if "_source" in a)
+    return posts
+
+
+def reddit_subreddits():
+    # Read from the harvester source: importing it here would configure logging in this process
+    with open(os.path.join(BACKEND, "reddit", "reddit_harvester.py"), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "SUBREDDITS" for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise ValueError("SUBREDDITS not found in reddit_harvester.py")
+
+
+# === child process ===
+@contextlib.contextmanager
+def fake_configs():
+    """Serve the /configs/default/<configmap>/<KEY> files the functions read; keys not in
+    FAKE_CONFIG (REDIS_HOST, PUSHGATEWAY, ...) are missing, as in a minimal deployment."""
+    real_open = builtins.open
+
+    def fake_open(file, *args, **kwargs):
+        if isinstance(file, str) and file.startswith("/configs/"):
+            key = os.path.basename(file)
+            if key not in FAKE_CONFIG:
+                raise FileNotFoundError(file)
+            return io.StringIO(FAKE_CONFIG[key])
+        return real_open(file, *args, **kwargs)
+
+    builtins.open = fake_open
+    try:
+        yield
+    finally:
+        builtins.open = real_open
+
+@contextlib.contextmanager
+def skipped_sleeps(real: bool):
+    # Rate-limit and politeness sleeps would dominate a local run; their total is reported instead
+    slept = [0.0]
+    real_sleep = time.sleep
+
+    def fake_sleep(seconds):
+        slept[0] += max(seconds, 0)
+        if real:
+            real_sleep(seconds)
+
+    time.sleep = fake_sleep
+    try:
+        yield slept
+    finally:
+        time.sleep = real_sleep
+
+def run_test1(urls, options):
+    from elasticsearch import Elasticsearch
+    from flask import Flask
+    from common.topic_store import ESModelStore, TopicTagger
+
+    test1 = load_module("test1", os.path.join(BACKEND, "fission", "mastodon", "test1.py"))
+    test1.API_BASE_URL = urls["mastodon"]
+    test1.es = Elasticsearch(urls["es"])
+    test1.topic_tagger = TopicTagger(ESModelStore(test1.es), "comments")
+    with Flask(__name__).app_context():
+        response, status = test1.main()
+    return {"status": status, "message": response.get_json()["message"]}
+
+def run_historical(urls, options):
+    from elasticsearch import Elasticsearch
+
+    historical = load_module("historical_harvester", os.path.join(BACKEND, "history-mastodon", "historical_harvester.py"))
+    historical.API_BASE_URL = urls["mastodon"]
+    historical.init_elasticsearch = lambda: Elasticsearch(urls["es"])
+    end = datetime.now(timezone.utc)
+    posts = historical.harvest_historical_data(historical.HASHTAGS, end - timedelta(days=1), end, options["batch_size"])
+    return {"posts": posts}
+
+def run_reddit(urls, options):
+    import praw
+    from elasticsearch import Elasticsearch
+    from common.dedup import Deduplicator
+
+    harvester_module = load_module("reddit_harvester", os.path.join(BACKEND, "reddit", "reddit_harvester.py"))
+    harvester_module.Elasticsearch = lambda **kwargs: Elasticsearch(urls["es"])
+    # Built without __init__: the Redis task stream is not part of the measured path
+    harvester = harvester_module.RedditHarvester.__new__(harvester_module.RedditHarvester)
+    harvester.reddit = praw.Reddit(
+        client_id=FAKE_CONFIG["REDDIT_CLIENT_ID"], client_secret=FAKE_CONFIG["REDDIT_CLIENT_SECRET"],
+        user_agent=harvester_module.USER_AGENT, oauth_url=urls["reddit"], reddit_url=urls["reddit"],
+        short_url=urls["reddit"], check_for_updates=False, check_for_async=False
+    )
+    harvester.es_manager = harvester_module.ESManager()
+    reference_only = harvester_module.dedup_reference_only()
+    harvester.post_dedup = Deduplicator("reddit-posts", reference_only=reference_only)
+    harvester.comment_dedup = Deduplicator("reddit-comments", reference_only=reference_only)
+
+    end = datetime.now(timezone.utc)
+    statuses = {}
+    for n, (subreddit, keyword) in enumerate(
+            (s, k) for s in harvester_module.SUBREDDITS for k in harvester_module.KEYWORDS):
+        result = harvester.process_task({
+            "task_id": f"bench-{n}", "subreddit": subreddit, "keyword": keyword, "max_posts": 200,
+            "start_time": (end - timedelta(days=1)).isoformat(), "end_time": end.isoformat(),
+        })
+        statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+    return {"tasks": statuses}
+
+def run_upload(urls, options):
+    sys.path.insert(0, os.path.join(BACKEND, "processor"))
+    try:
+        import upload_to_es
+    except ImportError as e:
+        return {"skipped": f"upload_to_es cannot be imported: {e}"}
+    upload_to_es.upload_lines(urls["es"], read_lines(os.path.join(MASTODON_SEED, "posts.json")),
+                              read_lines(os.path.join(MASTODON_SEED, "comments.json")))
+    return {}
+
+RUNNERS = {"test1": run_test1, "historical": run_historical, "reddit": run_reddit, "upload": run_upload}
+
+def child(scenario, urls, options, results):
+    sys.path.insert(0, BACKEND)
+    out = io.StringIO()
+    with fake_configs(), skipped_sleeps(options["real_sleeps"]) as slept, \
+            contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+        started = time.perf_counter()
+        try:
+            result = RUNNERS[scenario](urls, options)
+        except Exception as e:
+            result = {"error": f"{type(e).__name__}: {e}"}
+        seconds = time.perf_counter() - started
+    # ru_maxrss is KiB on Linux
+    result.update(seconds=seconds, slept_seconds=slept[0],
+                  peak_rss_mib=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+    if options["verbose"]:
+        sys.stderr.write(out.getvalue())
+    results.put(result)
+
+
+# === parent ===
+def run_scenario(scenario, options, mastodon_posts, mastodon_comments, reddit_posts):
+    es = FakeElasticsearch(reject_rate=options["reject_rate"]).start()
+    apis = {}
+    if scenario in ("test1", "historical"):
+        apis["mastodon"] = FakeMastodon(mastodon_posts, mastodon_comments, rate_limit=options["rate_limit"]).start()
+    elif scenario == "reddit":
+        apis["reddit"] = FakeReddit(reddit_posts, reddit_subreddits(), options["comments_per_post"]).start()
+    try:
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue()
+        proc = ctx.Process(target=child, args=(scenario, {"es": es.url, **{k: v.url for k, v in apis.items()}},
+                                               options, results))
+        proc.start()
+        result = results.get()
+        proc.join()
+    finally:
+        for service in [es, *apis.values()]:
+            service.stop()
+
+    created = es.created(exclude=NOT_DOCUMENTS)
+    docs = sum(created.values())
+    api_calls = sum(service.total_calls for service in apis.values())
+    result.update(
+        docs=docs,
+        indices=created,
+        docs_per_sec=docs / result["seconds"] if result["seconds"] else 0.0,
+        # what a deployment would see, where the sleeps are slept
+        docs_per_sec_with_sleeps=docs / (result["seconds"] + result["slept_seconds"]) if result["seconds"] else 0.0,
+        api_calls=api_calls,
+        api_calls_per_doc=api_calls / docs if docs else None,
+        api_calls_by_route={name: dict(service.calls) for name, service in apis.items()},
+        es_requests=es.total_calls,
+        es_requests_by_route=dict(es.calls),
+        bulk_rejected=es.rejected,
+    )
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_result(scenario, r):
+    if "skipped" in r or "error" in r:
+        print(f"{scenario:<11} {r.get('skipped') or r.get('error')}")
+        return
+    per_doc = f"{r['api_calls_per_doc']:.3f}" if r["api_calls_per_doc"] is not None else "-"
+    print(f"{scenario:<11} {r['docs']:>7,} docs  {r['seconds']:>7.2f}s  {r['docs_per_sec']:>9,.1f} docs/s  "
+          f"{per_doc:>6} API calls/doc  {r['es_requests']:>5,} ES requests  {r['peak_rss_mib']:>7.1f} MiB peak  "
+          f"({r['slept_seconds']:.0f}s of sleeps skipped)")
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nChange against {baseline_path} ({baseline.get('commit')}):")
+    for scenario, r in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(scenario)
+        if not before or any(k in x for x in (before, r) for k in ("skipped", "error")):
+            continue
+        deltas = []
+        for key in ("docs_per_sec", "api_calls_per_doc", "peak_rss_mib"):
+            if before.get(key) and r.get(key) is not None:
+                deltas.append(f"{key} {r[key] / before[key] - 1:+.1%}")
+        print(f"{scenario:<11} " + "  ".join(deltas))
+
+def parse_args():
+    p = argparse.ArgumentParser(description="End-to-end harvest/ingest throughput against local fakes")
+    p.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    p.add_argument("--comments-per-post", type=int, default=5, help="Synthetic comments per Reddit submission")
+    p.add_argument("--rate-limit", type=int, default=0,
+                   help="Mastodon requests per 5 minute window before 429s (default: unlimited)")
+    p.add_argument("--reject-rate", type=float, default=0.0,
+                   help="Fraction of bulk items the fake Elasticsearch rejects with 429")
+    p.add_argument("--batch-size", type=int, default=100, help="historical: bulk batch size")
+    p.add_argument("--real-sleeps", action="store_true", help="Actually sleep on time.sleep calls")
+    p.add_argument("--output", help=f"Results JSON (default: {RESULTS_DIR}/end_to_end-<timestamp>.json)")
+    p.add_argument("--compare", metavar="BASELINE", help="Earlier results JSON to compare against")
+    p.add_argument("-v", "--verbose", action="store_true", help="Show the scenarios' own output")
+    return p.parse_args()
+
+def main():
+    args = parse_args()
+    options = {"comments_per_post": args.comments_per_post, "rate_limit": args.rate_limit,
+               "reject_rate": args.reject_rate, "batch_size": args.batch_size,
+               "real_sleeps": args.real_sleeps, "verbose": args.verbose}
+    mastodon_posts, mastodon_comments = mastodon_seed()
+    reddit_posts = reddit_seed()
+    print(f"Seeds: {len(mastodon_posts):,} Mastodon posts, {len(mastodon_comments):,} comments, "
+          f"{len(reddit_posts):,} Reddit submissions")
+
+    report = {"timestamp": datetime.now(timezone.utc).isoformat(), "commit": git_commit(),
+              "python": sys.version.split()[0], "options": options, "scenarios": {}}
+    for scenario in args.scenarios:
+        result = run_scenario(scenario, options, mastodon_posts, mastodon_comments, reddit_posts)
+        report["scenarios"][scenario] = result
+        print_result(scenario, result)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"end_to_end-{datetime.now().strftime('%Y%m%dT%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    if args.compare:
+        compare(report, args.compare)
+
+if __name__ == "__main__":
+    main()
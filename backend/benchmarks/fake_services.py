@@ -0,0 +1,564 @@
+# COMP90024 Team 75
+# Linying Wei (1638206)
+# Wangyang Wu (1641248)
+# Ziyu Wang (1560831)
+# Roger Zhang (1079986)
+
+"""
+    Local stand-ins for the APIs the harvesters and uploaders talk to, for benchmarks
+    Each service is a threaded HTTP/1.1 server on 127.0.0.1 (random port) that counts
+    the requests it serves per route:
+      FakeMastodon       tag timelines (max_id / since_id paging), /statuses/<id>/context
+                         and X-RateLimit-* headers, seeded from harvested posts/comments
+      FakeReddit         OAuth token, subreddit search listings and /comments/<id>
+      FakeElasticsearch  in-memory indices: _bulk, _search, _mget, documents, templates
+    Seed timestamps are shifted into the last `span` so "since the last run" and
+    "within the last day" windows see every document.
+
+    with FakeMastodon(posts, comments) as mastodon, FakeElasticsearch() as es:
+        ...  # point the harvester at mastodon.url and es.url
+        print(mastodon.calls, es.created())
+"""
+
+import fnmatch
+import itertools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlsplit, unquote
+
+Response = Tuple[int, Dict[str, str], object]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes; with Nagle on, keep-alive clients wait
+    # for the delayed ACK (~40 ms) on every response
+    disable_nagle_algorithm = True
+    service = None
+
+    def log_message(self, *args):
+        pass
+
+    def _dispatch(self, method):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        status, headers, payload = self.service.dispatch(method, unquote(url.path), query, body)
+        data = payload if isinstance(payload, bytes) else (b"" if payload is None else json.dumps(payload).encode("utf-8"))
+        self.send_response(status)
+        for key, value in {**self.service.headers(), **headers}.items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if method != "HEAD":
+            self.wfile.write(data)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_HEAD(self):
+        self._dispatch("HEAD")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+
+class FakeService:
+    """A service answers dispatch(method, path, query, body) -> (status, headers, payload)."""
+
+    routes: Sequence[Tuple[str, str, str]] = ()   # (method regex, path regex, handler name)
+
+    def __init__(self):
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self._routes = [(re.compile(m), re.compile(p), getattr(self, h)) for m, p, h in self.routes]
+        self._server = None
+
+    def headers(self) -> Dict[str, str]:
+        return {}
+
+    def dispatch(self, method, path, query, body) -> Response:
+        for method_re, path_re, handler in self._routes:
+            match = path_re.match(path)
+            if match and method_re.fullmatch(method):
+                with self._lock:
+                    self.calls[handler.__name__] += 1
+                    return handler(method, query, body, *match.groups())
+        with self._lock:
+            self.calls["unrouted"] += 1
+        return 400, {}, {"error": f"no route for {method} {path}"}
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self):
+        handler = type("Handler", (_Handler,), {"service": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _spread(count: int, span: timedelta, now: datetime) -> List[datetime]:
+    # count timestamps, oldest first, evenly over (now - span, now)
+    step = span / max(count, 1)
+    return [now - span + step * (i + 1) for i in range(count)]
+
+
+# === Mastodon ===
+_HASHTAG_RE = re.compile(r"/tags/(\w+)")
+
+class FakeMastodon(FakeService):
+    routes = (
+        ("GET", r"^/api/v1/timelines/tag/([^/]+)$", "tag_timeline"),
+        ("GET", r"^/api/v1/statuses/(\d+)/context$", "context"),
+    )
+
+    def __init__(self, posts: Iterable[Dict], comments: Iterable[Dict] = (), rate_limit=0, window=300,
+                 span=timedelta(hours=20)):
+        """rate_limit requests per window seconds (0 = unlimited; the headers are sent either way)."""
+        super().__init__()
+        self.rate_limit = rate_limit
+        self.window = window
+        self._window_start = time.time()
+        self._window_calls = 0
+
+        posts = sorted(posts, key=lambda p: int(p["post_id"]))
+        now = datetime.now(timezone.utc)
+        self.statuses = []
+        for post, created in zip(posts, _spread(len(posts), span, now)):
+            tags = post.get("tags") or []
+            tags = {t.lower() for t in ([tags] if isinstance(tags, str) else tags)}
+            tags.update(t.lower() for t in _HASHTAG_RE.findall(post.get("content") or ""))
+            self.statuses.append({
+                "id": str(post["post_id"]),
+                "created_at": created.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                "content": post.get("content") or "",
+                "account": {"acct": post.get("author") or "unknown"},
+                "tags": [{"name": t} for t in sorted(tags)],
+            })
+        self.statuses.sort(key=lambda s: int(s["id"]), reverse=True)
+        created_of = {s["id"]: s["created_at"] for s in self.statuses}
+
+        self.replies: Dict[str, List[Dict]] = {}
+        for comment in sorted(comments, key=lambda c: int(c["comment_id"])):
+            post_id = str(comment["post_id"])
+            if post_id in created_of:
+                self.replies.setdefault(post_id, []).append({
+                    "id": str(comment["comment_id"]),
+                    "created_at": created_of[post_id],
+                    "content": comment.get("content") or "",
+                    "account": {"acct": comment.get("author") or "unknown"},
+                    "in_reply_to_id": post_id,
+                })
+
+    def _rate_limit_headers(self) -> Dict[str, str]:
+        limit = self.rate_limit or 300
+        reset = datetime.fromtimestamp(self._window_start + self.window, timezone.utc)
+        return {
+            "X-RateLimit-Limit": str(limit),
+            "X-RateLimit-Remaining": str(max(limit - self._window_calls, 0)),
+            "X-RateLimit-Reset": reset.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+        }
+
+    def dispatch(self, method, path, query, body) -> Response:
+        with self._lock:
+            now = time.time()
+            if now - self._window_start >= self.window:
+                self._window_start, self._window_calls = now, 0
+            self._window_calls += 1
+            headers = self._rate_limit_headers()
+            limited = self.rate_limit and self._window_calls > self.rate_limit
+            if limited:
+                self.calls["rate_limited"] += 1
+                # The client sleeps until X-RateLimit-Reset, which the benchmark skips,
+                # so the next window starts as if that sleep had happened
+                self._window_start, self._window_calls = now, 0
+        if limited:
+            return 429, headers, {"error": "Too many requests"}
+        status, extra, payload = super().dispatch(method, path, query, body)
+        return status, {**headers, **extra}, payload
+
+    def tag_timeline(self, method, query, body, tag) -> Response:
+        tag = tag.lower()
+        limit = min(int(query.get("limit", 20)), 40)
+        max_id = int(query["max_id"]) if query.get("max_id") else None
+        since_id = int(query["since_id"]) if query.get("since_id") else None
+        page = []
+        for status in self.statuses:
+            sid = int(status["id"])
+            if max_id is not None and sid >= max_id:
+                continue
+            if since_id is not None and sid <= since_id:
+                break
+            if any(t["name"] == tag for t in status["tags"]):
+                page.append(status)
+                if len(page) == limit:
+                    break
+        return 200, {}, page
+
+    def context(self, method, query, body, status_id) -> Response:
+        return 200, {}, {"ancestors": [], "descendants": self.replies.get(status_id, [])}
+
+
+# === Reddit ===
+class FakeReddit(FakeService):
+    routes = (
+        ("POST", r"^/api/v1/access_token/?$", "access_token"),
+        ("GET", r"^/r/([^/]+)/search/?$", "search"),
+        ("GET", r"^/comments/([0-9a-z]+)/?", "comments"),
+    )
+
+    TIME_FILTERS = {"hour": 3600, "day": 86400, "week": 7 * 86400, "month": 31 * 86400, "year": 366 * 86400}
+
+    def __init__(self, posts: Iterable[Dict], subreddits: Sequence[str], comments_per_post=5,
+                 span=timedelta(hours=20)):
+        """posts are spread round-robin over subreddits; each post gets comments_per_post
+        comments whose bodies are taken from the other posts."""
+        super().__init__()
+        posts = list(posts)
+        now = datetime.now(timezone.utc)
+        self.by_subreddit: Dict[str, List[Dict]] = {s.lower(): [] for s in subreddits}
+        self.submissions: Dict[str, Dict] = {}
+        for i, (post, created) in enumerate(zip(posts, _spread(len(posts), span, now))):
+            subreddit = subreddits[i % len(subreddits)]
+            content = post.get("content") or ""
+            title, _, selftext = content.partition(". ")
+            data = {
+                "id": str(post["post_id"]), "name": f"t3_{post['post_id']}", "title": title[:300],
+                "selftext": selftext, "author": post.get("author") or "[deleted]",
+                "created_utc": created.timestamp(), "subreddit": subreddit, "score": 1,
+                "num_comments": comments_per_post, "permalink": f"/r/{subreddit}/comments/{post['post_id']}/",
+            }
+            self.by_subreddit[subreddit.lower()].append(data)
+            self.submissions[data["id"]] = data
+        for listing in self.by_subreddit.values():
+            listing.sort(key=lambda d: d["created_utc"], reverse=True)
+
+        bodies = [p.get("content") or "" for p in posts] or [""]
+        self.threads: Dict[str, List[Dict]] = {}
+        counter = itertools.count()
+        for i, data in enumerate(self.submissions.values()):
+            replies = []
+            for j in range(comments_per_post):
+                cid = f"c{next(counter):x}"
+                replies.append({"kind": "t1", "data": {
+                    "id": cid, "name": f"t1_{cid}", "body": bodies[(i + j + 1) % len(bodies)],
+                    "author": f"user{j}", "created_utc": data["created_utc"] + 60 * (j + 1),
+                    "parent_id": data["name"], "link_id": data["name"], "replies": "",
+                    "subreddit": data["subreddit"], "score": 1,
+                }})
+            self.threads[data["id"]] = replies
+
+    def headers(self) -> Dict[str, str]:
+        return {"x-ratelimit-remaining": "996", "x-ratelimit-used": "4", "x-ratelimit-reset": "300"}
+
+    @staticmethod
+    def _listing(children: List[Dict], after: Optional[str] = None) -> Dict:
+        return {"kind": "Listing", "data": {"after": after, "before": None, "dist": len(children), "children": children}}
+
+    def access_token(self, method, query, body) -> Response:
+        return 200, {}, {"access_token": "benchmark", "expires_in": 3600, "scope": "*", "token_type": "bearer"}
+
+    def search(self, method, query, body, subreddit) -> Response:
+        words = re.compile(r"\b%s\b" % re.escape(query.get("q") or ""), re.IGNORECASE)
+        oldest = time.time() - self.TIME_FILTERS.get(query.get("t", "all"), float("inf"))
+        matches = [d for d in self.by_subreddit.get(subreddit.lower(), [])
+                   if d["created_utc"] >= oldest and words.search(d["title"] + " " + d["selftext"])]
+        limit = min(int(query.get("limit", 25)), 100)
+        start = 0
+        if query.get("after"):
+            names = [d["name"] for d in matches]
+            start = names.index(query["after"]) + 1 if query["after"] in names else len(matches)
+        page = matches[start:start + limit]
+        after = page[-1]["name"] if start + limit < len(matches) and page else None
+        return 200, {}, self._listing([{"kind": "t3", "data": d} for d in page], after)
+
+    def comments(self, method, query, body, submission_id) -> Response:
+        data = self.submissions.get(submission_id)
+        if data is None:
+            return 404, {}, {"message": "Not Found", "error": 404}
+        return 200, {}, [self._listing([{"kind": "t3", "data": data}]), self._listing(self.threads[submission_id])]
+
+
+# === Elasticsearch ===
+def _field(source: Dict, field: str):
+    if field.endswith(".keyword"):
+        field = field[:-len(".keyword")]
+    value = source
+    for part in field.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def _equals(value, wanted) -> bool:
+    if isinstance(value, list):
+        return wanted in value
+    return value == wanted or (value is not None and str(value) == str(wanted))
+
+def _matches(query: Optional[Dict], doc_id: str, source: Dict) -> bool:
+    """The subset of the query DSL the ingest paths use."""
+    if not query:
+        return True
+    kind, spec = next(iter(query.items()))
+    if kind == "match_all":
+        return True
+    if kind == "ids":
+        return doc_id in spec.get("values", [])
+    if kind == "term":
+        field, wanted = next(iter(spec.items()))
+        return _equals(_field(source, field), wanted.get("value") if isinstance(wanted, dict) else wanted)
+    if kind == "terms":
+        field, values = next(iter(spec.items()))
+        return any(_equals(_field(source, field), v) for v in values)
+    if kind == "exists":
+        return _field(source, spec["field"]) is not None
+    if kind == "range":
+        field, bounds = next(iter(spec.items()))
+        value = _field(source, field)
+        if value is None:
+            return False
+        checks = {"gt": lambda a, b: a > b, "gte": lambda a, b: a >= b, "lt": lambda a, b: a < b, "lte": lambda a, b: a <= b}
+        return all(checks[op](value, bound) for op, bound in bounds.items() if op in checks)
+    if kind == "match":
+        field, wanted = next(iter(spec.items()))
+        wanted = wanted.get("query") if isinstance(wanted, dict) else wanted
+        return str(wanted).lower() in str(_field(source, field) or "").lower()
+    if kind == "bool":
+        listify = lambda q: q if isinstance(q, list) else [q]
+        if not all(_matches(q, doc_id, source) for key in ("must", "filter") for q in listify(spec.get(key, []))):
+            return False
+        if any(_matches(q, doc_id, source) for q in listify(spec.get("must_not", []))):
+            return False
+        should = listify(spec.get("should", []))
+        return not should or any(_matches(q, doc_id, source) for q in should)
+    return True
+
+
+class FakeElasticsearch(FakeService):
+    routes = (
+        ("GET|HEAD", r"^/?$", "info"),
+        ("PUT", r"^/_index_template/([^/]+)$", "put_template"),
+        ("GET|POST|PUT", r"^/(?:([^/_][^/]*)/)?_bulk$", "bulk"),
+        ("GET|POST", r"^/(?:([^/_][^/]*)/)?_search$", "search"),
+        ("GET|POST", r"^/(?:([^/_][^/]*)/)?_count$", "count"),
+        ("GET|POST", r"^/(?:([^/_][^/]*)/)?_mget$", "mget"),
+        ("GET|POST", r"^/(?:([^/_][^/]*)/)?_refresh$", "refresh"),
+        ("POST", r"^/([^/_][^/]*)/_update/([^/]+)$", "update"),
+        ("HEAD|GET", r"^/([^/_][^/]*)/_doc/([^/]+)$", "get_doc"),
+        ("PUT|POST", r"^/([^/_][^/]*)/(?:_doc|_create)/([^/]+)$", "index_doc"),
+        ("POST", r"^/([^/_][^/]*)/_doc/?$", "index_doc"),
+        ("DELETE", r"^/([^/_][^/]*)/_doc/([^/]+)$", "delete_doc"),
+        ("HEAD|GET", r"^/([^/_][^/]*)$", "get_index"),
+        ("PUT", r"^/([^/_][^/]*)$", "create_index"),
+    )
+
+    def __init__(self, reject_rate=0.0):
+        """reject_rate: fraction of bulk items answered 429 es_rejected_execution_exception."""
+        super().__init__()
+        self.indices: Dict[str, Dict[str, Dict]] = {}
+        self.templates: Dict[str, Dict] = {}
+        self.reject_rate = reject_rate
+        self.bulk_items = 0
+        self.rejected = 0
+        self._created: Counter = Counter()
+        self._auto_id = itertools.count()
+        self._reject_every = int(1 / reject_rate) if reject_rate else 0
+
+    def headers(self) -> Dict[str, str]:
+        return {"X-Elastic-Product": "Elasticsearch"}
+
+    def created(self, exclude: Iterable[str] = ()) -> Dict[str, int]:
+        """Documents created per index family (monthly suffix dropped)."""
+        out: Counter = Counter()
+        for index, count in self._created.items():
+            family = re.sub(r"-\d{4}\.\d{2}$", "", index)
+            if not any(fnmatch.fnmatch(family, pattern) for pattern in exclude):
+                out[family] += count
+        return dict(out)
+
+    def _resolve(self, pattern: Optional[str]) -> List[str]:
+        if not pattern or pattern in ("_all", "*"):
+            return list(self.indices)
+        names = []
+        for part in pattern.split(","):
+            names.extend(name for name in self.indices if fnmatch.fnmatch(name, part))
+        return names
+
+    # --- documents ---
+    def _write(self, op, index, doc_id, payload) -> Dict:
+        docs = self.indices.setdefault(index, {})
+        if doc_id is None:
+            doc_id = f"auto{next(self._auto_id)}"
+        if self._reject_every:
+            self.bulk_items += 1
+            if self.bulk_items % self._reject_every == 0:
+                self.rejected += 1
+                return {"_index": index, "_id": doc_id, "status": 429,
+                        "error": {"type": "es_rejected_execution_exception", "reason": "queue full"}}
+        exists = doc_id in docs
+        if op == "create" and exists:
+            return {"_index": index, "_id": doc_id, "status": 409,
+                    "error": {"type": "version_conflict_engine_exception", "reason": "document already exists"}}
+        if op == "delete":
+            docs.pop(doc_id, None)
+            return {"_index": index, "_id": doc_id, "status": 200 if exists else 404, "result": "deleted" if exists else "not_found"}
+        if op == "update":
+            if not exists:
+                if "upsert" not in payload and not payload.get("doc_as_upsert"):
+                    return {"_index": index, "_id": doc_id, "status": 404,
+                            "error": {"type": "document_missing_exception", "reason": "document missing"}}
+                docs[doc_id] = dict(payload.get("upsert") or payload.get("doc") or {})
+                self._created[index] += 1
+                return {"_index": index, "_id": doc_id, "status": 201, "result": "created", "_version": 1}
+            source = docs[doc_id]
+            source.update(payload.get("doc") or {})
+            # scripts are not run; numeric params are added, the rest replaced ("+=" / "=" updates)
+            for key, value in ((payload.get("script") or {}).get("params") or {}).items():
+                if isinstance(value, (int, float)) and isinstance(source.get(key), (int, float)):
+                    source[key] += value
+                else:
+                    source[key] = value
+            return {"_index": index, "_id": doc_id, "status": 200, "result": "updated", "_version": 2}
+        docs[doc_id] = payload
+        if not exists:
+            self._created[index] += 1
+        return {"_index": index, "_id": doc_id, "status": 200 if exists else 201,
+                "result": "updated" if exists else "created", "_version": 2 if exists else 1}
+
+    def bulk(self, method, query, body, default_index) -> Response:
+        lines = [line for line in body.split(b"\n") if line.strip()]
+        items, errors = [], False
+        i = 0
+        while i < len(lines):
+            action = json.loads(lines[i])
+            op, meta = next(iter(action.items()))
+            i += 1
+            payload = None
+            if op != "delete":
+                payload = json.loads(lines[i])
+                i += 1
+            result = self._write(op, meta.get("_index", default_index), meta.get("_id"), payload)
+            errors = errors or "error" in result
+            items.append({op: result})
+        return 200, {}, {"took": 1, "errors": errors, "items": items}
+
+    def index_doc(self, method, query, body, index, doc_id=None) -> Response:
+        result = self._write("index", index, doc_id, json.loads(body or b"{}"))
+        return result["status"], {}, result
+
+    def update(self, method, query, body, index, doc_id) -> Response:
+        result = self._write("update", index, doc_id, json.loads(body or b"{}"))
+        return result["status"], {}, result
+
+    def get_doc(self, method, query, body, index, doc_id) -> Response:
+        source = self.indices.get(index, {}).get(doc_id)
+        if source is None:
+            return 404, {}, {"_index": index, "_id": doc_id, "found": False}
+        return 200, {}, {"_index": index, "_id": doc_id, "_version": 1, "found": True, "_source": source}
+
+    def delete_doc(self, method, query, body, index, doc_id) -> Response:
+        result = self._write("delete", index, doc_id, None)
+        return result["status"], {}, result
+
+    def mget(self, method, query, body, index) -> Response:
+        request = json.loads(body or b"{}")
+        wanted = request.get("docs") or [{"_index": index, "_id": i} for i in request.get("ids", [])]
+        docs = []
+        for ref in wanted:
+            name = ref.get("_index", index)
+            source = self.indices.get(name, {}).get(ref["_id"])
+            doc = {"_index": name, "_id": ref["_id"], "found": source is not None}
+            if source is not None:
+                doc["_source"] = source
+            docs.append(doc)
+        return 200, {}, {"docs": docs}
+
+    # --- search ---
+    def _hits(self, pattern, request) -> List[Tuple[str, str, Dict]]:
+        query = request.get("query")
+        hits = [(index, doc_id, source) for index in self._resolve(pattern)
+                for doc_id, source in self.indices[index].items() if _matches(query, doc_id, source)]
+        for spec in reversed(request.get("sort") or []):
+            field, order = next(iter(spec.items())) if isinstance(spec, dict) else (spec, "asc")
+            order = order.get("order", "asc") if isinstance(order, dict) else order
+            hits.sort(key=lambda h: (_field(h[2], field) is None, _field(h[2], field) or 0), reverse=order == "desc")
+        return hits
+
+    def search(self, method, query, body, pattern) -> Response:
+        if pattern and not self._resolve(pattern) and "*" not in pattern and query.get("ignore_unavailable") != "true":
+            return 404, {}, {"error": {"type": "index_not_found_exception", "reason": f"no such index [{pattern}]"}, "status": 404}
+        request = json.loads(body or b"{}")
+        hits = self._hits(pattern, request)
+        start = int(request.get("from", query.get("from", 0)))
+        size = int(request.get("size", query.get("size", 10)))
+        wanted = request.get("_source", True)
+        out = []
+        for index, doc_id, source in hits[start:start + size]:
+            hit = {"_index": index, "_id": doc_id, "_score": 1.0}
+            if wanted is True:
+                hit["_source"] = source
+            elif wanted:
+                fields = [wanted] if isinstance(wanted, str) else list(wanted)
+                hit["_source"] = {k: v for k, v in source.items() if k in fields}
+            out.append(hit)
+        return 200, {}, {"took": 1, "timed_out": False,
+                         "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+                         "hits": {"total": {"value": len(hits), "relation": "eq"}, "max_score": 1.0, "hits": out}}
+
+    def count(self, method, query, body, pattern) -> Response:
+        return 200, {}, {"count": len(self._hits(pattern, json.loads(body or b"{}")))}
+
+    # --- indices ---
+    def info(self, method, query, body) -> Response:
+        return 200, {}, {"name": "fake", "cluster_name": "benchmark", "version": {"number": "8.17.1"},
+                         "tagline": "You Know, for Search"}
+
+    def put_template(self, method, query, body, name) -> Response:
+        self.templates[name] = json.loads(body or b"{}")
+        return 200, {}, {"acknowledged": True}
+
+    def get_index(self, method, query, body, pattern) -> Response:
+        names = self._resolve(pattern)
+        if not names:
+            return 404, {}, {"error": {"type": "index_not_found_exception"}, "status": 404}
+        return 200, {}, {name: {"aliases": {}, "mappings": {}, "settings": {}} for name in names}
+
+    def create_index(self, method, query, body, index) -> Response:
+        if index in self.indices:
+            return 400, {}, {"error": {"type": "resource_already_exists_exception"}, "status": 400}
+        self.indices[index] = {}
+        return 200, {}, {"acknowledged": True, "shards_acknowledged": True, "index": index}
+
+    def refresh(self, method, query, body, pattern) -> Response:
+        return 200, {}, {"_shards": {"total": 1, "successful": 1, "failed": 0}}
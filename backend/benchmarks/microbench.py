@@ -0,0 +1,335 @@
+# COMP90024 Team 75
+# Linying Wei (1638206)
+# Wangyang Wu (1641248)
+# Ziyu Wang (1560831)
+# Roger Zhang (1079986)
+
+"""
+    Microbenchmarks of the per-document hot paths, over fixed corpora
+      clean_content / analyze_sentiment   PushiftConversion and fission/mastodon/test1.py
+      clean_text                          processor/upload_to_es.py
+      infer_state / classify_state        common.geo as bulk_insert_to_es.py (whole column)
+                                          and the harvesters (one document) call it
+      read_lines_zst                      PushiftConversion, over a synthetic archive
+      keyword checks                      KeyWordsPresenceIn* and the raw-line KeywordPrefilter
+      merge loop                          processor/main.py Merger.poll over a fresh data/ tree
+    Corpora: backend/utils/reddit-sydney-comments.ndjson, data/mastodon/AU-ACT/posts.json
+    (and comments.json for the merge) and a zst archive of the Reddit lines.
+    Reported per benchmark: ns/doc (best of --repeat runs) and the bytes each document
+    allocates (mean tracemalloc peak per call, divided over the documents of the call).
+    Results are compared with the committed baselines/microbench.json; a benchmark slower
+    or allocating more than --threshold over the baseline fails the run (exit status 1).
+    Benchmarks whose module cannot be imported here (e.g. without bertopic) are reported
+    as skipped.
+
+    python benchmarks/microbench.py --save-baseline          # on the base commit
+    python benchmarks/microbench.py --threshold 0.15         # on the change
+    python benchmarks/microbench.py --only clean_content keyword
+"""
+
+import argparse
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import zstandard
+
+from end_to_end import BACKEND, BASE_DIR, MASTODON_SEED, fake_configs, load_module
+
+REDDIT_CORPUS = os.path.join(BACKEND, "utils", "reddit-sydney-comments.ndjson")
+# Committed (results/ is git-ignored); refresh it with --save-baseline when a change is meant to move it
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "microbench.json")
+
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.join(BACKEND, "utils"))
+
+# A benchmark setup returns (calls, fn, docs): fn(call) for every call is timed, and the
+# total is normalised over docs documents. Setups run again before every repeat.
+Setup = Callable[[], Tuple[Iterable, Callable, int]]
+
+
+# === corpora ===
+def reddit_docs() -> List[Dict]:
+    with open(REDDIT_CORPUS, encoding="utf-8") as f:
+        return [json.loads(line)["_source"] for line in f if line.strip()]
+
+def mastodon_posts() -> List[Dict]:
+    with open(os.path.join(MASTODON_SEED, "posts.json"), encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def synthetic_zst(path: str, size_mb: int) -> int:
+    # The Reddit corpus lines repeated up to size_mb of decompressed data
+    with open(REDDIT_CORPUS, "rb") as f:
+        lines = [line if line.endswith(b"\n") else line + b"\n" for line in f if line.strip()]
+    target, written, count = size_mb * 2**20, 0, 0
+    with open(path, "wb") as f, zstandard.ZstdCompressor().stream_writer(f) as out:
+        while written < target:
+            for line in lines:
+                out.write(line)
+                written += len(line)
+                count += 1
+                if written >= target:
+                    break
+    return count
+
+def as_submission(doc: Dict) -> Dict:
+    title, _, text = doc["content"].partition(". ")
+    return {"title": title, "selftext": text, "selftext_html": text}
+
+
+# === benchmarks ===
+def per_doc(docs: List, fn: Callable) -> Setup:
+    return lambda: (docs, fn, len(docs))
+
+def pushshift():
+    import PushiftConversion
+    return PushiftConversion
+
+def test1():
+    # test1 builds its (unused here) Elasticsearch client on import
+    with fake_configs(), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return load_module("test1", os.path.join(BACKEND, "fission", "mastodon", "test1.py"))
+
+def upload_to_es():
+    sys.path.insert(0, os.path.join(BACKEND, "processor"))
+    import upload_to_es
+    return upload_to_es
+
+def processor_main():
+    sys.path.insert(0, os.path.join(BACKEND, "processor"))
+    return load_module("processor_main", os.path.join(BACKEND, "processor", "main.py"))
+
+def bench_clean_content(module):
+    html = [p["content"] for p in mastodon_posts()]
+    return per_doc(html, module().clean_content)
+
+def bench_analyze_sentiment(module):
+    conversion = pushshift()
+    texts = [conversion.clean_content(p["content"]) for p in mastodon_posts()]
+    return per_doc(texts, module().analyze_sentiment)
+
+def bench_clean_text():
+    return per_doc([d["content"] for d in reddit_docs()], upload_to_es().clean_text)
+
+def bench_infer_state():
+    # bulk_insert_to_es.infer_state runs its whole pipeline on import; this is its body
+    import pandas as pd
+    from common.geo import UNKNOWN, classify_states
+    docs = reddit_docs()
+    titles = pd.Series([d["content"][:300] for d in docs])
+    urls = pd.Series([f"https://www.reddit.com/r/{d.get('tags') or 'sydney'}/comments/{d['post_id']}/" for d in docs])
+
+    def subreddit_from_url(url):
+        parts = url.split("/")
+        return parts[4] if len(parts) > 4 and parts[3].lower() == "r" else None
+
+    def infer_state(_):
+        states = classify_states(titles.astype(str), subreddits=urls.map(subreddit_from_url))
+        return ["" if state == UNKNOWN else state for state in states]
+    return lambda: ([None], infer_state, len(docs))
+
+def bench_classify_state():
+    from common.geo import account_instance, classify_state
+    posts = [(p["content"], account_instance(p["author"], "aus.social")) for p in mastodon_posts()]
+    return per_doc(posts, lambda post: classify_state(post[0], instance=post[1]))
+
+def bench_read_lines_zst(path, lines):
+    conversion = pushshift()
+
+    def setup():
+        lines_iter = conversion.read_lines_zst(path)
+        return range(lines), lambda _: next(lines_iter), lines
+    return setup
+
+def bench_keywords_submission():
+    conversion = pushshift()
+    submissions = [as_submission(d) for d in reddit_docs()]
+    return per_doc(submissions, lambda s: conversion.KeyWordsPresenceInSubmission(s, conversion.KEYWORDS))
+
+def bench_keywords_comment():
+    conversion = pushshift()
+    comments = [{"body": d["content"]} for d in reddit_docs()]
+    return per_doc(comments, lambda c: conversion.KeyWordsPresenceInComment(c, conversion.KEYWORDS))
+
+def bench_keyword_prefilter():
+    conversion = pushshift()
+    prefilter = conversion.get_prefilter("comments", conversion.KEYWORDS)
+    lines = [json.dumps({"id": d["post_id"], "body": d["content"], "parent_id": "t3_" + d["post_id"]}).encode("utf-8")
+             for d in reddit_docs()]
+    return per_doc(lines, prefilter)
+
+def bench_merge_loop(workdir):
+    main = processor_main()
+    sources = [os.path.join(MASTODON_SEED, name) for name in ("posts.json", "comments.json")]
+    docs = 0
+    for path in sources:
+        with open(path, "rb") as f:
+            docs += sum(1 for line in f if line.strip())
+
+    def setup():
+        # A fresh data/ tree and database/ per repeat, so every poll merges everything
+        shutil.rmtree(workdir, ignore_errors=True)
+        data = os.path.join(workdir, "data", "mastodon", "AU-ACT")
+        os.makedirs(data)
+        os.makedirs(os.path.join(workdir, "database"))
+        for path in sources:
+            shutil.copy(path, data)
+        main.SOURCE_GLOBS = {kind: os.path.join(workdir, "data", "**", f"{kind}.json") for kind in ("posts", "comments")}
+        main.POSTS_JSON = os.path.join(workdir, "database", "posts.json")
+        main.COMMENTS_JSON = os.path.join(workdir, "database", "comments.json")
+        merger = main.Merger(queue.Queue(), manifest_path=os.path.join(workdir, "database", "merge-manifest.json"))
+        return [None], lambda _: merger.poll(), docs
+    return setup
+
+def benchmarks(workdir, zst_mb) -> Dict[str, Callable[[], Setup]]:
+    zst_path = os.path.join(workdir, "corpus.zst")
+    return {
+        "clean_content[pushshift]": lambda: bench_clean_content(pushshift),
+        "clean_content[test1]": lambda: bench_clean_content(test1),
+        "analyze_sentiment[pushshift]": lambda: bench_analyze_sentiment(pushshift),
+        "analyze_sentiment[test1]": lambda: bench_analyze_sentiment(test1),
+        "clean_text[upload_to_es]": bench_clean_text,
+        "infer_state[column]": bench_infer_state,
+        "classify_state[doc]": bench_classify_state,
+        "read_lines_zst": lambda: bench_read_lines_zst(zst_path, synthetic_zst(zst_path, zst_mb)),
+        "keywords[submission]": bench_keywords_submission,
+        "keywords[comment]": bench_keywords_comment,
+        "keywords[prefilter]": bench_keyword_prefilter,
+        "merge_loop": lambda: bench_merge_loop(os.path.join(workdir, "merge")),
+    }
+
+
+# === measurement ===
+def time_run(setup: Setup) -> float:
+    calls, fn, docs = setup()
+    started = time.perf_counter_ns()
+    for call in calls:
+        fn(call)
+    return (time.perf_counter_ns() - started) / docs
+
+def alloc_run(setup: Setup) -> float:
+    # Peak traced memory above the starting point of each call, summed over the documents
+    calls, fn, docs = setup()
+    total = 0
+    tracemalloc.start()
+    try:
+        for call in calls:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            fn(call)
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return total / docs
+
+def measure(name: str, make: Callable[[], Setup], repeat: int, allocations: bool) -> Dict:
+    try:
+        setup = make()
+    except ImportError as e:
+        return {"skipped": f"{type(e).__name__}: {e}"}
+    docs = setup()[2]
+    time_run(setup)   # warm-up: lazy imports, regex compilation, classifier tables
+    ns = min(time_run(setup) for _ in range(repeat))
+    result = {"docs": docs, "ns_per_doc": ns}
+    if allocations:
+        result["alloc_bytes_per_doc"] = alloc_run(setup)
+    return result
+
+
+# === baselines ===
+def regressions(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    out = []
+    for name, r in results.items():
+        before = baseline.get("benchmarks", {}).get(name)
+        if not before or "skipped" in r or "skipped" in before:
+            continue
+        for key in ("ns_per_doc", "alloc_bytes_per_doc"):
+            if before.get(key) and r.get(key) is not None and r[key] > before[key] * (1 + threshold):
+                out.append(f"{name}: {key} {before[key]:,.0f} → {r[key]:,.0f} ({r[key] / before[key] - 1:+.1%})")
+    return out
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_result(name, r, before=None):
+    if "skipped" in r:
+        print(f"{name:<30} skipped ({r['skipped']})")
+        return
+    line = f"{name:<30} {r['docs']:>7,} docs  {r['ns_per_doc']:>12,.0f} ns/doc"
+    if "alloc_bytes_per_doc" in r:
+        line += f"  {r['alloc_bytes_per_doc']:>10,.0f} B/doc"
+    if before and before.get("ns_per_doc"):
+        line += f"  ({r['ns_per_doc'] / before['ns_per_doc'] - 1:+.1%} time"
+        if before.get("alloc_bytes_per_doc") and "alloc_bytes_per_doc" in r:
+            line += f", {r['alloc_bytes_per_doc'] / before['alloc_bytes_per_doc'] - 1:+.1%} allocations"
+        line += ")"
+    print(line)
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Per-document hot path microbenchmarks")
+    p.add_argument("--only", nargs="+", help="Run the benchmarks whose name contains any of these")
+    p.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark; the best is kept (default: 5)")
+    p.add_argument("--zst-mb", type=int, default=16, help="Decompressed size of the synthetic archive (default: 16)")
+    p.add_argument("--no-alloc", action="store_true", help="Skip the (slower) allocation pass")
+    p.add_argument("--baseline", default=DEFAULT_BASELINE, help=f"Baseline JSON (default: {DEFAULT_BASELINE})")
+    p.add_argument("--save-baseline", action="store_true", help="Write these results as the baseline")
+    p.add_argument("--threshold", type=float, default=0.10,
+                   help="Fail when ns/doc or bytes/doc exceed the baseline by more than this fraction (default: 0.10)")
+    p.add_argument("--output", help="Also write the results JSON here")
+    return p.parse_args()
+
+def main():
+    args = parse_args()
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("python") != sys.version.split()[0]:
+            print(f"[Warn] baseline was recorded on Python {baseline.get('python')}")
+
+    workdir = tempfile.mkdtemp(prefix="microbench-")
+    results = {}
+    try:
+        for name, make in benchmarks(workdir, args.zst_mb).items():
+            if args.only and not any(part in name for part in args.only):
+                continue
+            results[name] = measure(name, make, args.repeat, not args.no_alloc)
+            print_result(name, results[name], baseline.get("benchmarks", {}).get(name))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"timestamp": datetime.now(timezone.utc).isoformat(), "commit": git_commit(),
+              "python": sys.version.split()[0], "repeat": args.repeat, "zst_mb": args.zst_mb,
+              "benchmarks": results}
+    for path in [args.output] + ([args.baseline] if args.save_baseline else []):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"Results written to {path}")
+
+    if baseline:
+        failed = regressions(results, baseline, args.threshold)
+        if failed:
+            print(f"\n{len(failed)} regression(s) over {args.threshold:.0%} against {args.baseline} ({baseline.get('commit')}):")
+            for line in failed:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions over {args.threshold:.0%} against {args.baseline} ({baseline.get('commit')})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# COMP90024 Team 75
+# Linying Wei (1638206)
+# Wangyang Wu (1641248)
+# Ziyu Wang (1560831)
+# Roger Zhang (1079986)
+
+"""
+    Keyword filtering cost on a Pushshift archive: json.loads on every line versus the
+    raw-byte prefilter in front of it. Also checks both paths select the same lines.
+
+    python benchmarks/pushshift_prefilter.py --archive AusFinance_comments.zst --kind comments
+    python benchmarks/pushshift_prefilter.py            # synthetic sample archive
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import zstandard
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "utils")))
+from PushiftConversion import (KEYWORDS, KeyWordsPresenceInComment, KeyWordsPresenceInSubmission,
+                               get_prefilter, read_lines_zst)
+
+WORDS = "the market prices interest bank super tax shares property loan budget income cost".split()
+
+def synthetic_archive(path: str, kind: str, lines: int, match_rate: float = 0.04):
+    rng = random.Random(75)
+    with open(path, "wb") as f, zstandard.ZstdCompressor().stream_writer(f) as out:
+        for i in range(lines):
+            text = " ".join(rng.choice(WORDS) for _ in range(40))
+            if rng.random() < match_rate:
+                text += " " + rng.choice(KEYWORDS)
+            record = {"id": f"x{i}", "author": "someone", "created_utc": 1700000000 + i,
+                      "subreddit": "AusFinance", "score": rng.randint(0, 50), "parent_id": "t3_abc"}
+            # real dumps carry ~50 more fields per record
+            record.update({f"field_{n}": rng.choice([None, True, n, "t2_" + str(n), [], {}]) for n in range(50)})
+            if kind == "submissions":
+                record.update(title=text[:60], selftext=text, selftext_html=f"<p>{text}</p>")
+            else:
+                record.update(body=text, link_id="t3_abc")
+            out.write((json.dumps(record) + "\n").encode("utf-8"))
+
+def full_parse(lines, kind):
+    check = KeyWordsPresenceInSubmission if kind == "submissions" else KeyWordsPresenceInComment
+    selected = []
+    for i, line in enumerate(lines):
+        try:
+            if check(json.loads(line), KEYWORDS):
+                selected.append(i)
+        except (KeyError, ValueError, TypeError):
+            pass
+    return selected
+
+def prefiltered(lines, kind):
+    check = KeyWordsPresenceInSubmission if kind == "submissions" else KeyWordsPresenceInComment
+    matcher = get_prefilter(kind, KEYWORDS)
+    selected = []
+    for i, line in enumerate(lines):
+        if not matcher(line):
+            continue
+        try:
+            if check(json.loads(line), KEYWORDS):
+                selected.append(i)
+        except (KeyError, ValueError, TypeError):
+            pass
+    return selected
+
+def timed(func, *args, repeat=3):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark the raw-byte keyword prefilter")
+    p.add_argument("--archive", help="Pushshift .zst archive (default: generate a synthetic one)")
+    p.add_argument("--kind", choices=["submissions", "comments"], default="comments")
+    p.add_argument("--limit", type=int, default=200000, help="Lines to benchmark (default: 200000)")
+    args = p.parse_args()
+
+    archive = args.archive
+    if archive is None:
+        archive = os.path.join(tempfile.mkdtemp(), f"sample_{args.kind}.zst")
+        synthetic_archive(archive, args.kind, args.limit)
+
+    lines = []
+    for line, _, _ in read_lines_zst(archive):
+        lines.append(line)
+        if len(lines) >= args.limit:
+            break
+
+    full_time, full_selected = timed(full_parse, lines, args.kind)
+    pre_time, pre_selected = timed(prefiltered, lines, args.kind)
+    candidates = sum(1 for line in lines if get_prefilter(args.kind, KEYWORDS)(line))
+
+    print(f"lines: {len(lines):,}  matches: {len(full_selected):,}  prefilter candidates: {candidates:,}")
+    print(f"json.loads every line : {full_time:.3f}s ({full_time / len(lines) * 1e6:.2f} us/line)")
+    print(f"raw-byte prefilter    : {pre_time:.3f}s ({pre_time / len(lines) * 1e6:.2f} us/line)")
+    print(f"speed-up              : {full_time / pre_time:.1f}x")
+    print(f"same selection        : {full_selected == pre_selected}")
+    if full_selected != pre_selected:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
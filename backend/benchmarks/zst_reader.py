@@ -0,0 +1,113 @@
+# COMP90024 Team 75
+# Linying Wei (1638206)
+# Wangyang Wu (1641248)
+# Ziyu Wang (1560831)
+# Roger Zhang (1079986)
+
+"""
+    Throughput and peak memory of the zst line readers: the previous 128 MiB chunk /
+    decode-and-split reader (copied below as legacy_read_lines_zst) versus ZstLineReader.
+    Both must yield the same lines.
+
+    python benchmarks/zst_reader.py --archive AusFinance_comments.zst
+    python benchmarks/zst_reader.py --size-mb 512      # synthetic archive
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import zstandard
+
+from pushshift_prefilter import WORDS
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "utils")))
+from PushiftConversion import ZstLineReader
+
+def legacy_read_and_decode(reader, chunk_size, max_window_size, previous_chunk=None, bytes_read=0):
+    chunk = reader.read(chunk_size)
+    bytes_read += chunk_size
+    if previous_chunk is not None:
+        chunk = previous_chunk + chunk
+    try:
+        return chunk.decode()
+    except UnicodeDecodeError:
+        if bytes_read > max_window_size:
+            raise UnicodeError(f"Unable to decode frame after reading {bytes_read:,} bytes")
+        return legacy_read_and_decode(reader, chunk_size, max_window_size, chunk, bytes_read)
+
+def legacy_read_lines_zst(file_name):
+    with open(file_name, 'rb') as file_handle:
+        buffer = ''
+        reader = zstandard.ZstdDecompressor(max_window_size=2**31).stream_reader(file_handle)
+        while True:
+            chunk = legacy_read_and_decode(reader, 2**27, (2**29) * 2)
+            if not chunk:
+                break
+            lines = (buffer + chunk).split("\n")
+            for line in lines[:-1]:
+                yield line, file_handle.tell()
+            buffer = lines[-1]
+        reader.close()
+
+def synthetic_archive(path: str, size_mb: int):
+    line = ('{"id":"%d","body":"' + " ".join(WORDS * 20) + ' café — rent","created_utc":1700000000}\n')
+    target = size_mb * 2**20
+    written = 0
+    with open(path, "wb") as f, zstandard.ZstdCompressor().stream_writer(f) as out:
+        i = 0
+        while written < target:
+            data = (line % i).encode("utf-8")
+            out.write(data)
+            written += len(data)
+            i += 1
+
+def consume(lines, encode):
+    digest = hashlib.md5()
+    count = 0
+    for line in lines:
+        digest.update(encode(line[0]))
+        count += 1
+    return count, digest.hexdigest()
+
+def run(name, make_lines, encode):
+    start = time.perf_counter()
+    count, digest = consume(make_lines(), encode)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    consume(make_lines(), encode)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"name": name, "lines": count, "digest": digest, "seconds": elapsed, "peak": peak}
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark the zst line readers")
+    p.add_argument("--archive", help="zst archive (default: generate a synthetic one)")
+    p.add_argument("--size-mb", type=int, default=384, help="Decompressed size of the synthetic archive (default: 384)")
+    p.add_argument("--read-size", type=int, default=2**20, help="ZstLineReader read size (default: 1 MiB)")
+    args = p.parse_args()
+
+    archive = args.archive
+    if archive is None:
+        archive = os.path.join(tempfile.mkdtemp(), "sample.zst")
+        synthetic_archive(archive, args.size_mb)
+
+    results = [
+        run("legacy (128 MiB chunks)", lambda: legacy_read_lines_zst(archive), lambda line: line.encode("utf-8")),
+        run(f"ZstLineReader ({args.read_size // 1024} KiB reads)", lambda: iter(ZstLineReader(archive, read_size=args.read_size)), lambda line: line),
+    ]
+    for r in results:
+        print(f"{r['name']:<30}: {r['lines']:,} lines  {r['seconds']:.2f}s  {r['lines'] / r['seconds']:,.0f} lines/s  "
+              f"peak {r['peak'] / 2**20:,.1f} MiB")
+    same = results[0]["lines"] == results[1]["lines"] and results[0]["digest"] == results[1]["digest"]
+    print(f"same lines: {same}")
+    if not same:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
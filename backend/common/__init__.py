@@ -0,0 +1,11 @@
+# COMP90024 Team 75
+# Linying Wei (1638206)
+# Wangyang Wu (1641248)
+# Ziyu Wang (1560831)
+# Roger Zhang (1079986)
+
+"""
+Helpers shared by the harvesters, the Fission functions and the local processors.
+Package this directory next to the entry script (as `common/`) when zipping a
+Fission function or building a harvester image.
+"""
@@ -0,0 +1,293 @@
+# COMP90024 Team 75
+# Linying Wei (1638206)
+# Wangyang Wu (1641248)
+# Ziyu Wang (1560831)
+# Roger Zhang (1079986)
+
+"""
+    Near-duplicate detection (MinHash + LSH) ahead of enrichment
+    Boosts, cross-posts and copy-pasted comments are recognised from their text: every
+    document is reduced to a MinHash signature over word shingles, and the signature is
+    split into LSH bands. A document sharing a band with an earlier one whose estimated
+    Jaccard similarity is at least threshold is a duplicate: it reuses the enrichment
+    (sentiment, ...) of that canonical document instead of computing it again, gets a
+    duplicate_of reference and, with reference_only, is indexed without its content.
+    The band index is an LRU bounded to max_docs documents per process; with a Redis
+    client the bands and canonical enrichment are also shared across pods (keys expire
+    after ttl seconds). Hashing is seeded, so every process computes the same bands.
+
+    dedup = Deduplicator("housing-comments", redis=redis_client)
+    fields, canonical = dedup.enrich(comment_id, cleaned_text, sentiment_fields)
+    source.update(fields)
+    dedup.link(source, canonical)
+    print(dedup.summary())      # hit rate and enrichment CPU saved
+
+    Callers with nothing to enrich only link copies: canonical = dedup.canonical(doc_id, text)
+"""
+
+import hashlib
+import json
+import re
+import time
+import zlib
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+SEED = 90024
+KEY_PREFIX = "dedup"
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_URL_RE = re.compile(r"https?://\S+")
+_WORD_RE = re.compile(r"\w+")
+
+
+def words(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return _WORD_RE.findall(_URL_RE.sub(" ", _TAG_RE.sub(" ", text)).lower())
+
+
+class MinHasher:
+    """Signatures of num_perm 32-bit minimums under seeded multiply-shift hashes of the
+    shingle CRCs (h(x) = (a * x + b) mod 2^64 >> 32, a odd)."""
+
+    def __init__(self, num_perm=128, shingle=3, seed=SEED):
+        self.num_perm = num_perm
+        self.shingle = shingle
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 2**63, num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+
+    def shingles(self, tokens: List[str]) -> np.ndarray:
+        k = self.shingle
+        grams = {" ".join(tokens[i:i + k]) for i in range(max(len(tokens) - k + 1, 1))}
+        return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+    def signature(self, tokens: List[str]) -> np.ndarray:
+        hashes = self.shingles(tokens)
+        # uint64 arithmetic wraps, which is the mod 2^64 of the hash family
+        mixed = (np.outer(self.a, hashes) + self.b[:, None]) >> np.uint64(32)
+        return mixed.min(axis=1).astype(np.uint32)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    # Estimated Jaccard similarity of the two shingle sets
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+class Deduplicator:
+    def __init__(self, namespace, threshold=0.8, num_perm=128, bands=16, shingle=3, min_words=6,
+                 max_docs=100000, redis=None, ttl=7 * 86400, reference_only=False):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.namespace = namespace
+        self.threshold = threshold
+        self.bands = bands
+        self.min_words = min_words
+        self.max_docs = max_docs
+        self.redis = redis
+        self.ttl = ttl
+        self.reference_only = reference_only
+        self.hasher = MinHasher(num_perm, shingle)
+
+        # doc id -> (signature, enrichment), least recently used first
+        self._docs: "OrderedDict[str, Tuple[np.ndarray, Dict]]" = OrderedDict()
+        # band key -> doc id
+        self._bands: Dict[str, str] = {}
+        self.stats: Counter = Counter()
+
+    # === signatures and bands ===
+    def signature(self, text: Optional[str]) -> Optional[np.ndarray]:
+        """None for texts too short to tell a copy from a common phrase ("thanks!")."""
+        tokens = words(text)
+        if len(tokens) < self.min_words:
+            return None
+        return self.hasher.signature(tokens)
+
+    def band_keys(self, signature: np.ndarray) -> List[str]:
+        rows = signature.reshape(self.bands, -1)
+        return [f"{band}:{hashlib.blake2b(row.tobytes(), digest_size=8).hexdigest()}"
+                for band, row in enumerate(rows)]
+
+    def _redis_key(self, kind, key) -> str:
+        return f"{KEY_PREFIX}:{self.namespace}:{kind}:{key}"
+
+    # === index ===
+    def _remember(self, doc_id, signature, keys, enrichment):
+        self._docs[doc_id] = (signature, enrichment)
+        self._docs.move_to_end(doc_id)
+        for key in keys:
+            self._bands.setdefault(key, doc_id)
+        while len(self._docs) > self.max_docs:
+            old_id, (old_signature, _) = self._docs.popitem(last=False)
+            for key in self.band_keys(old_signature):
+                if self._bands.get(key) == old_id:
+                    del self._bands[key]
+            self.stats["evicted"] += 1
+
+    def _redis_failed(self, e):
+        self.stats["redis_errors"] += 1
+        if self.stats["redis_errors"] == 1:
+            print(f"[Dedup] Redis unavailable, using the in-process index only: {e}")
+
+    def _candidates_from_redis(self, keys, checked) -> Dict[str, Tuple[np.ndarray, Dict]]:
+        try:
+            ids = self.redis.mget([self._redis_key("band", key) for key in keys])
+            ids = list(dict.fromkeys(i for i in ids if i and i not in checked))
+            if not ids:
+                return {}
+            docs = self.redis.mget([self._redis_key("doc", i) for i in ids])
+        except Exception as e:
+            self._redis_failed(e)
+            return {}
+        found = {}
+        for doc_id, raw in zip(ids, docs):
+            if raw:
+                doc = json.loads(raw)
+                found[doc_id] = (np.frombuffer(bytes.fromhex(doc["signature"]), dtype=np.uint32), doc["enrichment"])
+        return found
+
+    def find(self, doc_id, signature, keys) -> Optional[Tuple[str, Dict]]:
+        """(canonical id, enrichment) of the best earlier document at threshold or above.
+        A document seen before under the same id gets (doc_id, its own enrichment) back;
+        it is never a candidate for itself."""
+        if doc_id in self._docs:
+            self._docs.move_to_end(doc_id)
+            return doc_id, self._docs[doc_id][1]
+        candidates = {}
+        for key in keys:
+            other = self._bands.get(key)
+            if other is not None and other != doc_id and other in self._docs:
+                candidates[other] = self._docs[other]
+        best = self._best(signature, candidates)
+        if best is None and self.redis is not None:
+            remote = self._candidates_from_redis(keys, {**candidates, doc_id: None})
+            best = self._best(signature, remote)
+            if best is not None:
+                self.stats["redis_hits"] += 1
+                canonical = best[0]
+                self._remember(canonical, remote[canonical][0], self.band_keys(remote[canonical][0]), best[1])
+        return best
+
+    def _best(self, signature, candidates) -> Optional[Tuple[str, Dict]]:
+        best, best_score = None, self.threshold
+        for other, (other_signature, enrichment) in candidates.items():
+            score = similarity(signature, other_signature)
+            if score >= best_score:
+                best, best_score = (other, enrichment), score
+        return best
+
+    def register(self, doc_id, signature, keys, enrichment: Dict):
+        self._remember(doc_id, signature, keys, enrichment)
+        if self.redis is None:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for key in keys:
+                # first writer of a band stays canonical across pods
+                pipe.set(self._redis_key("band", key), doc_id, nx=True, ex=self.ttl)
+            pipe.set(self._redis_key("doc", doc_id), json.dumps(
+                {"signature": signature.tobytes().hex(), "enrichment": enrichment}), ex=self.ttl)
+            pipe.execute()
+        except Exception as e:
+            self._redis_failed(e)
+
+    # === enrichment ===
+    def _compute(self, text, compute: Callable[[str], Dict]) -> Dict:
+        started = time.process_time()
+        enrichment = compute(text)
+        self.stats["computed"] += 1
+        self.stats["compute_seconds"] += time.process_time() - started
+        return enrichment
+
+    def _match(self, doc_id, text: Optional[str]):
+        self.stats["docs"] += 1
+        started = time.process_time()
+        signature = self.signature(text)
+        keys, match = None, None
+        if signature is not None:
+            keys = self.band_keys(signature)
+            match = self.find(doc_id, signature, keys)
+        else:
+            self.stats["short"] += 1
+        self.stats["dedup_seconds"] += time.process_time() - started
+        if match is not None:
+            # a re-seen id reuses its own entry but is not a near-duplicate
+            self.stats["hits" if match[0] != doc_id else "reseen"] += 1
+        return signature, keys, match
+
+    def enrich(self, doc_id, text: Optional[str], compute: Callable[[str], Dict]) -> Tuple[Dict, Optional[str]]:
+        """(enrichment, canonical id) for a document. compute(text) -> fields runs only when
+        no near-duplicate is indexed; canonical is None unless the document is a copy of another."""
+        doc_id = str(doc_id)
+        signature, keys, match = self._match(doc_id, text)
+        if signature is None:
+            return self._compute(text, compute), None
+        if match is not None:
+            canonical, enrichment = match
+            return dict(enrichment), (canonical if canonical != doc_id else None)
+        enrichment = self._compute(text, compute)
+        self.register(doc_id, signature, keys, enrichment)
+        return enrichment, None
+
+    def canonical(self, doc_id, text: Optional[str]) -> Optional[str]:
+        """Canonical id only, for callers with no enrichment to reuse (no CPU saving is reported)."""
+        doc_id = str(doc_id)
+        signature, keys, match = self._match(doc_id, text)
+        if match is not None:
+            return match[0] if match[0] != doc_id else None
+        if signature is not None:
+            self.register(doc_id, signature, keys, {})
+        return None
+
+    def link(self, source: Dict, canonical: Optional[str], field="content") -> Dict:
+        """Point a duplicate's document at its canonical one (dropping its content with reference_only)."""
+        if canonical is None:
+            return source
+        source["duplicate_of"] = canonical
+        self.stats["linked"] += 1
+        if self.reference_only and source.get(field):
+            self.stats["bytes_saved"] += len(source[field].encode("utf-8"))
+            del source[field]
+        return source
+
+    # === reporting ===
+    def report(self) -> Dict:
+        docs = self.stats["docs"]
+        computed = self.stats["computed"]
+        report = {
+            "namespace": self.namespace,
+            "docs": docs,
+            "hits": self.stats["hits"],
+            "hit_rate": self.stats["hits"] / docs if docs else 0.0,
+            "redis_hits": self.stats["redis_hits"],
+            "linked": self.stats["linked"],
+            "reseen": self.stats["reseen"],
+            "short": self.stats["short"],
+            "indexed": len(self._docs),
+            "evicted": self.stats["evicted"],
+            "dedup_cpu_seconds": self.stats["dedup_seconds"],
+            "bytes_saved": self.stats["bytes_saved"],
+        }
+        # CPU saved only means something when enrich() ran a real computation to reuse
+        if computed:
+            saved = self.stats["hits"] * self.stats["compute_seconds"] / computed
+            report["cpu_saved_seconds"] = saved
+            report["net_cpu_saved_seconds"] = saved - self.stats["dedup_seconds"]
+        return report
+
+    def summary(self) -> str:
+        r = self.report()
+        saved = (f"enrichment CPU saved {r['cpu_saved_seconds']:.2f}s for "
+                 if "cpu_saved_seconds" in r else "")
+        return (f"[Dedup] {r['namespace']}: {r['hits']:,}/{r['docs']:,} near-duplicates ({r['hit_rate']:.1%}, "
+                f"{r['redis_hits']:,} via Redis), {saved}{r['dedup_cpu_seconds']:.2f}s of hashing, "
+                f"{r['bytes_saved']:,} content bytes not indexed")
+
+def enrich_once(dedup: Optional[Deduplicator], doc_id, text, compute: Callable[[str], Dict]) -> Tuple[Dict, Optional[str]]:
+    # Callers with deduplication switched off skip straight to compute
+    if dedup is None:
+        return compute(text), None
+    return dedup.enrich(doc_id, text, compute)
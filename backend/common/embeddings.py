@@ -0,0 +1,216 @@
+# COMP90024 Team 75
+# Linying Wei (1638206)
+# Wangyang Wu (1641248)
+# Ziyu Wang (1560831)
+# Roger Zhang (1079986)
+
+"""
+    Persistent sentence-embedding cache for topic modelling
+    Embeddings are stored once per distinct text, keyed by a 64-bit content hash:
+    <path>.f16 is a row-major float16 matrix opened with np.memmap, <path>.keys holds the
+    hash of each row and <path>.json the model name, dimension and committed row count.
+    A run hashes its corpus, looks the hashes up in a sorted copy of the keys and only
+    sends unseen texts to sentence-transformers, then hands the full matrix to BERTopic.
+    Keys added during a run go to a small sorted delta that is merged into the sorted
+    copy once it outgrows a fraction of it, so a write costs O(batch), not O(store).
+    Rows are appended before the row count is committed, so a crash mid-run leaves
+    the store at its last committed size.
+
+    store = EmbeddingStore("database/embeddings/all-MiniLM-L6-v2")
+    embeddings = store.embed(texts, batch_size=64, threads=8)
+    topics, _ = BERTopic(embedding_model=store.model_name).fit_transform(texts, embeddings)
+"""
+
+import hashlib
+import json
+import os
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+DEFAULT_MODEL = "all-MiniLM-L6-v2"   # BERTopic's default English model
+DELTA_MIN = 4096                     # delta keys always allowed before a merge
+DELTA_FRACTION = 8                   # ... or 1/DELTA_FRACTION of the sorted keys
+
+
+def text_key(text: str) -> int:
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+class EmbeddingStore:
+    def __init__(self, path, model_name=DEFAULT_MODEL, dim: Optional[int] = None):
+        self.path = path
+        self.model_name = model_name
+        self.dim = dim
+        self.rows = 0
+        self._model = None
+        self._matrix = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+            if meta["model"] != model_name:
+                raise ValueError(f"{path} holds {meta['model']} embeddings, not {model_name}")
+            self.dim = meta["dim"]
+            self.rows = meta["rows"]
+            self._truncate()
+        self._load_keys()
+
+    @property
+    def _meta_path(self):
+        return self.path + ".json"
+
+    @property
+    def _vectors_path(self):
+        return self.path + ".f16"
+
+    @property
+    def _keys_path(self):
+        return self.path + ".keys"
+
+    def _truncate(self):
+        # Drop rows appended after the last commit
+        for path, width in ((self._vectors_path, 2 * self.dim), (self._keys_path, 8)):
+            if os.path.exists(path) and os.path.getsize(path) > self.rows * width:
+                with open(path, "r+b") as f:
+                    f.truncate(self.rows * width)
+
+    def _load_keys(self):
+        if self.rows:
+            keys = np.fromfile(self._keys_path, dtype=np.int64, count=self.rows)
+        else:
+            keys = np.empty(0, dtype=np.int64)
+        self._order = np.argsort(keys, kind="stable")
+        self._sorted = keys[self._order]
+        self._delta_sorted = np.empty(0, dtype=np.int64)
+        self._delta_order = np.empty(0, dtype=np.int64)
+        self._matrix = None
+
+    def _remember_keys(self, keys: np.ndarray, first_row: int):
+        # Rows first_row.. hold keys: merge them into the delta, and the delta into the
+        # sorted keys once it is too large to keep searching separately
+        order = np.argsort(keys, kind="stable")
+        sorted_keys, rows = keys[order], first_row + order
+        pos = np.searchsorted(self._delta_sorted, sorted_keys, side="right")
+        self._delta_sorted = np.insert(self._delta_sorted, pos, sorted_keys)
+        self._delta_order = np.insert(self._delta_order, pos, rows)
+        if len(self._delta_sorted) > max(DELTA_MIN, len(self._sorted) // DELTA_FRACTION):
+            pos = np.searchsorted(self._sorted, self._delta_sorted, side="right")
+            self._sorted = np.insert(self._sorted, pos, self._delta_sorted)
+            self._order = np.insert(self._order, pos, self._delta_order)
+            self._delta_sorted = np.empty(0, dtype=np.int64)
+            self._delta_order = np.empty(0, dtype=np.int64)
+
+    def matrix(self) -> np.ndarray:
+        """All committed embeddings as a read-only (rows, dim) float16 memmap."""
+        if self._matrix is None:
+            if not self.rows:
+                return np.empty((0, self.dim or 0), dtype=np.float16)
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float16, mode="r", shape=(self.rows, self.dim))
+        return self._matrix
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        """Row of each key, -1 when it is not stored."""
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        if not len(keys):
+            return rows
+        # keys added since the last merge, then the sorted keys
+        for sorted_keys, order in ((self._delta_sorted, self._delta_order), (self._sorted, self._order)):
+            if not len(sorted_keys):
+                continue
+            pos = np.searchsorted(sorted_keys, keys)
+            pos[pos == len(sorted_keys)] = 0
+            found = (sorted_keys[pos] == keys) & (rows < 0)
+            rows[found] = order[pos[found]]
+        return rows
+
+    def model(self):
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def _encode(self, texts: List[str], batch_size, threads) -> np.ndarray:
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return self.model().encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True)
+
+    def add(self, keys: Sequence[int], vectors: np.ndarray):
+        keys = np.asarray(keys, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float16)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        with open(self._vectors_path, "ab") as f:
+            vectors.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self._keys_path, "ab") as f:
+            keys.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        first_row = self.rows
+        self.rows += len(vectors)
+        tmp = self._meta_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"model": self.model_name, "dim": self.dim, "rows": self.rows}, f)
+        os.replace(tmp, self._meta_path)
+        self._remember_keys(keys, first_row)
+        self._matrix = None
+
+    def embed(self, texts: Sequence[str], batch_size=64, threads: Optional[int] = None,
+              commit_every=50000) -> np.ndarray:
+        """float32 embeddings for texts (one row each), encoding only texts not stored yet.
+        New rows are committed every commit_every texts, so an interrupted run keeps its progress."""
+        texts = ["" if t is None else str(t) for t in texts]
+        keys = np.fromiter((text_key(t) for t in texts), dtype=np.int64, count=len(texts))
+        rows = self.lookup(keys)
+
+        missing = {}
+        for i in np.flatnonzero(rows < 0):
+            missing.setdefault(int(keys[i]), texts[i])
+        pending = list(missing.items())
+        for start in range(0, len(pending), commit_every):
+            chunk = pending[start:start + commit_every]
+            vectors = self._encode([t for _, t in chunk], batch_size, threads)
+            self.add([k for k, _ in chunk], vectors)
+        if pending:
+            rows = self.lookup(keys)
+
+        return np.asarray(self.matrix()[rows], dtype=np.float32)
+
+
+class SentenceEncoder:
+    """texts → float32 embeddings without a cache, for processes that only tag a few
+    documents per call (e.g. Fission functions). The model is loaded on first use:
+    the ONNX export through fastembed when it is installed (no torch, what the Fission
+    packages ship), sentence-transformers otherwise. Both run the same MiniLM weights
+    and return L2-normalised vectors, so either can tag against a model trained on
+    EmbeddingStore embeddings."""
+
+    def __init__(self, model_name=DEFAULT_MODEL, batch_size=64):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._model = None
+        self._onnx = False
+
+    def _load(self):
+        try:
+            from fastembed import TextEmbedding
+        except ImportError:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+            return
+        name = self.model_name if "/" in self.model_name else f"sentence-transformers/{self.model_name}"
+        self._model = TextEmbedding(name)
+        self._onnx = True
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        if self._model is None:
+            self._load()
+        if self._onnx:
+            vectors = list(self._model.embed(list(texts), batch_size=self.batch_size))
+            return np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        return self._model.encode(list(texts), batch_size=self.batch_size, show_progress_bar=False, convert_to_numpy=True)
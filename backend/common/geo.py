@@ -0,0 +1,258 @@
+# COMP90024 Team 75
+# Linying Wei (1638206)
+# Wangyang Wu (1641248)
+# Ziyu Wang (1560831)
+# Roger Zhang (1079986)
+
+"""
+    Australian state inference at ingest
+    A gazetteer of state names, abbreviations, demonyms, cities and suburbs is compiled
+    into one trie-shaped regex with word boundaries on both sides, so "sa" never matches
+    inside "salary". Abbreviations that are also English words (SA, WA, NT, ACT, TAS, VIC)
+    only match in capitals. Four-digit postcodes only count next to a state abbreviation
+    or the word "postcode", since bare numbers are mostly years and prices. Subreddit and
+    Mastodon instance names add a stronger hint. Batches are matched in one regex pass
+    over the joined texts.
+
+    classify_state("Rents in Fitzroy are up again", subreddit="melbourne")   # "VIC"
+    classify_state(status["content"], instance=account_instance(acct, "aus.social"))
+    classify_states(df["content"], subreddits=df["subreddit"])              # list of states
+"""
+
+import re
+from bisect import bisect_right
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+UNKNOWN = "UNKNOWN"
+STATES = ['ACT', 'NSW', 'NT', 'QLD', 'SA', 'TAS', 'VIC', 'WA']
+
+NAME_WEIGHT = 3
+PLACE_WEIGHT = 2
+POSTCODE_WEIGHT = 3
+HINT_WEIGHT = 4
+
+# Matched case-insensitively
+STATE_NAMES: Dict[str, List[str]] = {
+    'ACT': ['australian capital territory', 'canberra', 'canberran', 'canberrans'],
+    'NSW': ['nsw', 'new south wales', 'sydney', 'syd', 'sydneysider', 'sydneysiders'],
+    'NT':  ['northern territory', 'territorian', 'territorians', 'top end'],
+    'QLD': ['qld', 'queensland', 'queenslander', 'queenslanders'],
+    'SA':  ['south australia', 'south australian', 'south australians'],
+    'TAS': ['tasmania', 'tasmanian', 'tasmanians', 'tassie'],
+    'VIC': ['victoria', 'victorian', 'victorians', 'melbourne', 'melb', 'melburnian', 'melburnians'],
+    'WA':  ['western australia', 'western australian', 'western australians'],
+}
+
+# Matched case-sensitively: in lower case these are ordinary words
+ABBREVIATIONS: Dict[str, List[str]] = {
+    'ACT': ['ACT'],
+    'NSW': ['NSW'],
+    'NT':  ['NT'],
+    'QLD': ['QLD', 'Qld'],
+    'SA':  ['SA'],
+    'TAS': ['TAS', 'Tas'],
+    'VIC': ['VIC', 'Vic'],
+    'WA':  ['WA'],
+}
+
+# Cities and suburbs; names shared with other states or countries (Richmond, Liverpool,
+# Ipswich, Albany, ...) are left out
+PLACES: Dict[str, List[str]] = {
+    'ACT': ['belconnen', 'tuggeranong', 'woden', 'gungahlin', 'weston creek', 'braddon'],
+    'NSW': ['newcastle', 'wollongong', 'parramatta', 'penrith', 'blacktown', 'bondi', 'chatswood',
+            'manly', 'cronulla', 'central coast', 'gosford', 'wagga wagga', 'albury', 'dubbo',
+            'tamworth', 'bathurst', 'port macquarie', 'coffs harbour', 'lismore', 'byron bay',
+            'surry hills', 'strathfield', 'hornsby', 'castle hill', 'bankstown', 'hurstville'],
+    'NT':  ['darwin', 'alice springs', 'tennant creek', 'nhulunbuy', 'casuarina'],
+    'QLD': ['brisbane', 'brissie', 'gold coast', 'sunshine coast', 'townsville', 'cairns',
+            'toowoomba', 'mackay', 'rockhampton', 'bundaberg', 'logan', 'redcliffe', 'caloundra',
+            'noosa', 'surfers paradise', 'fortitude valley', 'hervey bay', 'mount isa'],
+    'SA':  ['adelaide', 'mount gambier', 'whyalla', 'murray bridge', 'port augusta',
+            'port lincoln', 'port pirie', 'glenelg', 'victor harbor', 'mawson lakes', 'barossa',
+            'gawler'],
+    'TAS': ['hobart', 'launceston', 'devonport', 'burnie', 'sandy bay', 'glenorchy', 'ulverstone'],
+    'VIC': ['geelong', 'ballarat', 'bendigo', 'shepparton', 'mildura', 'frankston', 'dandenong',
+            'st kilda', 'fitzroy', 'footscray', 'box hill', 'werribee', 'craigieburn', 'sunbury',
+            'point cook', 'tarneit', 'melton', 'pakenham', 'cranbourne', 'glen waverley',
+            'doncaster', 'ringwood', 'collingwood', 'northcote', 'coburg'],
+    'WA':  ['perth', 'fremantle', 'freo', 'mandurah', 'bunbury', 'geraldton', 'kalgoorlie',
+            'broome', 'joondalup', 'rockingham', 'karratha', 'port hedland', 'subiaco'],
+}
+
+# Subreddits whose name is not itself a gazetteer entry
+SUBREDDIT_HINTS: Dict[str, str] = {
+    'northernterritory': 'NT', 'goldcoast': 'QLD', 'sunshinecoast': 'QLD',
+    'westernaustralia': 'WA', 'southaustralia': 'SA', 'newsouthwales': 'NSW',
+    'centralcoast': 'NSW', 'canberra': 'ACT', 'tasmania': 'TAS',
+}
+
+# (first, last) postcode ranges
+POSTCODES: List[Tuple[int, int, str]] = [
+    (200, 299, 'ACT'), (800, 999, 'NT'), (1000, 2599, 'NSW'), (2600, 2618, 'ACT'),
+    (2619, 2899, 'NSW'), (2900, 2920, 'ACT'), (2921, 2999, 'NSW'), (3000, 3999, 'VIC'),
+    (4000, 4999, 'QLD'), (5000, 5999, 'SA'), (6000, 6999, 'WA'), (7000, 7999, 'TAS'),
+    (8000, 8999, 'VIC'), (9000, 9999, 'QLD'),
+]
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_POSTCODE_RE = re.compile(
+    r"(?<!\w)(?:(?i:post\s?code|p/c)|NSW|VIC|QLD|SA|WA|TAS|NT|ACT)[\s,:]{1,3}(\d{4})(?!\w)"
+)
+_SEPARATOR = "\n\x00\n"
+
+
+def _trie_regex(words: Iterable[str]) -> str:
+    # Alternation shaped as a character trie, so shared prefixes are matched once
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def render(node) -> str:
+        ends = "" in node
+        branches = [(r"\s+" if ch == " " else re.escape(ch)) + render(child)
+                    for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if ends:
+            return "(?:" + body + ")?"
+        return body
+
+    return render(trie)
+
+
+def postcode_state(postcode: int) -> Optional[str]:
+    for first, last, state in POSTCODES:
+        if first <= postcode <= last:
+            return state
+    return None
+
+
+class GeoClassifier:
+    def __init__(self, names=STATE_NAMES, abbreviations=ABBREVIATIONS, places=PLACES,
+                 subreddit_hints=SUBREDDIT_HINTS):
+        self.lookup: Dict[str, Tuple[str, int]] = {}
+        for state, words in places.items():
+            for word in words:
+                self.lookup[word] = (state, PLACE_WEIGHT)
+        for state, words in names.items():
+            for word in words:
+                self.lookup[word] = (state, NAME_WEIGHT)
+        self.exact: Dict[str, Tuple[str, int]] = {
+            word: (state, NAME_WEIGHT) for state, words in abbreviations.items() for word in words
+        }
+        self.subreddit_hints = subreddit_hints
+        self.pattern = re.compile(
+            r"(?<!\w)(?:(?i:" + _trie_regex(self.lookup) + r")|" + _trie_regex(self.exact) + r")(?!\w)"
+        )
+
+    def _hit(self, word: str) -> Optional[Tuple[str, int]]:
+        if word in self.exact:
+            return self.exact[word]
+        # collapse "New  South Wales" / "Gold\nCoast" to the gazetteer's single spaces
+        return self.lookup.get(" ".join(word.lower().split()))
+
+    def _score_text(self, text: str, start: int, end: int, scores: Counter, weight: Optional[int] = None):
+        for m in self.pattern.finditer(text, start, end):
+            hit = self._hit(m.group())
+            if hit:
+                scores[hit[0]] += weight or hit[1]
+        for m in _POSTCODE_RE.finditer(text, start, end):
+            state = postcode_state(int(m.group(1)))
+            if state:
+                scores[state] += weight or POSTCODE_WEIGHT
+
+    def hint_scores(self, subreddit: Optional[str] = None, instance: Optional[str] = None) -> Counter:
+        scores: Counter = Counter()
+        if subreddit:
+            name = subreddit.lower()
+            if name.startswith("r/"):
+                name = name[2:]
+            if name in self.subreddit_hints:
+                scores[self.subreddit_hints[name]] += HINT_WEIGHT
+            else:
+                self._score_text(name, 0, len(name), scores, HINT_WEIGHT)
+        if instance:
+            # "mastodon.melbourne" → its domain labels
+            domain = instance.replace(".", " ")
+            self._score_text(domain, 0, len(domain), scores, HINT_WEIGHT)
+        return scores
+
+    @staticmethod
+    def _decide(scores: Counter) -> str:
+        ranked = scores.most_common(2)
+        if not ranked or (len(ranked) == 2 and ranked[0][1] == ranked[1][1]):
+            return UNKNOWN
+        return ranked[0][0]
+
+    def classify(self, text: Optional[str], subreddit: Optional[str] = None,
+                 instance: Optional[str] = None) -> str:
+        scores = self.hint_scores(subreddit, instance)
+        if text:
+            text = _TAG_RE.sub(" ", text)
+            self._score_text(text, 0, len(text), scores)
+        return self._decide(scores)
+
+    def classify_batch(self, texts: Sequence[Optional[str]],
+                       subreddits: Optional[Sequence[Optional[str]]] = None,
+                       instances: Optional[Sequence[Optional[str]]] = None) -> List[str]:
+        """States for a batch of texts: the texts are joined and scanned in one pass, and
+        each match is assigned to its text by offset."""
+        texts = ["" if not isinstance(t, str) else _TAG_RE.sub(" ", t) for t in texts]
+        starts = []
+        pos = 0
+        for t in texts:
+            starts.append(pos)
+            pos += len(t) + len(_SEPARATOR)
+        joined = _SEPARATOR.join(texts)
+
+        scores = [Counter() for _ in texts]
+        for m in self.pattern.finditer(joined):
+            hit = self._hit(m.group())
+            if hit:
+                scores[bisect_right(starts, m.start()) - 1][hit[0]] += hit[1]
+        for m in _POSTCODE_RE.finditer(joined):
+            state = postcode_state(int(m.group(1)))
+            if state:
+                scores[bisect_right(starts, m.start()) - 1][state] += POSTCODE_WEIGHT
+
+        for i in range(len(texts)):
+            subreddit = subreddits[i] if subreddits is not None else None
+            instance = instances[i] if instances is not None else None
+            if subreddit or instance:
+                scores[i].update(self.hint_scores(
+                    subreddit if isinstance(subreddit, str) else None,
+                    instance if isinstance(instance, str) else None,
+                ))
+        return [self._decide(s) for s in scores]
+
+
+# Instance of a Mastodon account: "user@mastodon.melbourne" → "mastodon.melbourne",
+# local accounts ("user") → home
+def account_instance(acct: Optional[str], home: Optional[str] = None) -> Optional[str]:
+    if acct and "@" in acct:
+        return acct.rsplit("@", 1)[1]
+    return home
+
+
+_default: Optional[GeoClassifier] = None
+
+def default_classifier() -> GeoClassifier:
+    global _default
+    if _default is None:
+        _default = GeoClassifier()
+    return _default
+
+def classify_state(text: Optional[str], subreddit: Optional[str] = None, instance: Optional[str] = None) -> str:
+    return default_classifier().classify(text, subreddit, instance)
+
+def classify_states(texts, subreddits=None, instances=None) -> List[str]:
+    # texts / hints may be lists or pandas Series
+    texts = list(texts)
+    subreddits = list(subreddits) if subreddits is not None else None
+    instances = list(instances) if instances is not None else None
+    return default_classifier().classify_batch(texts, subreddits, instances)
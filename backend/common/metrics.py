@@ -0,0 +1,155 @@
+# COMP90024 Team 75
+# Linying Wei (1638206)
+# Wangyang Wu (1641248)
+# Ziyu Wang (1560831)
+# Roger Zhang (1079986)
+
+"""
+    Prometheus metrics for the harvesters, enrichment stages and ingest
+    One set of metrics shared by every ingest path:
+      housing_api_request_seconds{platform,endpoint,status}   API latency histogram
+      housing_api_rate_limited_total{platform}                429 responses
+      housing_sleep_seconds_total{platform,reason}            time slept on rate limits / backoff
+      housing_bulk_documents{operation}, housing_bulk_seconds{operation}
+      housing_bulk_rejected_total{index,reason}              failed bulk items by error type
+      housing_stage_documents_total{stage}, housing_stage_seconds_total{stage}
+      housing_stream_lag_messages / housing_stream_pending_messages / housing_stream_oldest_pending_seconds
+    Per-stage throughput is rate(housing_stage_documents_total[5m]) (documents per wall second)
+    or that divided by rate(housing_stage_seconds_total[5m]) (documents per busy second).
+    Endpoints are normalised (IDs and tags become {id} / {tag}) and index names lose their
+    monthly suffix, so label cardinality stays fixed.
+    Long-running jobs expose the metrics over HTTP with `serve(port)`; Fission functions,
+    whose pods may be gone before a scrape, push them to a Pushgateway with `push(job, gateway)`.
+
+    @timed_stage("clean_content")
+    def clean_content(text): ...
+    observe_request("mastodon", url, resp.status_code, elapsed)
+    rate_limited("mastodon", wait)        # counts the 429 and sleeps
+    serve(9100)                           # or push("mastodon-harvester", "pushgateway:9091")
+"""
+
+import functools
+import re
+import socket
+import time
+from typing import Dict, Iterable, Optional
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram, push_to_gateway, start_http_server
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BULK_SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000)
+
+REQUEST_SECONDS = Histogram("housing_api_request_seconds", "Latency of harvester API requests",
+                            ["platform", "endpoint", "status"], buckets=LATENCY_BUCKETS)
+RATE_LIMITED = Counter("housing_api_rate_limited_total", "API responses that were rate limited (429)", ["platform"])
+SLEEP_SECONDS = Counter("housing_sleep_seconds_total", "Seconds spent sleeping on rate limits and retry backoff",
+                        ["platform", "reason"])
+BULK_DOCUMENTS = Histogram("housing_bulk_documents", "Documents per bulk call", ["operation"], buckets=BULK_SIZE_BUCKETS)
+BULK_SECONDS = Histogram("housing_bulk_seconds", "Latency of bulk calls", ["operation"], buckets=LATENCY_BUCKETS)
+BULK_REJECTED = Counter("housing_bulk_rejected_total", "Bulk items Elasticsearch did not accept", ["index", "reason"])
+STAGE_DOCUMENTS = Counter("housing_stage_documents_total", "Documents through an enrichment stage", ["stage"])
+STAGE_SECONDS = Counter("housing_stage_seconds_total", "Seconds spent in an enrichment stage", ["stage"])
+STREAM_LAG = Gauge("housing_stream_lag_messages", "Stream entries not yet delivered to the group", ["stream", "group"])
+STREAM_PENDING = Gauge("housing_stream_pending_messages", "Delivered stream entries not yet acknowledged",
+                       ["stream", "group"])
+STREAM_OLDEST_PENDING = Gauge("housing_stream_oldest_pending_seconds", "Idle time of the oldest pending entry",
+                              ["stream", "group"])
+
+_NUMERIC_RE = re.compile(r"/\d+(?=/|$)")
+_TAG_RE = re.compile(r"/tag/[^/]+")
+_PARTITION_RE = re.compile(r"-\d{4}\.\d{2}$")
+
+
+def endpoint(url: str) -> str:
+    # "https://aus.social/api/v1/statuses/1144/context" -> "/api/v1/statuses/{id}/context"
+    path = re.sub(r"^\w+://[^/]+", "", url).split("?", 1)[0]
+    return _NUMERIC_RE.sub("/{id}", _TAG_RE.sub("/tag/{tag}", path)) or "/"
+
+def index_family(index: Optional[str]) -> str:
+    return _PARTITION_RE.sub("", index or "unknown")
+
+
+# === API requests ===
+def observe_request(platform: str, url_or_endpoint: str, status, seconds: float):
+    REQUEST_SECONDS.labels(platform, endpoint(url_or_endpoint), str(status)).observe(seconds)
+
+def sleep(platform: str, seconds: float, reason="backoff"):
+    SLEEP_SECONDS.labels(platform, reason).inc(max(seconds, 0))
+    time.sleep(seconds)
+
+def rate_limited(platform: str, wait: float):
+    RATE_LIMITED.labels(platform).inc()
+    sleep(platform, wait, "rate_limit")
+
+
+# === bulk indexing ===
+def observe_bulk(operation: str, documents: int, seconds: float, errors: Iterable[Dict] = ()):
+    """One bulk call of documents; errors are the failed items as helpers.bulk returns them."""
+    BULK_DOCUMENTS.labels(operation).observe(documents)
+    BULK_SECONDS.labels(operation).observe(seconds)
+    for item in errors:
+        info = next(iter(item.values()), {}) if item else {}
+        error = info.get("error")
+        reason = error.get("type") if isinstance(error, dict) else str(info.get("status", "unknown"))
+        BULK_REJECTED.labels(index_family(info.get("_index")), reason or "unknown").inc()
+
+
+# === enrichment stages ===
+def observe_stage(stage: str, documents: int, seconds: float):
+    STAGE_DOCUMENTS.labels(stage).inc(documents)
+    STAGE_SECONDS.labels(stage).inc(seconds)
+
+def timed_stage(stage: str):
+    """Decorator counting one document and the call's duration per call of a per-document function."""
+    documents = STAGE_DOCUMENTS.labels(stage)
+    seconds = STAGE_SECONDS.labels(stage)
+
+    def wrap(func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds.inc(time.perf_counter() - started)
+                documents.inc()
+        return timed
+    return wrap
+
+
+# === streams ===
+def observe_stream(redis_client, stream: str, group: str):
+    """Lag and pending count of a consumer group (lag needs Redis 7; it is left unset before)."""
+    for info in redis_client.xinfo_groups(stream):
+        if info.get("name") != group:
+            continue
+        STREAM_PENDING.labels(stream, group).set(info.get("pending") or 0)
+        if info.get("lag") is not None:
+            STREAM_LAG.labels(stream, group).set(info["lag"])
+
+def observe_oldest_pending(stream: str, group: str, idle_ms: float):
+    STREAM_OLDEST_PENDING.labels(stream, group).set(idle_ms / 1000)
+
+
+# === exposition ===
+_served = set()
+
+def serve(port: Optional[int]) -> bool:
+    """Expose /metrics on port for the life of the process (once per port; no-op without a port)."""
+    if not port or port in _served:
+        return bool(port)
+    start_http_server(port)
+    _served.add(port)
+    return True
+
+def push(job: str, gateway: Optional[str]) -> bool:
+    """Push every metric to a Pushgateway under (job, instance=hostname). Never raises: metrics
+    must not fail an invocation."""
+    if not gateway:
+        return False
+    try:
+        push_to_gateway(gateway, job=job, registry=REGISTRY, grouping_key={"instance": socket.gethostname()})
+        return True
+    except Exception as e:
+        print(f"[Metrics] push to {gateway} failed: {e}")
+        return False
@@ -0,0 +1,166 @@
+# COMP90024 Team 75
+# Linying Wei (1638206)
+# Wangyang Wu (1641248)
+# Ziyu Wang (1560831)
+# Roger Zhang (1079986)
+
+"""
+    Monthly time-partitioned indices
+    Harvesters write each document to `<base>-YYYY.MM` picked from its `created_at`.
+    An index template on `<base>-*` maps the time/keyword fields and attaches the
+    per-platform read aliases (`read-mastodon-posts`, `read-reddit-comments`, ...),
+    so dashboards query one alias and range filters skip old months.
+    Closed months can be made read-only and force-merged with `seal`.
+"""
+
+import argparse
+from datetime import datetime, timezone
+from typing import List, Optional, Union
+
+from dateutil import parser as date_parser
+
+PARTITION_FORMAT = "%Y.%m"
+PLATFORMS = ("mastodon", "reddit")
+
+# Every index family written by an ingest path and the kind of document it holds
+PARTITIONED_INDICES = {
+    "housing-posts": "posts",
+    "housing-comments": "comments",
+    "reddit-posts": "posts",
+    "reddit-comments": "comments",
+    "history-mastodon-posts": "posts",
+    "history-mastodon-comments": "comments",
+    "posts": "posts",
+    "comments": "comments",
+}
+
+# housing-* is copied into posts/comments by the reindex function, so dashboards
+# read the reindexed datasets plus the families that are never reindexed
+DASHBOARD_DATASETS = (
+    "posts", "comments",
+    "reddit-posts", "reddit-comments",
+    "history-mastodon-posts", "history-mastodon-comments",
+)
+
+# Normalise datetime / ISO string / epoch seconds or milliseconds to an aware UTC datetime
+def as_utc_datetime(value: Union[datetime, str, int, float]) -> datetime:
+    if isinstance(value, datetime):
+        dt = value
+    elif isinstance(value, (int, float)):
+        dt = datetime.fromtimestamp(value / 1000 if value > 1e11 else value, timezone.utc)
+    else:
+        try:
+            dt = datetime.fromisoformat(str(value))
+        except ValueError:
+            dt = date_parser.parse(str(value))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+# Backing index for a document, e.g. housing-posts-2025.05
+def partition_index(base: str, created_at: Union[datetime, str, int, float]) -> str:
+    return f"{base}-{as_utc_datetime(created_at).strftime(PARTITION_FORMAT)}"
+
+# Read alias covering one platform's documents of one kind across all families
+def read_alias(platform: str, kind: str) -> str:
+    return f"read-{platform}-{kind}"
+
+# Install (idempotently) the template applied to every new monthly index of a family
+def ensure_partition_template(es, base: str, kind: Optional[str] = None):
+    kind = kind or PARTITIONED_INDICES.get(base, "posts")
+    es.indices.put_index_template(
+        name=f"{base}-partitions",
+        index_patterns=[f"{base}-*"],
+        priority=100,
+        template={
+            "settings": {
+                "number_of_shards": 1,
+                "refresh_interval": "5s"
+            },
+            "mappings": {
+                "properties": {
+                    "created_at": {"type": "date"},
+                    "platform": {"type": "keyword"},
+                    "state": {"type": "keyword"},
+                    "sentiment": {"type": "keyword"},
+                    "sentiment_score": {"type": "float"},
+                    "tags": {"type": "keyword"},
+                    "topic": {"type": "integer"},
+                    "topic_label": {"type": "keyword"},
+                    "topic_model_version": {"type": "keyword"},
+                    "duplicate_of": {"type": "keyword"}
+                }
+            },
+            "aliases": {
+                read_alias(platform, kind): {"filter": {"term": {"platform": platform}}}
+                for platform in PLATFORMS
+            }
+        }
+    )
+
+def _month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1, tzinfo=timezone.utc)
+
+def _add_months(dt: datetime, months: int) -> datetime:
+    month = dt.month - 1 + months
+    return datetime(dt.year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+
+# Monthly backing indices overlapping [start, end]; query them with ignore_unavailable=True
+def indices_for_range(base: str, start: Union[datetime, str], end: Union[datetime, str]) -> List[str]:
+    month = _month_start(as_utc_datetime(start))
+    last = _month_start(as_utc_datetime(end))
+    names = []
+    while month <= last:
+        names.append(f"{base}-{month.strftime(PARTITION_FORMAT)}")
+        month = _add_months(month, 1)
+    return names
+
+# Month encoded in a backing index name, or None for the legacy unpartitioned index
+def partition_month(base: str, index_name: str) -> Optional[datetime]:
+    try:
+        suffix = index_name[len(base) + 1:]
+        return datetime.strptime(suffix, PARTITION_FORMAT).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+# Make partitions older than `keep_months` read-only and merge them down to one segment
+def seal_partitions(es, base: str, keep_months: int = 1, now: Optional[datetime] = None) -> List[str]:
+    cutoff = _add_months(_month_start(now or datetime.now(timezone.utc)), -max(keep_months - 1, 0))
+    sealed = []
+    for name, settings in es.indices.get_settings(index=f"{base}-*", ignore_unavailable=True).items():
+        month = partition_month(base, name) if name.startswith(f"{base}-") else None
+        if month is None or month >= cutoff:
+            continue
+        blocks = settings["settings"]["index"].get("blocks", {})
+        if str(blocks.get("write", "false")).lower() == "true":
+            continue
+        es.indices.put_settings(index=name, settings={"index.blocks.write": True})
+        es.indices.forcemerge(index=name, max_num_segments=1)
+        sealed.append(name)
+    return sealed
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Maintain monthly partitioned indices")
+    p.add_argument("action", choices=["templates", "seal"], help="Install index templates or seal closed months")
+    p.add_argument("--es-host", default="https://elasticsearch-master.elastic.svc.cluster.local:9200")
+    p.add_argument("--username", default="elastic")
+    p.add_argument("--password", default="elastic")
+    p.add_argument("--base", nargs="+", default=list(PARTITIONED_INDICES), help="Index families to maintain")
+    p.add_argument("--keep-months", type=int, default=1, help="Most recent months left writable (default: 1)")
+    return p.parse_args()
+
+def main():
+    from elasticsearch import Elasticsearch
+
+    args = parse_args()
+    es = Elasticsearch(hosts=args.es_host, verify_certs=False, http_auth=(args.username, args.password))
+    for base in args.base:
+        if args.action == "templates":
+            ensure_partition_template(es, base)
+            print(f"Installed template for {base}-*")
+        else:
+            sealed = seal_partitions(es, base, args.keep_months)
+            print(f"Sealed {len(sealed)} partitions of {base}: {sealed}")
+
+if __name__ == "__main__":
+    main()
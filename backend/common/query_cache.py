@@ -0,0 +1,179 @@
+# COMP90024 Team 75
+# Linying Wei (1638206)
+# Wangyang Wu (1641248)
+# Ziyu Wang (1560831)
+# Roger Zhang (1079986)
+
+"""
+    Result cache for the dashboard queries
+    Entries are keyed by the query name, its normalised parameters, the current time
+    bucket and the ingest watermark (latest write recorded in the control indices and
+    the rollup index), so a cached answer is reused until new data is ingested or the
+    time bucket rolls over. Entries live in an in-process LRU and, when a Redis client
+    is given (created with decode_responses=False), in Redis so every API replica shares them.
+    JSON results and rendered charts (str / bytes) are both cacheable.
+
+    cache = QueryCache(es, redis_client=redis.Redis(...))
+
+    @cache.cached("posts-per-day")
+    def posts_per_day(start_days=7, end_days=0): ...   # call with keyword parameters
+"""
+
+import functools
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from common.rollups import ROLLUP_INDEX
+
+CONTROL_INDICES = ("housing-control", "reddit-control", "upload-control", ROLLUP_INDEX)
+
+_MISSING = object()
+
+def _normalise(value: Any) -> Any:
+    if isinstance(value, str):
+        stripped = value.strip()
+        try:
+            return int(stripped)
+        except ValueError:
+            return stripped
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, (list, tuple)):
+        # order is kept: it matters for e.g. sort clauses
+        return [_normalise(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        # sorted by their JSON so mixed types (str, int, None) still compare
+        return sorted((_normalise(v) for v in value), key=lambda v: json.dumps(v, sort_keys=True, default=str))
+    return value
+
+# Stable representation of query parameters: None dropped, "7" == 7, set order ignored
+def normalise_params(params: Dict[str, Any]) -> str:
+    cleaned = {k: _normalise(v) for k, v in params.items() if v is not None}
+    return json.dumps(cleaned, sort_keys=True, separators=(",", ":"), default=str)
+
+def _encode(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return b"b" + value
+    if isinstance(value, str):
+        return b"s" + value.encode("utf-8")
+    return b"j" + json.dumps(value, default=str).encode("utf-8")
+
+def _decode(blob: bytes) -> Any:
+    kind, payload = blob[:1], blob[1:]
+    if kind == b"b":
+        return payload
+    if kind == b"s":
+        return payload.decode("utf-8")
+    return json.loads(payload)
+
+class QueryCache:
+    def __init__(self, es, redis_client=None, max_entries: int = 512, ttl: int = 3600,
+                 bucket_seconds: int = 3600, watermark_ttl: float = 5.0,
+                 namespace: str = "housing-query-cache"):
+        self.es = es
+        self.redis = redis_client
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bucket_seconds = bucket_seconds
+        self.watermark_ttl = watermark_ttl
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._watermark = (0.0, None)
+
+    def watermark(self) -> Optional[str]:
+        """Latest ingest write across the control indices, memoised for watermark_ttl seconds."""
+        checked_at, value = self._watermark
+        if time.monotonic() - checked_at < self.watermark_ttl:
+            return value
+        try:
+            res = self.es.search(
+                index=",".join(CONTROL_INDICES),
+                size=0,
+                ignore_unavailable=True,
+                aggs={
+                    "timestamp": {"max": {"field": "timestamp"}},
+                    "updated_at": {"max": {"field": "updated_at"}}
+                }
+            )
+            marks = [agg.get("value") for agg in res["aggregations"].values()]
+            value = str(max(m for m in marks if m is not None)) if any(m is not None for m in marks) else "empty"
+        except Exception as e:
+            print(f"Error reading ingest watermark: {e}")
+            value = None
+        self._watermark = (time.monotonic(), value)
+        return value
+
+    def key(self, name: str, params: Dict[str, Any]) -> Optional[str]:
+        watermark = self.watermark()
+        if watermark is None:
+            return None
+        bucket = int(time.time() // self.bucket_seconds)
+        digest = hashlib.sha1(f"{name}|{normalise_params(params)}|{bucket}|{watermark}".encode("utf-8")).hexdigest()
+        return f"{self.namespace}:{name}:{digest}"
+
+    def _get(self, key: str) -> Any:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        if self.redis is not None:
+            try:
+                blob = self.redis.get(key)
+                if blob is not None:
+                    value = _decode(blob if isinstance(blob, bytes) else blob.encode("utf-8"))
+                    self._put_local(key, value)
+                    return value
+            except Exception as e:
+                print(f"Error reading query cache from Redis: {e}")
+        return _MISSING
+
+    def _put_local(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _put(self, key: str, value: Any):
+        self._put_local(key, value)
+        if self.redis is not None:
+            try:
+                self.redis.setex(key, self.ttl, _encode(value))
+            except Exception as e:
+                print(f"Error writing query cache to Redis: {e}")
+
+    def get_or_compute(self, name: str, params: Dict[str, Any], compute: Callable[[], Any]) -> Any:
+        """Return the cached result for (name, params) or compute and store it.
+        Without a readable watermark the query runs uncached."""
+        key = self.key(name, params)
+        if key is None:
+            return compute()
+        value = self._get(key)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = compute()
+        self._put(key, value)
+        return value
+
+    def cached(self, name: str):
+        """Decorator for query / render functions called with keyword parameters."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(**params):
+                return self.get_or_compute(name, params, lambda: func(**params))
+            return wrapper
+        return decorator
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        self._watermark = (0.0, None)
@@ -0,0 +1,221 @@
+# COMP90024 Team 75
+# Linying Wei (1638206)
+# Wangyang Wu (1641248)
+# Ziyu Wang (1560831)
+# Roger Zhang (1079986)
+
+"""
+    Daily rollups of counts and sentiment
+    Every ingest path indexes through `bulk_with_rollups`, which upserts one rollup
+    document per (day, dataset, kind, platform, state, tag, sentiment) for the
+    documents the bulk call newly created. Each rollup holds the document count and
+    the sum / sum of squares of sentiment_score, so dashboards aggregate a few rollups
+    per day instead of every raw document. The same documents feed the per-day term
+    buckets used by the word cloud (see common.terms).
+"""
+
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from elasticsearch import helpers
+
+from common import metrics
+from common.partitions import DASHBOARD_DATASETS, as_utc_datetime, partition_month
+from common.terms import DailyTerms, ensure_terms_index
+
+ROLLUP_INDEX = "housing-rollups-daily"
+DIMENSIONS = ("day", "dataset", "kind", "platform", "state", "tag", "sentiment")
+
+_UPSERT_SCRIPT = (
+    "ctx._source.count += params.count;"
+    "ctx._source.sentiment_sum += params.sentiment_sum;"
+    "ctx._source.sentiment_sumsq += params.sentiment_sumsq;"
+    "ctx._source.updated_at = params.updated_at;"
+)
+
+# Create the rollup and term-bucket indices with explicit mappings if they do not exist yet
+def ensure_rollup_index(es):
+    ensure_terms_index(es)
+    if es.indices.exists(index=ROLLUP_INDEX):
+        return
+    es.indices.create(
+        index=ROLLUP_INDEX,
+        mappings={
+            "properties": {
+                "day": {"type": "date", "format": "yyyy-MM-dd"},
+                "dataset": {"type": "keyword"},
+                "kind": {"type": "keyword"},
+                "platform": {"type": "keyword"},
+                "state": {"type": "keyword"},
+                "tag": {"type": "keyword"},
+                "sentiment": {"type": "keyword"},
+                "count": {"type": "long"},
+                "sentiment_sum": {"type": "double"},
+                "sentiment_sumsq": {"type": "double"},
+                "updated_at": {"type": "date"}
+            }
+        }
+    )
+
+# Index family of a concrete (possibly monthly) index name
+def dataset_of(index_name: str) -> str:
+    base, _, _ = index_name.rpartition("-")
+    if base and partition_month(base, index_name) is not None:
+        return base
+    return index_name
+
+# (day, dataset, kind) of an indexed document
+def document_dims(index_name: str, source: Dict) -> Tuple[str, str, str]:
+    return (
+        as_utc_datetime(source["created_at"]).date().isoformat(),
+        dataset_of(index_name),
+        "comments" if "comment_id" in source else "posts",
+    )
+
+class DailyRollup:
+    """Accumulates rollup deltas in memory and turns them into upsert actions."""
+
+    def __init__(self):
+        self.buckets: Dict[Tuple[str, ...], List[float]] = {}
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def add(self, index_name: str, source: Dict):
+        tags = source.get("tags")
+        if isinstance(tags, (list, tuple)):
+            tag = tags[0] if tags else "none"
+        else:
+            tag = tags or "none"
+        sentiment = source.get("sentiment") or "unscored"
+        score = float(source.get("sentiment_score") or 0.0) if sentiment != "unscored" else 0.0
+        key = document_dims(index_name, source) + (
+            source.get("platform") or "unknown",
+            source.get("state") or "UNKNOWN",
+            str(tag),
+            sentiment,
+        )
+        bucket = self.buckets.setdefault(key, [0, 0.0, 0.0])
+        bucket[0] += 1
+        bucket[1] += score
+        bucket[2] += score * score
+
+    def actions(self) -> Iterable[Dict]:
+        now = datetime.now(timezone.utc).isoformat()
+        for key, (count, total, total_sq) in self.buckets.items():
+            params = {
+                "count": count,
+                "sentiment_sum": total,
+                "sentiment_sumsq": total_sq,
+                "updated_at": now
+            }
+            yield {
+                "_op_type": "update",
+                "_index": ROLLUP_INDEX,
+                "_id": "|".join(key),
+                "_retry_on_conflict": 5,
+                "script": {"source": _UPSERT_SCRIPT, "lang": "painless", "params": params},
+                "upsert": {**dict(zip(DIMENSIONS, key)), **params}
+            }
+
+    def flush(self, es):
+        if self.buckets:
+            started = time.perf_counter()
+            _, errors = helpers.bulk(es, self.actions(), chunk_size=500, raise_on_error=False,
+                                     max_retries=5, initial_backoff=1)
+            metrics.observe_bulk("rollups", len(self.buckets), time.perf_counter() - started, errors)
+            self.buckets.clear()
+
+# helpers.bulk replacement that also rolls up (counts, sentiment and terms) every
+# document the bulk call created. Overwrites of an existing _id ("updated") and
+# failed items are not counted again. Terms are read from content_field; documents
+# without created_at cannot be bucketed by day and are reported instead.
+def bulk_with_rollups(es, actions: Sequence[Dict], chunk_size: int = 100, content_field: str = "content",
+                      **kwargs) -> Tuple[int, List[Dict]]:
+    sources = {(a["_index"], a["_id"]): a["_source"] for a in actions if "_id" in a and "_source" in a}
+    rollup = DailyRollup()
+    terms = DailyTerms()
+    success, errors, undated = 0, [], 0
+    started = time.perf_counter()
+    for ok, item in helpers.streaming_bulk(es, actions, chunk_size=chunk_size, raise_on_error=False, **kwargs):
+        if not ok:
+            errors.append(item)
+            continue
+        success += 1
+        info = next(iter(item.values()))
+        source = sources.get((info.get("_index"), info.get("_id")))
+        if source is not None and info.get("result") == "created":
+            if source.get("created_at") is None:
+                undated += 1
+                continue
+            rollup.add(info["_index"], source)
+            terms.add(*document_dims(info["_index"], source), source.get(content_field) or "")
+    metrics.observe_bulk("ingest", success + len(errors), time.perf_counter() - started, errors)
+    rollup.flush(es)
+    terms.flush(es)
+    if undated:
+        print(f"[Rollups] {undated} created documents without created_at were not rolled up")
+    return success, errors
+
+def _range_filter(start_days: Optional[int], end_days: Optional[int]) -> List[Dict]:
+    if start_days is None:
+        return []
+    return [{"range": {"day": {"gte": f"now-{start_days}d/d", "lte": f"now-{end_days or 0}d/d"}}}]
+
+def _summarise(node: Dict) -> Dict:
+    count = int(node["count"]["value"])
+    scored = int(node["scored"]["count"]["value"])
+    mean = node["sentiment_sum"]["value"] / scored if scored else 0.0
+    variance = node["sentiment_sumsq"]["value"] / scored - mean * mean if scored else 0.0
+    return {"count": count, "scored": scored, "mean": mean, "std": max(variance, 0.0) ** 0.5}
+
+def _collect(node: Dict, group_by: Sequence[str], prefix: Tuple, out: Dict):
+    for bucket in node["groups"]["buckets"]:
+        key = prefix + (bucket.get("key_as_string", bucket["key"]),)
+        if len(group_by) > 1:
+            _collect(bucket, group_by[1:], key, out)
+        else:
+            out[key if len(key) > 1 else key[0]] = _summarise(bucket)
+
+# Aggregate rollups over a day window (start_days..end_days ago, None = all time),
+# grouped by one or more dimensions. Cost grows with days x groups, not documents.
+def query_rollups(es, group_by: Union[str, Sequence[str]] = "day", start_days: Optional[int] = 7,
+                  end_days: Optional[int] = 0, kind: Optional[str] = None,
+                  datasets: Optional[Sequence[str]] = DASHBOARD_DATASETS,
+                  **filters) -> Dict:
+    group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+    must = _range_filter(start_days, end_days)
+    if kind:
+        must.append({"term": {"kind": kind}})
+    if datasets:
+        must.append({"terms": {"dataset": list(datasets)}})
+    for field, value in filters.items():
+        must.append({"term": {field: value}})
+
+    metrics = {
+        "count": {"sum": {"field": "count"}},
+        "sentiment_sum": {"sum": {"field": "sentiment_sum"}},
+        "sentiment_sumsq": {"sum": {"field": "sentiment_sumsq"}},
+        "scored": {
+            "filter": {"bool": {"must_not": {"term": {"sentiment": "unscored"}}}},
+            "aggs": {"count": {"sum": {"field": "count"}}}
+        }
+    }
+    aggs = metrics
+    for field in reversed(group_by):
+        aggs = {"groups": {"terms": {"field": field, "size": 10000, "order": {"_key": "asc"}}, "aggs": aggs}}
+
+    res = es.search(index=ROLLUP_INDEX, size=0, query={"bool": {"filter": must}}, aggs=aggs)
+    out = {}
+    _collect(res["aggregations"], group_by, (), out)
+    return out
+
+# /api/posts-per-day backed by rollups: {"2025-05-19": 42, ...}
+def posts_per_day(es, start_days: int = 7, end_days: int = 0, **kwargs) -> Dict[str, int]:
+    rows = query_rollups(es, "day", start_days, end_days, kind="posts", **kwargs)
+    return {day: row["count"] for day, row in rows.items()}
+
+# /api/sentiment-dist backed by rollups: {"positive": {"count": .., "mean": .., "std": ..}, ...}
+def sentiment_distribution(es, start_days: int = 7, end_days: int = 0, **kwargs) -> Dict[str, Dict]:
+    return query_rollups(es, "sentiment", start_days, end_days, **kwargs)
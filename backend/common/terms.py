@@ -0,0 +1,140 @@
+# COMP90024 Team 75
+# Linying Wei (1638206)
+# Wangyang Wu (1641248)
+# Ziyu Wang (1560831)
+# Roger Zhang (1079986)
+
+"""
+    Per-day term buckets for the word cloud
+    New documents are tokenised once at ingest (HTML, URLs and stop words dropped) and
+    their term counts are merged into one bucket document per (day, dataset, kind).
+    The word-cloud query merges the buckets of the requested days instead of
+    re-scanning document text.
+"""
+
+import re
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from elasticsearch import helpers
+
+from common import metrics
+from common.partitions import DASHBOARD_DATASETS, as_utc_datetime
+
+TERMS_INDEX = "housing-terms-daily"
+MIN_TERM_LENGTH = 3
+
+STOP_WORDS = frozenset("""
+a about above after again against all also am an and any are aren as at be because been before
+being below between both but by can cannot could couldn did didn do does doesn doing don down
+during each even ever every few for from further get gets got had hadn has hasn have haven having
+he her here hers herself him himself his how however i if in into is isn it its itself just let
+like ll made make many may me might more most much must mustn my myself need no nor not now of
+off on once one only or other others our ours ourselves out over own per quite rather re really
+s same say says shall shan she should shouldn since so some such than that the their theirs them
+themselves then there these they thing things think this those though through to too under until
+up upon us ve very via was wasn way we well were weren what when where which while who whom why
+will with won would wouldn yet you your yours yourself yourselves
+amp com gt http https lt nbsp www deleted removed
+""".split())
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_URL_RE = re.compile(r"https?://\S+|www\.\S+")
+_TOKEN_RE = re.compile(r"[a-z][a-z0-9']*[a-z0-9]")
+
+_MERGE_SCRIPT = (
+    "def t = ctx._source.terms;"
+    "for (def e : params.terms.entrySet()) {"
+    "  def k = e.getKey();"
+    "  t[k] = t.containsKey(k) ? t[k] + e.getValue() : e.getValue();"
+    "}"
+    "ctx._source.docs += params.docs;"
+)
+
+# Lower-cased content words of a (possibly raw HTML) post or comment
+def tokenize(text: str) -> List[str]:
+    if not text:
+        return []
+    text = _URL_RE.sub(" ", _TAG_RE.sub(" ", text)).lower()
+    return [
+        token.replace("'", "") for token in _TOKEN_RE.findall(text)
+        if len(token) >= MIN_TERM_LENGTH and token not in STOP_WORDS
+    ]
+
+def ensure_terms_index(es):
+    if es.indices.exists(index=TERMS_INDEX):
+        return
+    es.indices.create(
+        index=TERMS_INDEX,
+        mappings={
+            "properties": {
+                "day": {"type": "date", "format": "yyyy-MM-dd"},
+                "dataset": {"type": "keyword"},
+                "kind": {"type": "keyword"},
+                "docs": {"type": "long"},
+                # term -> count, kept in _source only so the vocabulary never becomes mappings
+                "terms": {"type": "object", "enabled": False}
+            }
+        }
+    )
+
+class DailyTerms:
+    """Accumulates term counts per (day, dataset, kind) and merges them into TERMS_INDEX."""
+
+    def __init__(self):
+        self.buckets: Dict[Tuple[str, str, str], Counter] = {}
+        self.docs: Counter = Counter()
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def add(self, day: str, dataset: str, kind: str, text: str):
+        key = (day, dataset, kind)
+        self.buckets.setdefault(key, Counter()).update(tokenize(text))
+        self.docs[key] += 1
+
+    def actions(self) -> Iterable[Dict]:
+        for key, counts in self.buckets.items():
+            params = {"terms": dict(counts), "docs": self.docs[key]}
+            yield {
+                "_op_type": "update",
+                "_index": TERMS_INDEX,
+                "_id": "|".join(key),
+                "_retry_on_conflict": 5,
+                "script": {"source": _MERGE_SCRIPT, "lang": "painless", "params": params},
+                "upsert": {"day": key[0], "dataset": key[1], "kind": key[2], **params}
+            }
+
+    def flush(self, es):
+        if self.buckets:
+            started = time.perf_counter()
+            _, errors = helpers.bulk(es, self.actions(), chunk_size=50, raise_on_error=False,
+                                     max_retries=5, initial_backoff=1)
+            metrics.observe_bulk("terms", len(self.buckets), time.perf_counter() - started, errors)
+            self.buckets.clear()
+            self.docs.clear()
+
+# Word-cloud data for start_days..end_days ago (start_days=None: all time): the k most
+# frequent terms across the daily buckets
+def top_terms(es, start_days: Optional[int] = 7, end_days: int = 0, k: int = 100,
+              datasets: Optional[Sequence[str]] = DASHBOARD_DATASETS, kind: Optional[str] = None,
+              now: Optional[datetime] = None) -> List[Tuple[str, int]]:
+    today = as_utc_datetime(now or datetime.now(timezone.utc)).date()
+    must = []
+    if start_days is not None:
+        must.append({"range": {"day": {
+            "gte": (today - timedelta(days=start_days)).isoformat(),
+            "lte": (today - timedelta(days=end_days)).isoformat()
+        }}})
+    if datasets:
+        must.append({"terms": {"dataset": list(datasets)}})
+    if kind:
+        must.append({"term": {"kind": kind}})
+
+    merged: Counter = Counter()
+    for hit in helpers.scan(es, index=TERMS_INDEX, query={"query": {"bool": {"filter": must}}},
+                            _source=["terms"], size=100):
+        merged.update(hit["_source"].get("terms", {}))
+    return merged.most_common(k)
@@ -0,0 +1,309 @@
+# COMP90024 Team 75
+# Linying Wei (1638206)
+# Wangyang Wu (1641248)
+# Ziyu Wang (1560831)
+# Roger Zhang (1079986)
+
+"""
+    Versioned store for fitted topic models, and transform-only tagging at ingest
+    A fitted model is published under a name with a UTC timestamp version, either to a
+    local directory (<root>/<name>/<version>.pkl + .json) or to an Elasticsearch index as
+    base64 binary chunks, so Fission functions can read it without shared disk.
+    The local store pickles any model (OnlineTopicModel or BERTopic). The Elasticsearch
+    store only takes OnlineTopicModels and writes their export_state as npz + JSON, never
+    a pickle: every pod that loads from the index would otherwise run whatever code was
+    written to it. Models loaded from Elasticsearch are transform-only.
+    `TopicTagger` loads the latest version once per process (re-checking the version every
+    ttl seconds), tags batches of documents with topic, topic_label and topic_model_version,
+    and `retag` re-tags only the documents whose topic_model_version is missing or older
+    than the latest. Embeddings come from SentenceEncoder: the Fission packages ship the
+    ONNX MiniLM through fastembed instead of sentence-transformers, which pulls in torch.
+    The online model is published here by processor/upload_to_es.py and processor/main.py
+    (--online-topics) during and at the end of a run.
+
+    store = ESModelStore(es)
+    tagger = TopicTagger(store, "comments")
+    tagger.tag_sources([a["_source"] for a in actions])
+    python -m common.topic_store publish --model comments.pkl --name comments
+    python -m common.topic_store retag --index "housing-comments*" --name comments
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+import pickle
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from common.embeddings import DEFAULT_MODEL, SentenceEncoder
+from common.topics import OnlineTopicModel
+
+MODEL_INDEX = "topic-models"
+CHUNK_BYTES = 8 * 2**20
+DEFAULT_LABEL = "default"
+ES_FORMAT = "online-topic-model/npz"
+
+
+def new_version() -> str:
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+
+class LocalModelStore:
+    def __init__(self, root):
+        self.root = root
+
+    def _dir(self, name):
+        return os.path.join(self.root, name)
+
+    def publish(self, name: str, model: Any, meta: Optional[Dict] = None) -> str:
+        version = new_version()
+        os.makedirs(self._dir(name), exist_ok=True)
+        base = os.path.join(self._dir(name), version)
+        with open(base + ".pkl.tmp", "wb") as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(base + ".pkl.tmp", base + ".pkl")
+        with open(base + ".json", "w") as f:
+            json.dump({**(meta or {}), "name": name, "version": version}, f)
+        return version
+
+    def latest_version(self, name: str) -> Optional[str]:
+        if not os.path.isdir(self._dir(name)):
+            return None
+        versions = [fn[:-5] for fn in os.listdir(self._dir(name)) if fn.endswith(".json")]
+        return max(versions) if versions else None
+
+    def load(self, name: str, version: str) -> Tuple[Any, Dict]:
+        base = os.path.join(self._dir(name), version)
+        with open(base + ".json") as f:
+            meta = json.load(f)
+        with open(base + ".pkl", "rb") as f:
+            return pickle.load(f), meta
+
+
+class ESModelStore:
+    """One manifest document per version (id <name>@<version>) and the npz (model arrays plus
+    its JSON state) split into CHUNK_BYTES base64 chunks (id <name>@<version>#<n>); the
+    manifest is written last. Nothing read from the index is unpickled."""
+
+    def __init__(self, es, index=MODEL_INDEX):
+        self.es = es
+        self.index = index
+
+    def ensure_index(self):
+        if self.es.indices.exists(index=self.index):
+            return
+        self.es.indices.create(
+            index=self.index,
+            mappings={
+                "properties": {
+                    "name": {"type": "keyword"},
+                    "version": {"type": "keyword"},
+                    "manifest": {"type": "boolean"},
+                    "chunk": {"type": "integer"},
+                    "chunks": {"type": "integer"},
+                    "format": {"type": "keyword"},
+                    "data": {"type": "binary"},
+                    "meta": {"type": "object", "enabled": False}
+                }
+            }
+        )
+
+    def publish(self, name: str, model: Any, meta: Optional[Dict] = None) -> str:
+        from elasticsearch import helpers
+
+        if not isinstance(model, OnlineTopicModel):
+            raise TypeError(f"ESModelStore only publishes OnlineTopicModels, not {type(model).__name__} "
+                            "(use a LocalModelStore)")
+        arrays, state = model.export_state()
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, state=np.frombuffer(json.dumps(state).encode("utf-8"), dtype=np.uint8), **arrays)
+        blob = buffer.getvalue()
+
+        self.ensure_index()
+        version = new_version()
+        chunks = [blob[i:i + CHUNK_BYTES] for i in range(0, len(blob), CHUNK_BYTES)] or [b""]
+        helpers.bulk(self.es, (
+            {"_index": self.index, "_id": f"{name}@{version}#{n}",
+             "_source": {"name": name, "version": version, "manifest": False, "chunk": n,
+                         "data": base64.b64encode(chunk).decode("ascii")}}
+            for n, chunk in enumerate(chunks)
+        ), chunk_size=1, refresh="wait_for")
+        self.es.index(index=self.index, id=f"{name}@{version}", refresh="wait_for", document={
+            "name": name, "version": version, "manifest": True, "chunks": len(chunks), "format": ES_FORMAT,
+            "meta": {**(meta or {}), "name": name, "version": version}
+        })
+        return version
+
+    def latest_version(self, name: str) -> Optional[str]:
+        if not self.es.indices.exists(index=self.index):
+            return None
+        res = self.es.search(index=self.index, size=1, sort=[{"version": "desc"}], source=["version"],
+                             query={"bool": {"filter": [{"term": {"name": name}}, {"term": {"manifest": True}}]}})
+        hits = res["hits"]["hits"]
+        return hits[0]["_source"]["version"] if hits else None
+
+    def load(self, name: str, version: str) -> Tuple[Any, Dict]:
+        manifest = self.es.get(index=self.index, id=f"{name}@{version}")["_source"]
+        if manifest.get("format") != ES_FORMAT:
+            raise ValueError(f"{name}@{version} is not stored as {ES_FORMAT}; pickled models are not loaded from Elasticsearch")
+        parts = self.es.mget(index=self.index, ids=[f"{name}@{version}#{n}" for n in range(manifest["chunks"])])
+        blob = b"".join(base64.b64decode(doc["_source"]["data"]) for doc in parts["docs"])
+        with np.load(io.BytesIO(blob), allow_pickle=False) as npz:
+            arrays = {key: npz[key] for key in npz.files}
+        state = json.loads(arrays.pop("state").tobytes().decode("utf-8"))
+        return OnlineTopicModel.from_state(arrays, state), manifest["meta"]
+
+
+# === per-process model cache ===
+_LOADED: Dict[Tuple[int, str], Dict] = {}
+
+def load_latest(store, name: str, ttl: float = 300) -> Tuple[Optional[Any], Optional[str]]:
+    """(model, version) of the latest published model, (None, None) when there is none.
+    The version is looked up at most every ttl seconds; a model is only loaded when it changed."""
+    key = (id(store), name)
+    entry = _LOADED.get(key)
+    now = time.monotonic()
+    if entry is not None and now - entry["checked"] < ttl:
+        return entry["model"], entry["version"]
+
+    version = store.latest_version(name)
+    if entry is not None and entry["version"] == version:
+        entry["checked"] = now
+        return entry["model"], version
+    model = None
+    if version is not None:
+        model, meta = store.load(name, version)
+        if hasattr(model, "embed") and getattr(model, "embed", None) is None:
+            # pickled OnlineTopicModels leave their embedder behind
+            model.embed = SentenceEncoder(meta.get("embedding_model", DEFAULT_MODEL))
+    _LOADED[key] = {"model": model, "version": version, "checked": now}
+    return model, version
+
+
+def assign_topics(model: Any, texts: Sequence[str], embeddings=None) -> Tuple[List[int], List[str]]:
+    """Transform-only topic assignment for an OnlineTopicModel or a fitted BERTopic."""
+    texts = list(texts)
+    if not texts:
+        return [], []
+    if hasattr(model, "label"):
+        topics = model.transform(texts, embeddings)
+        return topics, [model.label(t) for t in topics]
+    topics, _ = model.transform(texts, embeddings)
+    names = model.get_topic_info().set_index("Topic")["Name"].to_dict()
+    topics = [int(t) for t in topics]
+    return topics, [names.get(t, DEFAULT_LABEL) for t in topics]
+
+
+class TopicTagger:
+    def __init__(self, store, name="comments", ttl=300):
+        self.store = store
+        self.name = name
+        self.ttl = ttl
+        self.failed: Optional[Exception] = None
+
+    def model(self):
+        return load_latest(self.store, self.name, self.ttl)
+
+    def tag_sources(self, sources: Sequence[Dict], field="content") -> Optional[str]:
+        """Set topic, topic_label and topic_model_version on each document source in one
+        batch; sources are left untouched (so `retag` picks them up) when no model is published."""
+        model, version = self.model()
+        if model is None or not sources:
+            return version
+        topics, labels = assign_topics(model, [s.get(field) or "" for s in sources])
+        for source, topic, label in zip(sources, topics, labels):
+            source["topic"] = topic
+            source["topic_label"] = label
+            source["topic_model_version"] = version
+        return version
+
+    def tag_actions(self, actions: Sequence[Dict], index_prefix: str, field="content") -> Optional[str]:
+        """tag_sources for the bulk actions going to index_prefix*. Tagging never fails an
+        ingest: the first error (a missing dependency, a model that cannot be loaded) is
+        reported once and tagging stays off for the process; documents are left for `retag`."""
+        if self.failed is not None:
+            return None
+        sources = [a["_source"] for a in actions if a.get("_index", "").startswith(index_prefix) and "_source" in a]
+        try:
+            return self.tag_sources(sources, field)
+        except Exception as e:
+            self.failed = e
+            print(f"[Topics] tagging disabled for this process, documents are left for retag: {e!r}")
+            return None
+
+
+def retag(es, index: str, tagger: TopicTagger, field="content", batch_size=500) -> int:
+    """Re-tag the documents of index whose topic_model_version is missing or not the latest."""
+    from elasticsearch import helpers
+
+    _, version = tagger.model()
+    if version is None:
+        return 0
+    # .keyword for indices created before the partition templates mapped the field
+    query = {"query": {"bool": {"must_not": [
+        {"term": {"topic_model_version": version}},
+        {"term": {"topic_model_version.keyword": version}},
+    ]}}}
+    updated = 0
+    batch: List[Dict] = []
+
+    def flush():
+        nonlocal updated
+        sources = [hit["_source"] for hit in batch]
+        tagger.tag_sources(sources, field)
+        helpers.bulk(es, (
+            {"_op_type": "update", "_index": hit["_index"], "_id": hit["_id"],
+             "doc": {k: hit["_source"][k] for k in ("topic", "topic_label", "topic_model_version")}}
+            for hit in batch
+        ), chunk_size=batch_size, raise_on_error=False)
+        updated += len(batch)
+        batch.clear()
+
+    for hit in helpers.scan(es, index=index, query=query, _source=[field]):
+        batch.append(hit)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return updated
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Publish topic models and re-tag documents")
+    p.add_argument("action", choices=["publish", "latest", "retag"])
+    p.add_argument("--name", default="comments", help="Model name (default: comments)")
+    p.add_argument("--model", help="publish: pickled fitted model (an OnlineTopicModel for Elasticsearch)")
+    p.add_argument("--embedding-model", default=DEFAULT_MODEL, help="publish: sentence-transformers model it expects")
+    p.add_argument("--index", help="retag: index pattern, e.g. housing-comments*")
+    p.add_argument("--root", help="Use a local store directory instead of Elasticsearch")
+    p.add_argument("--es-host", default="https://elasticsearch-master.elastic.svc.cluster.local:9200")
+    p.add_argument("--username", default="elastic")
+    p.add_argument("--password", default="elastic")
+    return p.parse_args()
+
+def main():
+    args = parse_args()
+    es = None
+    if not args.root or args.action == "retag":
+        from elasticsearch import Elasticsearch
+        es = Elasticsearch(hosts=args.es_host, verify_certs=False, http_auth=(args.username, args.password))
+    store = LocalModelStore(args.root) if args.root else ESModelStore(es)
+
+    if args.action == "publish":
+        with open(args.model, "rb") as f:
+            model = pickle.load(f)
+        version = store.publish(args.name, model, {"embedding_model": args.embedding_model})
+        print(f"Published {args.name} version {version}")
+    elif args.action == "latest":
+        print(store.latest_version(args.name))
+    else:
+        updated = retag(es, args.index, TopicTagger(store, args.name))
+        print(f"Re-tagged {updated} documents in {args.index}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+# COMP90024 Team 75
+# Linying Wei (1638206)
+# Wangyang Wu (1641248)
+# Ziyu Wang (1560831)
+# Roger Zhang (1079986)
+
+"""
+    Online topic modelling for streamed comments
+    Each batch of cleaned comments is embedded (through the embedding cache), reduced
+    with IncrementalPCA and assigned to micro-clusters by MiniBatchKMeans; the term
+    counts of every micro-cluster are kept as an online c-TF-IDF with exponential decay.
+    The reducer is fitted once, on the first warmup_docs documents (nothing is clustered
+    before that), and then frozen, so cluster centres from every batch live in the same
+    PCA space; transform() returns the default topic until then.
+    Topics are groups of micro-clusters: every regroup_every batches the micro-cluster
+    centres are re-grouped by cosine similarity, which merges topics that have drifted
+    together and splits ones that have drifted apart. Topic ids are kept stable across
+    regroups (a group keeps the id most of its documents had). Cost per batch grows with
+    the batch; the embedding cache adds an amortised O(batch) write and O(batch log n)
+    lookup (common/embeddings.py).
+
+    model = OnlineTopicModel(embed=EmbeddingStore("database/embeddings/all-MiniLM-L6-v2").embed)
+    model.partial_fit(texts)
+    topics = model.transform(texts)
+    labels = [model.label(t) for t in topics]
+
+    arrays, state = model.export_state()    # numpy arrays + JSON, no pickle
+    tagger_model = OnlineTopicModel.from_state(arrays, state, embed=...)   # transform-only
+"""
+
+import math
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sklearn.cluster import AgglomerativeClustering, MiniBatchKMeans
+from sklearn.decomposition import IncrementalPCA
+
+from common.terms import tokenize
+
+DEFAULT_TOPIC = -1
+DEFAULT_LABEL = "default"
+PARAMS = ("n_components", "n_clusters", "merge_threshold", "regroup_every", "decay", "top_n_words",
+          "warmup_docs")
+
+
+def _normalise(rows: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(rows, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return rows / norms
+
+def _nearest(rows: np.ndarray, centres: np.ndarray) -> np.ndarray:
+    # closest centre by squared Euclidean distance, as MiniBatchKMeans.predict
+    return ((centres ** 2).sum(axis=1) - 2 * rows @ centres.T).argmin(axis=1)
+
+
+class OnlineTopicModel:
+    # False for models rebuilt by from_state, which only carry what transform() needs
+    trainable = True
+
+    def __init__(self, n_components=10, n_clusters=50, merge_threshold=0.9, regroup_every=10,
+                 decay=0.01, top_n_words=4, embed: Optional[Callable[[List[str]], np.ndarray]] = None,
+                 random_state=42, warmup_docs=1000):
+        self.n_components = n_components
+        self.n_clusters = n_clusters
+        self.merge_threshold = merge_threshold
+        self.regroup_every = regroup_every
+        self.decay = decay
+        self.top_n_words = top_n_words
+        self.warmup_docs = warmup_docs
+        self.embed = embed
+
+        self.reducer = IncrementalPCA(n_components=n_components)
+        self.clusterer = MiniBatchKMeans(n_clusters=n_clusters, random_state=random_state, n_init=3)
+        self.cluster_terms: List[Counter] = [Counter() for _ in range(n_clusters)]
+        self.cluster_sizes = np.zeros(n_clusters)
+        self.cluster_topic = np.arange(n_clusters)
+        self.next_topic = n_clusters
+        self.fitted = False
+        self.batches = 0
+        self._decay_pending = 0
+        self._pending_texts: List[str] = []
+        self._pending_embeddings: List[np.ndarray] = []
+        self._labels: Optional[Dict[int, str]] = None
+
+    def __getstate__(self):
+        # the embedder (a model / memmap) is not part of the fitted state
+        state = self.__dict__.copy()
+        state["embed"] = None
+        return state
+
+    @property
+    def min_batch(self) -> int:
+        # IncrementalPCA and the first MiniBatchKMeans call need this many samples;
+        # the first fit also waits for the warm-up documents the reducer is fitted on
+        needed = max(self.n_components, self.n_clusters)
+        return needed if self.fitted else max(needed, self.warmup_docs)
+
+    def _embeddings(self, texts: List[str], embeddings) -> np.ndarray:
+        if embeddings is not None:
+            return np.asarray(embeddings, dtype=np.float32)
+        if self.embed is None:
+            raise ValueError("OnlineTopicModel needs embeddings or an embed function")
+        return np.asarray(self.embed(texts), dtype=np.float32)
+
+    def _reduce(self, embeddings: np.ndarray) -> np.ndarray:
+        # IncrementalPCA.transform (no whitening) on its fitted mean and components
+        centred = embeddings.astype(np.float64) - self.reducer.mean_
+        return _normalise(centred @ self.reducer.components_.T)
+
+    # === training ===
+    def partial_fit(self, texts: Sequence[str], embeddings=None) -> "OnlineTopicModel":
+        """Update the model from a batch. Batches smaller than min_batch are held back
+        and folded into the next one."""
+        if not self.trainable:
+            raise ValueError("OnlineTopicModel restored with from_state is transform-only")
+        texts = ["" if t is None else str(t) for t in texts]
+        if not texts:
+            return self
+        self._pending_texts.extend(texts)
+        self._pending_embeddings.append(self._embeddings(texts, embeddings))
+        if len(self._pending_texts) < self.min_batch:
+            return self
+
+        texts = self._pending_texts
+        embeddings = np.vstack(self._pending_embeddings)
+        self._pending_texts, self._pending_embeddings = [], []
+
+        if not self.fitted:
+            # fitted once and frozen: updating it would move the space the centres live in
+            self.reducer.fit(embeddings)
+        reduced = self._reduce(embeddings)
+        self.clusterer.partial_fit(reduced)
+        clusters = self.clusterer.predict(reduced)
+        self.fitted = True
+
+        self._decay_pending += 1
+        for cluster, text in zip(clusters, texts):
+            self.cluster_terms[cluster].update(tokenize(text))
+        self.cluster_sizes += np.bincount(clusters, minlength=self.n_clusters)
+        self.batches += 1
+        self._labels = None
+        if self.batches % self.regroup_every == 0:
+            self.regroup()
+        return self
+
+    def _apply_decay(self):
+        factor = (1 - self.decay) ** self._decay_pending
+        self._decay_pending = 0
+        if factor == 1:
+            return
+        self.cluster_sizes *= factor
+        for i, counts in enumerate(self.cluster_terms):
+            self.cluster_terms[i] = Counter({t: c * factor for t, c in counts.items() if c * factor >= 0.01})
+
+    def regroup(self):
+        """Re-group micro-clusters into topics by centre similarity (merges and splits)."""
+        self._apply_decay()
+        active = np.flatnonzero(self.cluster_sizes > 0)
+        if len(active) < 2:
+            return
+        centres = _normalise(self.clusterer.cluster_centers_[active])
+        groups = AgglomerativeClustering(
+            n_clusters=None, distance_threshold=1 - self.merge_threshold,
+            metric="cosine", linkage="average",
+        ).fit_predict(centres)
+
+        # largest groups pick first; each keeps the previous topic id with most documents in it
+        members: Dict[int, List[int]] = {}
+        for cluster, group in zip(active, groups):
+            members.setdefault(group, []).append(cluster)
+        ordered = sorted(members.values(), key=lambda cs: -self.cluster_sizes[cs].sum())
+        taken = set()
+        mapping = self.cluster_topic.copy()
+        for clusters in ordered:
+            votes: Counter = Counter()
+            for c in clusters:
+                votes[int(self.cluster_topic[c])] += self.cluster_sizes[c]
+            topic = next((t for t, _ in votes.most_common() if t not in taken), None)
+            if topic is None:
+                topic = self.next_topic
+                self.next_topic += 1
+            taken.add(topic)
+            mapping[clusters] = topic
+        self.cluster_topic = mapping
+        self._labels = None
+
+    # === inference ===
+    def transform(self, texts: Sequence[str], embeddings=None) -> List[int]:
+        texts = ["" if t is None else str(t) for t in texts]
+        if not texts:
+            return []
+        if not self.fitted:
+            return [DEFAULT_TOPIC] * len(texts)
+        reduced = self._reduce(self._embeddings(texts, embeddings))
+        return self.cluster_topic[_nearest(reduced, self.clusterer.cluster_centers_)].tolist()
+
+    def topic_terms(self) -> Dict[int, Counter]:
+        terms: Dict[int, Counter] = {}
+        for cluster, counts in enumerate(self.cluster_terms):
+            terms.setdefault(int(self.cluster_topic[cluster]), Counter()).update(counts)
+        return terms
+
+    def topic_labels(self) -> Dict[int, str]:
+        """BERTopic-style names ("3_rent_lease_landlord_bond") from class-based TF-IDF:
+        tf(term, topic) * log(1 + average words per topic / frequency of term)."""
+        if self._labels is not None:
+            return self._labels
+        terms = self.topic_terms()
+        totals: Counter = Counter()
+        for counts in terms.values():
+            totals.update(counts)
+        words = sum(sum(c.values()) for c in terms.values())
+        average = words / max(len(terms), 1)
+        labels = {}
+        for topic, counts in terms.items():
+            if not counts:
+                continue
+            scored = sorted(counts, key=lambda t: -counts[t] * math.log(1 + average / totals[t]))
+            labels[topic] = "_".join([str(topic)] + scored[:self.top_n_words])
+        self._labels = labels
+        return labels
+
+    def label(self, topic: int) -> str:
+        return self.topic_labels().get(topic, DEFAULT_LABEL)
+
+    # === serialisation ===
+    def export_state(self) -> Tuple[Dict[str, np.ndarray], Dict]:
+        """(arrays, JSON-able state) with everything transform() and label() use: the PCA
+        mean and components, micro-cluster centres, sizes and topics, and the term counts."""
+        if not self.fitted:
+            raise ValueError("OnlineTopicModel is not fitted")
+        arrays = {
+            "pca_mean": self.reducer.mean_,
+            "pca_components": self.reducer.components_,
+            "cluster_centers": self.clusterer.cluster_centers_,
+            "cluster_sizes": self.cluster_sizes,
+            "cluster_topic": self.cluster_topic,
+        }
+        state = {
+            "params": {name: getattr(self, name) for name in PARAMS},
+            "cluster_terms": [dict(counts) for counts in self.cluster_terms],
+            "next_topic": int(self.next_topic),
+            "batches": self.batches,
+        }
+        return arrays, state
+
+    @classmethod
+    def from_state(cls, arrays: Dict[str, np.ndarray], state: Dict,
+                   embed: Optional[Callable[[List[str]], np.ndarray]] = None) -> "OnlineTopicModel":
+        """Transform-only model from export_state output (partial_fit raises)."""
+        model = cls(embed=embed, **state["params"])
+        model.reducer.mean_ = np.asarray(arrays["pca_mean"], dtype=np.float64)
+        model.reducer.components_ = np.asarray(arrays["pca_components"], dtype=np.float64)
+        model.clusterer.cluster_centers_ = np.asarray(arrays["cluster_centers"], dtype=np.float64)
+        model.cluster_sizes = np.asarray(arrays["cluster_sizes"], dtype=np.float64)
+        model.cluster_topic = np.asarray(arrays["cluster_topic"], dtype=np.int64)
+        model.cluster_terms = [Counter(counts) for counts in state["cluster_terms"]]
+        model.next_topic = int(state["next_topic"])
+        model.batches = int(state["batches"])
+        model.fitted = True
+        model.trainable = False
+        return model
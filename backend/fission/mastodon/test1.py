@@ -17,9 +17,16 @@ from typing import Optional, Dict, List, Tuple
 import re
 from bs4 import BeautifulSoup
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+from common import metrics
+from common.dedup import Deduplicator
+from common.geo import UNKNOWN, account_instance, classify_state
+from common.partitions import partition_index, ensure_partition_template
+from common.rollups import bulk_with_rollups, ensure_rollup_index
+from common.topic_store import ESModelStore, TopicTagger
 
 # Base API and search settings
 API_BASE_URL = 'https://aus.social'
+HOME_INSTANCE = 'aus.social'
 STATES = ['ACT', 'NSW', 'NT', 'QLD', 'SA', 'TAS', 'VIC', 'WA']
 HASHTAGS = ['housing', 'affordability', 'rent', 'mortgage']
 KEYWORDS = HASHTAGS
@@ -31,6 +38,13 @@ def config(key: str) -> str:
     with open(f'/configs/default/shared-data/{key}', 'r') as f:
         return f.read().strip()
 
+# Optional ConfigMap keys (REDIS_HOST, PUSHGATEWAY): None when the key is not set
+def optional_config(key: str) -> Optional[str]:
+    try:
+        return config(key) or None
+    except OSError:
+        return None
+
 # HTTP headers for Mastodon API
 def get_headers():
     return {
@@ -45,6 +59,21 @@ es = Elasticsearch(
     http_auth=(config("ES_USERNAME"), config("ES_PASSWORD"))
 )
 
+# Comment topics come from the latest published model (loaded once per process)
+topic_tagger = TopicTagger(ESModelStore(es), "comments")
+
+# Optional Redis shared by every pod's near-duplicate index (REDIS_HOST in the ConfigMap)
+def dedup_redis():
+    host = optional_config("REDIS_HOST")
+    if host is None:
+        return None
+    import redis
+    return redis.Redis(host=host, port=6379, decode_responses=True, socket_connect_timeout=5, socket_timeout=5)
+
+# Boosts and copy-pasted replies reuse the sentiment of the first copy seen
+post_dedup = Deduplicator("housing-posts", redis=dedup_redis())
+comment_dedup = Deduplicator("housing-comments", redis=post_dedup.redis)
+
 # Disable SSL warnings
 urllib3.disable_warnings(category=InsecureRequestWarning)
 
@@ -103,12 +132,14 @@ def update_last_run_data(tag_since_ids: Dict[str, int]):
 # Safe GET with rate-limit handling
 def safe_get(url: str, params: Optional[Dict] = None, retries: int = 5) -> requests.Response:
     for _ in range(retries):
+        started = time.perf_counter()
         resp = requests.get(url, headers=get_headers(), params=params)
+        metrics.observe_request('mastodon', url, resp.status_code, time.perf_counter() - started)
         if resp.status_code == 429:
             req_ts = datetime.strptime(resp.headers.get('Date'), '%a, %d %b %Y %H:%M:%S %Z')
             reset_ts = datetime.strptime(resp.headers.get('X-RateLimit-Reset'), '%Y-%m-%dT%H:%M:%S.%fZ')
             wait = max((reset_ts - req_ts).total_seconds(), 60)
-            time.sleep(wait)
+            metrics.rate_limited('mastodon', wait)
             continue
         resp.raise_for_status()
         return resp
@@ -125,6 +156,7 @@ def fetch_tag_page(tag: str, since_id: Optional[str] = None, max_id: Optional[in
     return safe_get(url, params=params).json()
 
 # Clean data
+@metrics.timed_stage("clean_content")
 def clean_content(text: str) -> str:
     if not text:
         return ""
@@ -139,12 +171,17 @@ def clean_content(text: str) -> str:
 
 # Sentiment score
 analyzer = SentimentIntensityAnalyzer()
+@metrics.timed_stage("analyze_sentiment")
 def analyze_sentiment(text: str) -> Tuple[float, str]:
      vs = analyzer.polarity_scores(text)
      score = vs["compound"]
      label = "positive" if score >= 0.05 else ("negative" if score <= -0.05 else "neutral")
      return score, label
 
+def sentiment_fields(text: str) -> Dict:
+    score, label = analyze_sentiment(text)
+    return {'sentiment': label, 'sentiment_score': score}
+
 # Fetch replies for a post
 def fetch_replies(post_id: str, state: str) -> List[Dict]:
     url = f"{API_BASE_URL}/api/v1/statuses/{post_id}/context"
@@ -152,25 +189,29 @@ def fetch_replies(post_id: str, state: str) -> List[Dict]:
     out = []
     for r in data:
         created = date_parser.parse(r['created_at'])
+        # Replies inherit the post's state unless it is unknown
+        reply_state = state
+        if state == UNKNOWN:
+            reply_state = classify_state(r['content'], instance=account_instance(r['account']['acct'], HOME_INSTANCE))
         cleaned_content = clean_content(r['content'])
         # score_r = 0.0
         # sentiment_r = 'neutral'
-        score_r, sentiment_r = analyze_sentiment(cleaned_content)
+        enrichment, canonical = comment_dedup.enrich(r['id'], cleaned_content, sentiment_fields)
         out.append({
             '_op_type': 'index',
-            '_index': comment_index,
+            '_index': partition_index(comment_index, created),
             '_id': r['id'],
-            '_source': {
+            '_source': comment_dedup.link({
                 'comment_id': r['id'],
                 'post_id': post_id,
                 'platform': 'mastodon',
                 'author': r['account']['acct'],
                 'content': cleaned_content,
                 'created_at': created.isoformat(),
-                'state': state,  # Add state to comments
-                'sentiment': sentiment_r,
-                'sentiment_score': score_r
-            }
+                'state': reply_state,  # Add state to comments
+                'sentiment': enrichment['sentiment'],
+                'sentiment_score': enrichment['sentiment_score']
+            }, canonical)
         })
     return out
 
@@ -195,6 +236,11 @@ def main():
     latest_since_ids = {tag: since_ids.get(tag, "0") for tag in HASHTAGS}
 
     try:
+        # Documents go to monthly backing indices picked by created_at
+        ensure_partition_template(es, post_index, "posts")
+        ensure_partition_template(es, comment_index, "comments")
+        ensure_rollup_index(es)
+
         for tag in HASHTAGS:
                 since_id = since_ids.get(tag)
                 max_id = None
@@ -222,19 +268,20 @@ def main():
 
                         text = st.get('content', '') or ''
                         if any(kw in text.lower() for kw in KEYWORDS):
-                            # Set state as unknown - leave determination to data processing
-                            state = 'UNKNOWN'
+                            # State from the gazetteer (raw text keeps the capitalised abbreviations)
+                            state = classify_state(text, instance=account_instance(st['account']['acct'], HOME_INSTANCE))
                             text = clean_content(text)
                             # score = 0.0
                             # sentiment = 'neutral'
-                            score, sentiment = analyze_sentiment(text)
+                            # near-duplicates (boosts, cross-posts) reuse the first copy's sentiment
+                            enrichment, canonical = post_dedup.enrich(sid, text, sentiment_fields)
                             
                             # prepare post action with unique _id
                             actions.append({
                                 '_op_type': 'index',
-                                '_index': post_index,
+                                '_index': partition_index(post_index, created),
                                 '_id': sid,
-                                '_source': {
+                                '_source': post_dedup.link({
                                     'post_id': sid,
                                     'platform': 'mastodon',
                                     'author': st['account']['acct'],
@@ -242,9 +289,9 @@ def main():
                                     'created_at': created.isoformat(),
                                     'tags': [tag],
                                     'state': state,
-                                    'sentiment': sentiment,
-                                    'sentiment_score': score
-                                }
+                                    'sentiment': enrichment['sentiment'],
+                                    'sentiment_score': enrichment['sentiment_score']
+                                }, canonical)
                             })
                             seen_posts.add(sid)
                             posts_processed += 1
@@ -254,11 +301,11 @@ def main():
 
                             # If buffer full, flush
                             if len(actions) >= BULK_SIZE:
-                                success, errors = helpers.bulk(
+                                topic_tagger.tag_actions(actions, comment_index)
+                                success, errors = bulk_with_rollups(
                                     es, 
                                     actions, 
-                                    chunk_size=BULK_SIZE,
-                                    raise_on_error=False
+                                    chunk_size=BULK_SIZE
                                 )
                                 if errors:
                                     print(f"Errors in bulk operation: {errors}")
@@ -274,17 +321,19 @@ def main():
 
         # Flush any remaining actions
         if actions:
-            success, errors = helpers.bulk(
+            topic_tagger.tag_actions(actions, comment_index)
+            success, errors = bulk_with_rollups(
                 es, 
                 actions, 
-                chunk_size=BULK_SIZE,
-                raise_on_error=False
+                chunk_size=BULK_SIZE
             )
             if errors:
                 print(f"Errors in final bulk operation: {errors}")
         
         # Update the since_ids after successful completion
         update_last_run_data(latest_since_ids)
+        print(post_dedup.summary())
+        print(comment_dedup.summary())
         
         return jsonify({
             'message': f'Incremental harvest complete. Processed {posts_processed} new posts.',
@@ -296,4 +345,7 @@ def main():
         return jsonify({
             'message': f'Error during incremental harvest: {str(e)}',
             'last_run': last_run_time.isoformat()
-        }), 500
\ No newline at end of file
+        }), 500
+    finally:
+        # The pod may be gone before a scrape, so push this invocation's metrics
+        metrics.push("mastodon-harvester", optional_config("PUSHGATEWAY"))
@@ -0,0 +1,223 @@
+# COMP90024 Team 75
+# Linying Wei (1638206)
+# Wangyang Wu (1641248)
+# Ziyu Wang (1560831)
+# Roger Zhang (1079986)
+
+"""
+    Seen-ID sidecar index for the local harvesters' JSON-lines files
+    <data>.ids holds a 16-byte header (magic, bytes of <data> covered) followed by
+    (id, byte offset) int64 pairs sorted by id; it is mmap'd, so opening costs nothing and
+    a lookup is a binary search. New records go to <data>.ids.log as unsorted pairs and
+    are merged into <data>.ids every compact_every records and on close. Lines of <data>
+    past what the index covers (a crash between the two writes, or files harvested before
+    the index existed) are scanned once on open.
+    IDs are decoded to integers: base 10 for Mastodon status IDs, base 36 for Reddit.
+
+    posts = IdIndex('data/reddit/VIC/posts.json', 'post_id', base=36)
+    with open('data/reddit/VIC/posts.json', 'ab') as out:
+        if sid not in posts:
+            posts.append(out, sid, post_doc)
+    posts.get(sid)      # the record, read from its offset
+    posts.close()
+"""
+
+import bisect
+import heapq
+import json
+import mmap
+import os
+import struct
+from array import array
+from typing import Dict, Iterator, Optional, Tuple
+
+MAGIC = b"IDIDX\x00\x01\x00"
+HEADER = struct.Struct("<8sq")
+PAIR = struct.Struct("<qq")
+
+
+class _Keys:
+    # ids of the sorted pairs, as a sequence bisect can search
+    def __init__(self, view):
+        self.view = view
+
+    def __len__(self):
+        return len(self.view) // 2
+
+    def __getitem__(self, i):
+        return self.view[2 * i]
+
+
+class IdIndex:
+    def __init__(self, data_path, field, base=10, compact_every=4096):
+        self.data_path = data_path
+        self.field = field
+        self.base = base
+        self.compact_every = compact_every
+        self.path = data_path + ".ids"
+        self.log_path = self.path + ".log"
+        self._mm = None
+        self._view = None
+        self._keys = None
+        self._covered = 0
+        self._log: Dict[int, int] = {}
+
+        data_size = os.path.getsize(data_path) if os.path.exists(data_path) else 0
+        if not os.path.exists(self.path):
+            self._write_sorted(iter(()), 0)
+        self._open_sorted()
+        self._load_log()
+        if self._covered > data_size:
+            # data file was truncated or replaced: start over
+            self._log = {}
+            self._close_sorted()
+            self._write_sorted(iter(()), 0)
+            self._open_sorted()
+            open(self.log_path, "wb").close()
+        self._log_out = open(self.log_path, "ab")
+        if data_size > self._covered:
+            self._scan(self._covered)
+
+    def encode(self, record_id) -> int:
+        return int(str(record_id), self.base)
+
+    # === lookups ===
+    def offset(self, record_id) -> Optional[int]:
+        try:
+            key = self.encode(record_id)
+        except ValueError:
+            return None
+        return self._find(key)
+
+    def _find(self, key) -> Optional[int]:
+        if key in self._log:
+            return self._log[key]
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return self._view[2 * i + 1]
+        return None
+
+    def __contains__(self, record_id) -> bool:
+        return self.offset(record_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._keys) + len(self._log)
+
+    def get(self, record_id) -> Optional[Dict]:
+        # Random access to a record by ID
+        offset = self.offset(record_id)
+        if offset is None:
+            return None
+        with open(self.data_path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    # === writes ===
+    def add(self, record_id, offset):
+        self._record(self.encode(record_id), offset)
+        if len(self._log) >= self.compact_every:
+            self.compact()
+
+    def _record(self, key, offset):
+        self._log[key] = offset
+        self._log_out.write(PAIR.pack(key, offset))
+        self._log_out.flush()
+
+    def append(self, out, record_id, doc):
+        """Write doc as a JSON line to out (a binary append-mode file of data_path) and index it.
+        The line is flushed before the index entry, so the index never points past the data."""
+        offset = out.tell()
+        out.write((json.dumps(doc, ensure_ascii=False) + "\n").encode("utf-8"))
+        out.flush()
+        self.add(record_id, offset)
+
+    def compact(self):
+        """Merge the append log into the sorted file."""
+        covered = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        pending = sorted(self._log.items())
+        merged = heapq.merge(
+            ((self._view[2 * i], self._view[2 * i + 1]) for i in range(len(self._keys))),
+            iter(pending),
+        )
+        self._write_sorted(merged, covered)
+        self._close_sorted()
+        self._open_sorted()
+        self._log = {}
+        self._log_out.seek(0)
+        self._log_out.truncate()
+
+    def close(self):
+        self.compact()
+        self._log_out.close()
+        self._close_sorted()
+
+    # === files ===
+    def _write_sorted(self, pairs: Iterator[Tuple[int, int]], covered):
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, covered))
+            block = array("q")
+            last = None
+            for key, offset in pairs:
+                if key == last:
+                    continue
+                last = key
+                block.append(key)
+                block.append(offset)
+                if len(block) >= 2**16:
+                    block.tofile(f)
+                    block = array("q")
+            block.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def _open_sorted(self):
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._covered = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not an ID index")
+        self._view = memoryview(self._mm)[HEADER.size:].cast("q")
+        self._keys = _Keys(self._view)
+
+    def _close_sorted(self):
+        self._keys = None
+        self._view.release()
+        self._mm.close()
+
+    def _load_log(self):
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % PAIR.size
+        for key, offset in PAIR.iter_unpack(data[:usable]):
+            self._log[key] = offset
+        if self._log and os.path.exists(self.data_path):
+            # the log's last record ends where the covered part of the data file ends
+            last = max(self._log.values())
+            with open(self.data_path, "rb") as f:
+                f.seek(last)
+                self._covered = max(self._covered, last + len(f.readline()))
+        if usable != len(data):
+            with open(self.log_path, "r+b") as f:
+                f.truncate(usable)
+
+    def _scan(self, start):
+        # Index complete lines of the data file from byte start on
+        with open(self.data_path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    key = self.encode(json.loads(line)[self.field])
+                    if self._find(key) is None:
+                        self._record(key, offset)
+                except (ValueError, KeyError, TypeError):
+                    pass
+                offset += len(line)
+        # covered only moves once the whole tail is indexed
+        self.compact()
@@ -12,6 +12,8 @@ from datetime import datetime, timedelta, timezone
 from dateutil import parser as date_parser
 import requests
 
+from id_index import IdIndex
+
 # Prompt for credentials
 API_BASE_URL = 'https://aus.social'
 ACCESS_TOKEN = getpass.getpass("Mastodon ACCESS_TOKEN: ").strip()
@@ -73,26 +75,12 @@ if __name__ == '__main__':
         comments_fp = os.path.join(base,'comments.json')
         print(f"\n--- Mastodon STATE={state} ---")
 
-        # Load already-harvested post and comment IDs to skip duplicates
-        seen_posts = set()
-        if os.path.exists(posts_fp):
-            with open(posts_fp,'r',encoding='utf-8') as f:
-                for line in f:
-                    try:
-                        seen_posts.add(json.loads(line)['post_id'])
-                    except Exception:
-                        continue
-        seen_comments = set()
-        if os.path.exists(comments_fp):
-            with open(comments_fp,'r',encoding='utf-8') as f:
-                for line in f:
-                    try:
-                        seen_comments.add(json.loads(line)['comment_id'])
-                    except Exception:
-                        continue
+        # Already-harvested post and comment IDs (sidecar indexes) to skip duplicates
+        seen_posts = IdIndex(posts_fp, 'post_id', base=10)
+        seen_comments = IdIndex(comments_fp, 'comment_id', base=10)
 
         max_id = None
-        with open(posts_fp,'a',encoding='utf-8') as p_out, open(comments_fp,'a',encoding='utf-8') as c_out:
+        with open(posts_fp,'ab') as p_out, open(comments_fp,'ab') as c_out:
             for tag in HASHTAGS:
                 while True:
                     statuses = fetch_tag_page(tag, max_id)
@@ -116,17 +104,17 @@ if __name__ == '__main__':
                                 'created_at': created.isoformat(),
                                 'tags':       [tag]
                             }
-                            p_out.write(json.dumps(post_doc, ensure_ascii=False) + "\n")
-                            seen_posts.add(sid)
+                            seen_posts.append(p_out, sid, post_doc)
                             replies = fetch_replies(sid)
                             for c in replies:
                                 cid = c['comment_id']
                                 if cid in seen_comments:
                                     continue
-                                c_out.write(json.dumps(c, ensure_ascii=False) + "\n")
-                                seen_comments.add(cid)
+                                seen_comments.append(c_out, cid, c)
                             print(f"Saved {sid} (+{len(replies)} replies)")
                     if not statuses or (created < START_DATE):
                         break
                     max_id = int(statuses[-1]['id']) - 1
-                    time.sleep(1)
\ No newline at end of file
+                    time.sleep(1)
+        seen_posts.close()
+        seen_comments.close()
\ No newline at end of file
@@ -12,6 +12,8 @@ from datetime import datetime, timedelta, timezone
 import praw
 import prawcore
 
+from id_index import IdIndex
+
 # Prompt for credentials
 CLIENT_ID     = 'Sm5Hyq-3pIgg_Gqb9RLmOQ'
 CLIENT_SECRET = getpass.getpass("Reddit CLIENT_SECRET: ").strip()
@@ -37,9 +39,10 @@ def reddit_safe_call(func, *args, retries=5, **kwargs):
 def fetch_comments(subm, seen_comments):
     subm.comments.replace_more(limit=None)
     out = []
+    batch = set()
     for c in subm.comments.list():
         cid = c.id
-        if cid in seen_comments:
+        if cid in seen_comments or cid in batch:
             continue
         comment = {
             'comment_id': cid,
@@ -50,7 +53,7 @@ def fetch_comments(subm, seen_comments):
             'created_at': datetime.fromtimestamp(c.created_utc, timezone.utc).isoformat()
         }
         out.append(comment)
-        seen_comments.add(cid)
+        batch.add(cid)
     return out
 
 if __name__ == '__main__':
@@ -61,25 +64,11 @@ if __name__ == '__main__':
         comments_fp = os.path.join(base,'comments.json')
         print(f"\n--- Reddit STATE={state} ---")
 
-        # Load existing IDs
-        seen_posts = set()
-        if os.path.exists(posts_fp):
-            with open(posts_fp,'r',encoding='utf-8') as f:
-                for line in f:
-                    try:
-                        seen_posts.add(json.loads(line)['post_id'])
-                    except:
-                        continue
-        seen_comments = set()
-        if os.path.exists(comments_fp):
-            with open(comments_fp,'r',encoding='utf-8') as f:
-                for line in f:
-                    try:
-                        seen_comments.add(json.loads(line)['comment_id'])
-                    except:
-                        continue
+        # Existing IDs (sidecar indexes)
+        seen_posts = IdIndex(posts_fp, 'post_id', base=36)
+        seen_comments = IdIndex(comments_fp, 'comment_id', base=36)
 
-        with open(posts_fp,'a',encoding='utf-8') as p_out, open(comments_fp,'a',encoding='utf-8') as c_out:
+        with open(posts_fp,'ab') as p_out, open(comments_fp,'ab') as c_out:
             for sub in SUBREDDITS:
                 for kw in KEYWORDS:
                     submissions = reddit_safe_call(reddit.subreddit(sub).search, kw, time_filter='all', limit=MAX_KW)
@@ -96,9 +85,10 @@ if __name__ == '__main__':
                             'created_at': datetime.fromtimestamp(subm.created_utc, timezone.utc).isoformat(),
                             'tags':       [sub]
                         }
-                        p_out.write(json.dumps(post_doc, ensure_ascii=False) + "\n")
-                        seen_posts.add(sid)
+                        seen_posts.append(p_out, sid, post_doc)
                         comments = reddit_safe_call(fetch_comments, subm, seen_comments)
                         for comment in comments:
-                            c_out.write(json.dumps(comment, ensure_ascii=False) + "\n")
+                            seen_comments.append(c_out, comment['comment_id'], comment)
                         print(f"Saved {sid} (+{len(comments)} comments)")
+        seen_posts.close()
+        seen_comments.close()
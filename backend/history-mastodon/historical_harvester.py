@@ -17,9 +17,14 @@ import urllib3
 from urllib3.exceptions import InsecureRequestWarning
 import sys
 import os
+from common import metrics
+from common.geo import UNKNOWN, account_instance, classify_state
+from common.partitions import partition_index, ensure_partition_template
+from common.rollups import bulk_with_rollups, ensure_rollup_index
 
 # Base API and search settings
 API_BASE_URL = 'https://aus.social'
+HOME_INSTANCE = 'aus.social'
 HASHTAGS = ['housing', 'affordability', 'rent', 'mortgage']
 KEYWORDS = HASHTAGS
 POST_INDEX = "history-mastodon-posts"
@@ -61,7 +66,9 @@ urllib3.disable_warnings(category=InsecureRequestWarning)
 def safe_get(url, params=None, retries=5):
     for attempt in range(retries):
         try:
+            started = time.perf_counter()
             resp = requests.get(url, headers=get_headers(), params=params)
+            metrics.observe_request('mastodon', url, resp.status_code, time.perf_counter() - started)
             if resp.status_code == 429:
                 # More robust header parsing with defaults
                 wait = 60  # Default wait time
@@ -75,7 +82,7 @@ def safe_get(url, params=None, retries=5):
                 
                 wait += random.uniform(0, 1)  
                 print(f"Rate limited. Waiting {wait:.2f} seconds...")
-                time.sleep(wait)
+                metrics.rate_limited('mastodon', wait)
                 continue
             resp.raise_for_status()
             return resp
@@ -87,7 +94,7 @@ def safe_get(url, params=None, retries=5):
             print(f"Error in request: {e}")
             if attempt == retries - 1:
                 raise
-        time.sleep(min(2 ** attempt, 60) + random.uniform(0, 1))  
+        metrics.sleep('mastodon', min(2 ** attempt, 60) + random.uniform(0, 1))
     raise RuntimeError(f"Failed GET {url} after {retries} retries")
 
 # Fetch one page of tag timeline
@@ -105,9 +112,13 @@ def fetch_replies(post_id, state, is_historical=True):
     out = []
     for r in data:
         created = date_parser.parse(r['created_at'])
+        # Replies inherit the post's state unless it is unknown
+        reply_state = state
+        if state == UNKNOWN:
+            reply_state = classify_state(r['content'], instance=account_instance(r['account']['acct'], HOME_INSTANCE))
         out.append({
             '_op_type': 'index',
-            '_index': COMMENT_INDEX,
+            '_index': partition_index(COMMENT_INDEX, created),
             '_id': r['id'],
             '_source': {
                 'comment_id': r['id'],
@@ -116,7 +127,7 @@ def fetch_replies(post_id, state, is_historical=True):
                 'author': r['account']['acct'],
                 'content': r['content'],
                 'created_at': created.isoformat(),
-                'state': state,
+                'state': reply_state,
                 'historical_harvest': is_historical  # Add flag to comments too
             }
         })
@@ -124,6 +135,10 @@ def fetch_replies(post_id, state, is_historical=True):
 
 def harvest_historical_data(tags, start_date, end_date, batch_size=100):
     es = init_elasticsearch()
+    # Backfilled documents land in the monthly partition of their created_at
+    ensure_partition_template(es, POST_INDEX, "posts")
+    ensure_partition_template(es, COMMENT_INDEX, "comments")
+    ensure_rollup_index(es)
     print(f"Starting historical harvest from {start_date.isoformat()} to {end_date.isoformat()} for tags: {tags}")
     
     # Track progress for all tags
@@ -166,13 +181,13 @@ def harvest_historical_data(tags, start_date, end_date, batch_size=100):
                 
                 text = st.get('content', '') or ''
                 
-                # Set state as unknown - leave determination to data processing
-                state = 'UNKNOWN'
+                # State from the gazetteer and the author's instance
+                state = classify_state(text, instance=account_instance(st['account']['acct'], HOME_INSTANCE))
                 
                 # Prepare post action with unique _id
                 actions.append({
                     '_op_type': 'index',
-                    '_index': POST_INDEX,
+                    '_index': partition_index(POST_INDEX, created),
                     '_id': sid,
                     '_source': {
                         'post_id': sid,
@@ -194,11 +209,10 @@ def harvest_historical_data(tags, start_date, end_date, batch_size=100):
                 # If buffer full, flush
                 if len(actions) >= batch_size:
                     try:
-                        success, errors = helpers.bulk(
+                        success, errors = bulk_with_rollups(
                             es, 
                             actions, 
-                            chunk_size=batch_size,
-                            raise_on_error=False
+                            chunk_size=batch_size
                         )
                         total_posts_harvested += posts_processed
                         if errors:
@@ -222,11 +236,10 @@ def harvest_historical_data(tags, start_date, end_date, batch_size=100):
         # Flush any remaining actions at the end of each tag
         if actions:
             try:
-                success, errors = helpers.bulk(
+                success, errors = bulk_with_rollups(
                     es, 
                     actions, 
-                    chunk_size=batch_size,
-                    raise_on_error=False
+                    chunk_size=batch_size
                 )
                 total_posts_harvested += posts_processed
                 if errors:
@@ -254,10 +267,14 @@ def parse_args():
                       help='End month for harvesting (default: 12)')
     parser.add_argument('--batch-size', type=int, default=100,
                       help='Batch size for ES bulk operations (default: 100)')
+    parser.add_argument('--metrics-port', type=int, default=int(os.environ.get('METRICS_PORT', 0)),
+                      help='Serve Prometheus metrics on this port (default: $METRICS_PORT, 0 = off)')
     return parser.parse_args()
 
 def main():
     args = parse_args()
+    if metrics.serve(args.metrics_port):
+        print(f"Serving metrics on :{args.metrics_port}/metrics")
     
     start_date = datetime(args.start_year, args.start_month, 1, tzinfo=timezone.utc)
     
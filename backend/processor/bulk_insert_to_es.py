@@ -10,13 +10,22 @@
     Hardcode json files to ES
 """
 
+import json
+import os
+import sys
 import pandas as pd
-import requests
 import re
 from urllib.parse import urlparse
 from sklearn.feature_extraction.text import CountVectorizer
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 from bertopic import BERTopic
+from elasticsearch import Elasticsearch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.embeddings import EmbeddingStore
+from common.geo import UNKNOWN, classify_states
+from common.rollups import bulk_with_rollups, ensure_rollup_index
+from common.topic_store import LocalModelStore, assign_topics, load_latest
 
 
 # === Step 1: Load data ===
@@ -46,37 +55,18 @@ merged_df = comments_df_flat.merge(
 )
 
 # === Step 4: Infer state from post title ===
-def infer_state(title, url):
-    title = str(title).lower()
-    if "melbourne" in title or "melb" in title or "victoria" in title or "vic" in title:
-        return "VIC"
-    elif "sydney" in title or "syd" in title or "nsw" in title:
-        return "NSW"
-    elif "queensland" in title or "brisbane" in title or "qld" in title:
-        return "QLD"
-    elif "perth" in title or "wa" in title:
-        return "WA"
-    elif "adelaide" in title or "sa" in title:
-        return "SA"
-    elif "tasmania" in title or "hobart" in title or "tas" in title:
-        return "TAS"
-    elif "darwin" in title or "nt" in title:
-        return "NT"
-
-    from urllib.parse import urlparse
-    path = urlparse(str(url)).path.lower()
-    if "/r/melbourne" in path: return "VIC"
-    if "/r/sydney" in path: return "NSW"
-    if "/r/brisbane" in path: return "QLD"
-    if "/r/perth" in path: return "WA"
-    if "/r/adelaide" in path: return "SA"
-    if "/r/hobart" in path: return "TAS"
-    if "/r/darwin" in path: return "NT"
-
-    return ""
-
-posts_df["state"] = posts_df.apply(lambda row: infer_state(row["title"], row["url"]), axis=1)
-merged_df["state"] = merged_df.apply(lambda row: infer_state(row["title"], row["url"]), axis=1)
+# Gazetteer classifier (common/geo.py) over the whole column in one pass,
+# with the subreddit from the post URL as a hint
+def subreddit_from_url(url):
+    parts = urlparse(str(url)).path.strip("/").split("/")
+    return parts[1] if len(parts) > 1 and parts[0].lower() == "r" else None
+
+def infer_state(titles, urls):
+    states = classify_states(titles.astype(str), subreddits=urls.map(subreddit_from_url))
+    return ["" if state == UNKNOWN else state for state in states]
+
+posts_df["state"] = infer_state(posts_df["title"], posts_df["url"])
+merged_df["state"] = infer_state(merged_df["title"], merged_df["url"])
 
 # Clean the raw data
 def clean_text(text):
@@ -122,25 +112,46 @@ renamed_df["sentiment"] = renamed_df["text"].apply(get_sentiment)
 renamed_df["sentiment_score"] = renamed_df["text"].apply(get_sentiment_score)
 
 # === Topic Modeling with BERTopic ===
-vectorizer_model = CountVectorizer(
-    stop_words="english",
-    ngram_range=(1, 2),
-    min_df=5
-)
-topic_model = BERTopic(vectorizer_model=vectorizer_model)
-topics, _ = topic_model.fit_transform(renamed_df["text"].tolist())
-renamed_df["topic"] = topics
-
-topic_info = topic_model.get_topic_info()
-topic_labels = topic_info.set_index("Topic")["Name"].to_dict()
-renamed_df["topic_label"] = renamed_df["topic"].map(topic_labels)
+# Sentence embeddings are cached by content hash across runs; only new texts are encoded
+EMBEDDING_STORE   = "database/embeddings/all-MiniLM-L6-v2"
+EMBEDDING_BATCH   = 64
+EMBEDDING_THREADS = os.cpu_count()
+
+texts = renamed_df["text"].tolist()
+embedding_store = EmbeddingStore(EMBEDDING_STORE)
+embeddings = embedding_store.embed(texts, batch_size=EMBEDDING_BATCH, threads=EMBEDDING_THREADS)
+
+# The fitted model is versioned in the local topic store; later runs only transform
+# unless --retrain-topics is given
+TOPIC_STORE    = "database/topic-models"
+RETRAIN_TOPICS = "--retrain-topics" in sys.argv
+
+topic_store = LocalModelStore(TOPIC_STORE)
+topic_model, topic_version = (None, None) if RETRAIN_TOPICS else load_latest(topic_store, "comments")
+if topic_model is None:
+    vectorizer_model = CountVectorizer(
+        stop_words="english",
+        ngram_range=(1, 2),
+        min_df=5
+    )
+    topic_model = BERTopic(vectorizer_model=vectorizer_model, embedding_model=embedding_store.model_name)
+    topics, _ = topic_model.fit_transform(texts, embeddings)
+    topic_version = topic_store.publish("comments", topic_model, {"embedding_model": embedding_store.model_name})
+    print(f"Published topic model version {topic_version}")
+    topic_info = topic_model.get_topic_info()
+    topic_labels = topic_info.set_index("Topic")["Name"].to_dict()
+    renamed_df["topic"] = topics
+    renamed_df["topic_label"] = renamed_df["topic"].map(topic_labels)
+else:
+    renamed_df["topic"], renamed_df["topic_label"] = assign_topics(topic_model, texts, embeddings)
+renamed_df["topic_model_version"] = topic_version
 
 # === Step 5a: Prepare comments upload DataFrame ===
 comment_fields = [
     "comment_id", "post_id", "text", "author", "score", "title", "url", "state",
-    "sentiment", "sentiment_score", "topic", "topic_label"
+    "sentiment", "sentiment_score", "topic", "topic_label", "topic_model_version", "created_utc"
 ]
-comments_to_upload = renamed_df[comment_fields]
+comments_to_upload = renamed_df[[field for field in comment_fields if field in renamed_df.columns]]
 
 # === Step 5b: Prepare posts upload DataFrame ===
 # Assign post.topic as most common comment.topic
@@ -152,41 +163,39 @@ posts_to_upload = posts_to_upload.merge(top_label_by_post, on="post_id", how="le
 
 # posts_to_upload = posts_df.rename(columns={"id": "post_id"}).drop_duplicates("post_id")
 
-# === Step 6a: Upload comments to ES ===
-print(f"Uploading comments: {len(comments_to_upload)} records")
-comment_result = {"success": 0, "fail": 0}
-
-for _, row in comments_to_upload.iterrows():
+# === Step 6: Upload to ES ===
+# Through bulk_with_rollups, so the daily rollups and term buckets the dashboards read
+# (visualization/analysis.py) count every document this script creates. created_at
+# comes from the Reddit created_utc, which the rollups bucket by day.
+es = Elasticsearch("http://localhost:9200")
+ensure_rollup_index(es)
+
+def with_created_at(df):
+    df = df.copy()
+    if "created_utc" in df.columns:
+        df["created_at"] = pd.to_datetime(df["created_utc"], unit="s", utc=True).map(lambda t: t.isoformat())
+    df["platform"] = "reddit"
+    return df
+
+def upload_docs(index, df, id_field, label):
+    print(f"Uploading {label}: {len(df)} records")
+    actions = []
+    for _, row in df.iterrows():
+        doc = json.loads(row.dropna().to_json())
+        actions.append({"_index": index, "_id": str(doc[id_field]), "_source": doc})
+    result = {"success": 0, "fail": 0}
     try:
-        doc = row.dropna().to_dict()
-        url = f"http://localhost:9200/housing_comments/_doc/{doc['comment_id']}"
-        res = requests.put(url, json=doc)
-        if res.status_code in [200, 201]:
-            comment_result["success"] += 1
-        else:
-            print("Comment Failed:", res.status_code, res.text)
-            comment_result["fail"] += 1
+        success, errors = bulk_with_rollups(es, actions, chunk_size=500, content_field="text")
+        result = {"success": success, "fail": len(errors)}
+        for item in errors[:10]:
+            print(f"{label.capitalize()} Failed:", item)
     except Exception as e:
-        print("Comment Error:", str(e))
-        comment_result["fail"] += 1
-
-# === Step 6b: Upload posts to ES ===
-print(f"Uploading posts: {len(posts_to_upload)} records")
-post_result = {"success": 0, "fail": 0}
+        print(f"{label.capitalize()} Error:", str(e))
+        result["fail"] = len(actions)
+    return result
 
-for _, row in posts_to_upload.iterrows():
-    try:
-        doc = row.dropna().to_dict()
-        url = f"http://localhost:9200/housing_posts/_doc/{doc['post_id']}"
-        res = requests.put(url, json=doc)
-        if res.status_code in [200, 201]:
-            post_result["success"] += 1
-        else:
-            print("Post Failed:", res.status_code, res.text)
-            post_result["fail"] += 1
-    except Exception as e:
-        print("Post Error:", str(e))
-        post_result["fail"] += 1
+comment_result = upload_docs("housing_comments", with_created_at(comments_to_upload), "comment_id", "comments")
+post_result = upload_docs("housing_posts", with_created_at(posts_to_upload), "post_id", "posts")
 
 # === Summary ===
 print("Upload completed:")
@@ -8,22 +8,35 @@
 
 """
     main
-    1. trigger harvesters (each max 2 mins for testing)
-    2. wait for data/**/*.json
-    3. merge data/**/*.json → database/posts.json & database/comments.json
-    4. trigger upload_to_es.py
+    1. start every harvester at once (each max 2 mins for testing)
+    2. tail data/**/posts.json & comments.json while they run
+    3. append new lines → database/posts.json & database/comments.json as they arrive
+       (byte offsets per source in database/merge-manifest.json, so re-runs merge only new data)
+    4. upload merged lines in batches on a background thread (upload_to_es); lines that are not
+       acknowledged are sent again with backoff, and the acknowledged offset of each merged
+       output (database/upload-manifest.json) lets the next run upload whatever this one could not
 """
 
+import argparse
 import subprocess
 import glob
 import os
+import queue
+import re
 import sys
+import threading
 import time
 import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 BASE_DIR   = os.path.abspath(os.path.join(SCRIPT_DIR, "..", ".."))
 
+sys.path.insert(0, SCRIPT_DIR)
+import upload_to_es
+from common import metrics
+
 
 HARVEST_TIMEOUT = 60 * 2 # for debug
 HARVESTERS = [
@@ -39,79 +52,328 @@ HARVESTERS = [
 
 POSTS_JSON    = os.path.join(BASE_DIR, "database", "posts.json")
 COMMENTS_JSON = os.path.join(BASE_DIR, "database", "comments.json")
-UPLOAD_SCRIPT = os.path.join(BASE_DIR, "backend", "processor", "upload_to_es.py")
-
-def run_harvester(path, timeout=HARVEST_TIMEOUT):
-    print(f"▶ Running harvester (timeout {timeout}s): {path}")
-    try:
-        subprocess.run([sys.executable, path], check=True, timeout=timeout)
-    except subprocess.TimeoutExpired:
-        print(f"[Warn] Harvester timed out: {path}")
-    except subprocess.CalledProcessError as e:
-        print(f"[Error] Harvester failed: {path} → {e}")
-
-def wait_for_any(pattern, timeout=300, interval=2):
-    print(f"Waiting for files matching: {pattern}")
-    start = time.time()
-    while time.time() - start < timeout:
-        matches = glob.glob(pattern, recursive=True)
-        if matches:
-            print(f"Found {len(matches)} files")
-            return
-        time.sleep(interval)
-    print(f"[Warn] No files found for pattern within timeout: {pattern}")
+MANIFEST_JSON = os.path.join(BASE_DIR, "database", "merge-manifest.json")
+UPLOAD_MANIFEST_JSON = os.path.join(BASE_DIR, "database", "upload-manifest.json")
+SOURCE_GLOBS  = {
+    "posts":    os.path.join(BASE_DIR, "data", "**", "posts.json"),
+    "comments": os.path.join(BASE_DIR, "data", "**", "comments.json"),
+}
+ES_HOST = "http://localhost:9200"
 
-if __name__ == "__main__":
-    for fn in (POSTS_JSON, COMMENTS_JSON):
+POLL_INTERVAL  = 2      # seconds between tail passes
+UPLOAD_BATCH   = 500    # lines per upload call
+UPLOAD_LINGER  = 10     # seconds a partial batch waits for more lines
+UPLOAD_RETRY   = 5      # seconds before unacknowledged lines are sent again, doubling per failure
+UPLOAD_RETRY_MAX = 300
+UPLOAD_FINAL_ATTEMPTS = 3   # attempts left for unacknowledged lines once harvesting is over
+TOPIC_PUBLISH_EVERY = 20    # upload batches between publishes of the online topic model
+
+def start_harvester(path):
+    print(f"▶ Starting harvester (timeout {HARVEST_TIMEOUT}s): {path}")
+    # harvesters write data/<platform>/<state>/ relative to their working directory
+    return {"path": path, "proc": subprocess.Popen([sys.executable, path], cwd=BASE_DIR), "started": time.time()}
+
+def check_harvester(h):
+    # True while the harvester is still running; kills it once it exceeds HARVEST_TIMEOUT
+    code = h["proc"].poll()
+    if code is None:
+        if time.time() - h["started"] < HARVEST_TIMEOUT:
+            return True
+        print(f"[Warn] Harvester timed out: {h['path']}")
+        h["proc"].kill()
+        h["proc"].wait()
+    elif code != 0:
+        print(f"[Error] Harvester failed: {h['path']} → exit status {code}")
+    return False
+
+class Tail:
+    """Follows one harvester output file from a byte offset and returns the complete
+    lines appended since the last read, as bytes."""
+
+    def __init__(self, path, offset=0):
+        self.path = path
+        self.offset = offset
+        self.state = os.path.basename(os.path.dirname(path))
+        self.platform = os.path.basename(os.path.dirname(os.path.dirname(path)))
+        self.suffix = (', "state": ' + json.dumps(self.state, ensure_ascii=False) +
+                       ', "platform": ' + json.dumps(self.platform, ensure_ascii=False)).encode("utf-8")
+
+    def read_new(self):
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return b""
+        if size < self.offset:
+            print(f"[Warn] {self.path} shrank, merging it again from the start")
+            self.offset = 0
+        if size == self.offset:
+            return b""
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        # leave a partially written last line for the next pass
+        end = data.rfind(b"\n") + 1
+        self.offset += end
+        return data[:end]
+
+    def annotate(self, data):
+        # Tag each line with state and platform by splicing them in before the closing brace
+        out = []
+        for line in data.splitlines():
+            line = line.rstrip()
+            if not line:
+                continue
+            if line.endswith(b"}") and line[:-1].rstrip() != b"{" and not _TAGGED.search(line):
+                out.append(line[:-1] + self.suffix + b"}\n")
+                continue
+            try:
+                obj = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"[Warn] Skipping malformed line in {self.path}")
+                continue
+            obj["state"] = self.state
+            obj["platform"] = self.platform
+            out.append(json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n")
+        return b"".join(out)
+
+# lines that already carry state/platform are re-encoded so the keys are not duplicated
+_TAGGED = re.compile(rb'"(?:state|platform)"\s*:')
+
+class Merger:
+    """Appends new harvester lines, tagged with state and platform, to database/*.json
+    and hands them to the upload queue. The byte offset reached in every source file and
+    the size of every output are kept in a manifest, so each run merges only new data."""
+
+    def __init__(self, upload_queue, manifest_path=MANIFEST_JSON, jobs=4):
+        self.upload_queue = upload_queue
+        self.manifest_path = manifest_path
+        self.jobs = jobs
+        self.outputs = {"posts": POSTS_JSON, "comments": COMMENTS_JSON}
+        self.merged = {"posts": 0, "comments": 0}
+        self.tails = {}
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self):
         try:
-            os.remove(fn)
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            manifest = {"sources": {}, "outputs": {}}
+        # an output smaller than recorded was removed or replaced: merge everything again
+        if any(self.size(path) < manifest["outputs"].get(kind, 0) for kind, path in self.outputs.items()):
+            print("[Warn] Merged outputs do not match the manifest, rebuilding them")
+            manifest = {"sources": {}, "outputs": {}}
+        # drop anything appended after the last manifest save (e.g. an interrupted run)
+        for kind, path in self.outputs.items():
+            with open(path, "ab") as out:
+                out.truncate(manifest["outputs"].get(kind, 0))
+        return manifest
+
+    def save_manifest(self):
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp, self.manifest_path)
+
+    @staticmethod
+    def size(path):
+        try:
+            return os.path.getsize(path)
         except FileNotFoundError:
-            pass
+            return 0
+
+    def poll(self):
+        for kind, pattern in SOURCE_GLOBS.items():
+            for fn in glob.glob(pattern, recursive=True):
+                if fn not in self.tails:
+                    key = os.path.relpath(fn, BASE_DIR)
+                    self.tails[fn] = (kind, Tail(fn, self.manifest["sources"].get(key, 0)))
 
-    # 1. trigger each harvester
-    for h in HARVESTERS:
-        run_harvester(h["script"])
-        wait_for_any(h["data_glob"])
+        def read(item):
+            kind, tail = item
+            return kind, tail, tail.annotate(tail.read_new())
 
-    # 2. merge data/**/*.json → database/*.json
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            results = list(pool.map(read, self.tails.values()))
+
+        for kind, path in self.outputs.items():
+            chunks = [data for k, _, data in results if k == kind and data]
+            if not chunks:
+                continue
+            with open(path, "ab") as out:
+                out.writelines(chunks)
+                end = out.tell()
+            lines = b"".join(chunks).decode("utf-8").splitlines(keepends=True)
+            self.merged[kind] += len(lines)
+            self.upload_queue.put((kind, lines, end))
+
+        for _, tail, _ in results:
+            self.manifest["sources"][os.path.relpath(tail.path, BASE_DIR)] = tail.offset
+        self.manifest["outputs"] = {kind: self.size(path) for kind, path in self.outputs.items()}
+        self.save_manifest()
+
+class UploadLog:
+    """Byte offset up to which each merged output has been acknowledged by Elasticsearch, in
+    its own manifest (written by the upload thread only). The offset moves past a line only
+    once that line and every line before it were acknowledged, so whatever a run could not
+    upload is read back from the merged output and sent again by the next one."""
+
+    def __init__(self, outputs, path=UPLOAD_MANIFEST_JSON):
+        self.outputs = outputs
+        self.path = path
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                offsets = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            offsets = {}
+        # outputs rebuilt or truncated by the merger are uploaded from their new end
+        self.offsets = {kind: min(offsets.get(kind, 0), Merger.size(out)) for kind, out in outputs.items()}
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.offsets, f)
+        os.replace(tmp, self.path)
+
+    def backlog(self):
+        # (kind, lines, end offset) of the merged lines not acknowledged yet, as the merger queues them
+        items = []
+        for kind, path in self.outputs.items():
+            start, end = self.offsets[kind], Merger.size(path)
+            if end <= start:
+                continue
+            with open(path, "rb") as f:
+                f.seek(start)
+                data = f.read(end - start)
+            items.append((kind, data.decode("utf-8").splitlines(keepends=True), end))
+        return items
+
+def line_ends(lines, end):
+    # Offset in the merged output just past each line, given the offset past the last one
+    ends = []
+    for line in reversed(lines):
+        ends.append(end)
+        end -= len(line.encode("utf-8"))
+    return ends[::-1]
+
+def upload_worker(upload_queue, host, upload_log, online_topics=False):
+    # Batches merged lines and uploads them while harvesting continues; None ends the stream.
+    # Unacknowledged lines stay at the front of the batch and are sent again after a backoff.
+    # With online_topics one topic model learns across every batch of the run and is
+    # published for the Fission functions every TOPIC_PUBLISH_EVERY batches and at the end.
+    topic_model = upload_to_es.online_topic_model() if online_topics else None
+    uploads = 0
+    batch = {"posts": [], "comments": []}   # (line, end offset) in merged output order
+    sent_to = dict(upload_log.offsets)
+    first_at = None
+    retry_at, backoff = 0, UPLOAD_RETRY
+    final_attempts = UPLOAD_FINAL_ATTEMPTS
+    done = False
+    while True:
+        if not done:
+            try:
+                item = upload_queue.get(timeout=1)
+                if item is None:
+                    done = True
+                else:
+                    kind, lines, end = item
+                    batch[kind].extend(zip(lines, line_ends(lines, end)))
+                    first_at = first_at or time.time()
+            except queue.Empty:
+                pass
+        size = len(batch["posts"]) + len(batch["comments"])
+        if done and (not size or not final_attempts):
+            break
+        if not size or not (done or size >= UPLOAD_BATCH or time.time() - first_at >= UPLOAD_LINGER):
+            continue
+        if time.time() < retry_at:
+            if done:
+                time.sleep(1)
+            continue
+        if done:
+            final_attempts -= 1
+
+        print(f"▶ Uploading {len(batch['posts'])} posts, {len(batch['comments'])} comments")
+        try:
+            failed = upload_to_es.upload_lines(host, [line for line, _ in batch["posts"]],
+                                               [line for line, _ in batch["comments"]], topic_model=topic_model)
+        except Exception as e:
+            print(f"[Error] upload_to_es failed: {e}")
+            failed = {kind: [line for line, _ in entries] for kind, entries in batch.items()}
+        uploads += 1
+        if uploads % TOPIC_PUBLISH_EVERY == 0:
+            upload_to_es.publish_topic_model(host, topic_model)
+
+        for kind, entries in batch.items():
+            if not entries:
+                continue
+            sent_to[kind] = max(sent_to[kind], entries[-1][1])
+            unacked = Counter(failed[kind])
+            kept = []
+            for line, end in entries:
+                if unacked[line]:
+                    unacked[line] -= 1
+                    kept.append((line, end))
+            batch[kind] = kept
+            # every line before the first unacknowledged one has been acknowledged
+            if kept:
+                line, end = kept[0]
+                upload_log.offsets[kind] = end - len(line.encode("utf-8"))
+            else:
+                upload_log.offsets[kind] = sent_to[kind]
+        upload_log.save()
+
+        left = len(batch["posts"]) + len(batch["comments"])
+        if left:
+            retry_at = time.time() + backoff
+            print(f"[Warn] {left} lines not acknowledged, sending them again in {backoff}s")
+            backoff = min(backoff * 2, UPLOAD_RETRY_MAX)
+        else:
+            first_at = None
+            backoff = UPLOAD_RETRY
+    upload_to_es.publish_topic_model(host, topic_model)
+    if size:
+        print(f"[Warn] {size} lines are still not acknowledged; the next run uploads them from the merged output")
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Harvest, merge and upload")
+    p.add_argument("--rebuild", action="store_true", help="Discard the merged files and merge every source again")
+    p.add_argument("--online-topics", action="store_true", help="Assign comment topics with the online topic model")
+    p.add_argument("--metrics-port", type=int, default=0, help="Serve Prometheus metrics on this port (default: 0, off)")
+    args = p.parse_args()
+    if metrics.serve(args.metrics_port):
+        print(f"▶ Serving metrics on :{args.metrics_port}/metrics")
+
+    if args.rebuild:
+        for fn in (POSTS_JSON, COMMENTS_JSON, MANIFEST_JSON, UPLOAD_MANIFEST_JSON):
+            try:
+                os.remove(fn)
+            except FileNotFoundError:
+                pass
     os.makedirs(os.path.dirname(POSTS_JSON), exist_ok=True)
     os.makedirs(os.path.dirname(COMMENTS_JSON), exist_ok=True)
 
-    print(f"▶ Merging all posts to {POSTS_JSON}")
-    with open(POSTS_JSON, "w", encoding="utf-8") as p_out:
-        for fn in glob.glob(os.path.join(BASE_DIR, "data", "**", "posts.json"), recursive=True):
-            state = os.path.basename(os.path.dirname(fn))
-            platform = os.path.basename(os.path.dirname(os.path.dirname(fn)))
-            with open(fn, "r", encoding="utf-8") as f:
-                for line in f:
-                    obj = json.loads(line)
-                    obj["state"] = state
-                    obj["platform"] = platform
-                    p_out.write(json.dumps(obj, ensure_ascii=False) + "\n")
-
-    print(f"▶ Merging all comments to {COMMENTS_JSON}")
-    with open(COMMENTS_JSON, "w", encoding="utf-8") as c_out:
-        for fn in glob.glob(os.path.join(BASE_DIR, "data", "**", "comments.json"), recursive=True):
-            state = os.path.basename(os.path.dirname(fn))
-            platform = os.path.basename(os.path.dirname(os.path.dirname(fn)))
-            with open(fn, "r", encoding="utf-8") as f:
-                for line in f:
-                    obj = json.loads(line)
-                    obj["state"] = state
-                    obj["platform"] = platform
-                    c_out.write(json.dumps(obj, ensure_ascii=False) + "\n")
-
-    # 3. call upload_to_es.py
-    cmd = [
-        sys.executable,
-        UPLOAD_SCRIPT,
-        "--posts",    POSTS_JSON,
-        "--comments", COMMENTS_JSON
-    ]
-    print("▶ Running upload_to_es:", " ".join(cmd))
-    try:
-        subprocess.run(cmd, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"[Error] upload_to_es failed: {e}")
-    else:
-        print("Completed!")
\ No newline at end of file
+    upload_queue = queue.Queue()
+    merger = Merger(upload_queue)
+    # lines merged by earlier runs but never acknowledged go first
+    upload_log = UploadLog(merger.outputs)
+    for item in upload_log.backlog():
+        print(f"▶ Re-uploading {len(item[1])} unacknowledged {item[0]} from {merger.outputs[item[0]]}")
+        upload_queue.put(item)
+    uploader = threading.Thread(target=upload_worker, args=(upload_queue, ES_HOST, upload_log, args.online_topics), daemon=True)
+    uploader.start()
+
+    # 1. start every harvester; 2./3. merge their output while they run
+    running = [start_harvester(h["script"]) for h in HARVESTERS]
+    while running:
+        running = [h for h in running if check_harvester(h)]
+        merger.poll()
+        if running:
+            time.sleep(POLL_INTERVAL)
+    merger.poll()
+    print(f"▶ Merged {merger.merged['posts']} posts to {POSTS_JSON}, {merger.merged['comments']} comments to {COMMENTS_JSON}")
+
+    # 4. flush the remaining uploads
+    upload_queue.put(None)
+    uploader.join()
+    print("Completed!")
@@ -13,20 +13,50 @@
 """
 
 import argparse
+import io
+import json
+import os
+import sys
 import pandas as pd
 import requests
+from elasticsearch import Elasticsearch
 import re
+import time
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 from bertopic import BERTopic
 from sklearn.feature_extraction.text import CountVectorizer
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common import metrics
+from common.embeddings import DEFAULT_MODEL, EmbeddingStore
+from common.rollups import bulk_with_rollups, ensure_rollup_index
+from common.topic_store import ESModelStore
+from common.topics import OnlineTopicModel
+
+analyzer = SentimentIntensityAnalyzer()
+
+CONTROL_INDEX = "upload-control"
+BULK_SIZE = 500
+EMBEDDING_STORE = "database/embeddings/all-MiniLM-L6-v2"
+TOPIC_MODEL_NAME = "comments"   # the model the Fission functions tag comments with
+TARGETS = {
+    "posts":    ("housing_posts",    "post_id"),
+    "comments": ("housing_comments", "comment_id"),
+}
+
 def parse_args():
     p = argparse.ArgumentParser(description="Bulk insert posts & comments into Elasticsearch")
     p.add_argument("--posts",    required=True, help="Path to merged posts JSON-lines file")
     p.add_argument("--comments", required=True, help="Path to merged comments JSON-lines file")
     p.add_argument("--es-host",  default="http://localhost:9200", help="Elasticsearch host URL")
+    p.add_argument("--online-topics", action="store_true",
+                   help="Assign comment topics with the online topic model instead of the default placeholder, "
+                        "and publish it for the Fission functions at the end of the run")
+    p.add_argument("--incremental", action="store_true",
+                   help=f"Only process records past the per-platform, per-state watermark kept in {CONTROL_INDEX}")
     return p.parse_args()
 
+@metrics.timed_stage("clean_text")
 def clean_text(text):
     if pd.isna(text):
         return ""
@@ -35,25 +65,42 @@ def clean_text(text):
     text = re.sub(r"[^\w\s]", "", text)
     return text.strip().lower()
 
-def main():
-    args = parse_args()
+def frames_from_lines(lines):
+    # JSON-lines strings → DataFrame (empty when there are no lines)
+    if not lines:
+        return pd.DataFrame()
+    return pd.read_json(io.StringIO("".join(lines)), lines=True)
 
-    # === Step 1: Load data ===
-    posts_df    = pd.read_json(args.posts,    lines=True)
-    comments_df = pd.read_json(args.comments, lines=True)
+def online_topic_model():
+    # Streaming topic model over cached sentence embeddings (see common/topics.py)
+    return OnlineTopicModel(embed=EmbeddingStore(EMBEDDING_STORE).embed)
 
-    print("Posts columns:", posts_df.columns.tolist())
-    print("Comments columns:", comments_df.columns.tolist())
+def publish_topic_model(host, topic_model):
+    # Publish the online model to the Elasticsearch model store (common/topic_store.py) so the
+    # Fission functions tag new comments with it; skipped until its warm-up fit is done.
+    # A failed publish never fails the upload: the next one carries the newer state anyway.
+    if topic_model is None or not topic_model.fitted:
+        return None
+    try:
+        version = ESModelStore(Elasticsearch(host)).publish(TOPIC_MODEL_NAME, topic_model, {"embedding_model": DEFAULT_MODEL})
+    except Exception as e:
+        print(f"[Topics] publishing the online topic model failed: {e}")
+        return None
+    print(f"Published topic model {TOPIC_MODEL_NAME} version {version}")
+    return version
 
+def prepare(posts_df, comments_df, topic_model=None):
     # === Step 2: Clean text ===
-    posts_df["text"]    = posts_df["content"].apply(clean_text)
-    comments_df["text"] = comments_df["content"].apply(clean_text)
+    if not posts_df.empty:
+        posts_df["text"] = posts_df["content"].apply(clean_text)
+    if not comments_df.empty:
+        comments_df["text"] = comments_df["content"].apply(clean_text)
 
-    # Filter out low-quality comments
-    comments_df = comments_df[
-        (~comments_df["text"].isin(["", "removed", "deleted"])) &
-        (comments_df["text"].str.split().str.len() >= 5)
-    ]
+        # Filter out low-quality comments
+        comments_df = comments_df[
+            (~comments_df["text"].isin(["", "removed", "deleted"])) &
+            (comments_df["text"].str.split().str.len() >= 5)
+        ].copy()
 
     # to_datetime → nanoseconds int → milliseconds
     for df in (posts_df, comments_df):
@@ -61,17 +108,26 @@ def main():
             df["created_at"] = (pd.to_datetime(df["created_at"], utc=True).astype('int64') // 10 ** 6)
 
     # === Step 3: Sentiment Analysis ===
-    analyzer = SentimentIntensityAnalyzer()
-    comments_df["sentiment_score"] = comments_df["text"].apply(
-        lambda t: analyzer.polarity_scores(t)["compound"]
-    )
-    comments_df["sentiment"] = comments_df["sentiment_score"].apply(
-        lambda s: "positive" if s >= 0.05 else ("negative" if s <= -0.05 else "neutral")
-    )
+    if not comments_df.empty:
+        started = time.perf_counter()
+        comments_df["sentiment_score"] = comments_df["text"].apply(
+            lambda t: analyzer.polarity_scores(t)["compound"]
+        )
+        metrics.observe_stage("analyze_sentiment", len(comments_df), time.perf_counter() - started)
+        comments_df["sentiment"] = comments_df["sentiment_score"].apply(
+            lambda s: "positive" if s >= 0.05 else ("negative" if s <= -0.05 else "neutral")
+        )
 
-    # === Step 4: Topic Modeling on comments ===
-    comments_df["topic"]       = 0
-    comments_df["topic_label"] = "default"
+        # === Step 4: Topic Modeling on comments ===
+        # The online model learns from each batch before tagging it; cost stays per batch
+        if topic_model is not None:
+            texts = comments_df["text"].tolist()
+            topic_model.partial_fit(texts)
+            comments_df["topic"]       = topic_model.transform(texts)
+            comments_df["topic_label"] = comments_df["topic"].map(topic_model.label)
+        else:
+            comments_df["topic"]       = 0
+            comments_df["topic_label"] = "default"
 
     # # BERTopic only for Reddit
     # reddit_comments = comments_df[comments_df["platform"] == "reddit"]
@@ -85,16 +141,41 @@ def main():
     #     comments_df.loc[reddit_comments.index, "topic"] = topics
     #     comments_df.loc[reddit_comments.index, "topic_label"] = [topic_info.get(t, "default") for t in topics]
 
+    return posts_df, comments_df
 
-    # === Step 5: Upload to Elasticsearch ===
-    host = args.es_host.rstrip("/")
+def _json_default(value):
+    # numpy scalars → python
+    return value.item() if hasattr(value, "item") else str(value)
+
+def bulk_upload(es, index, df, id_field):
+    # bulk_with_rollups in BULK_SIZE chunks → one acknowledged flag per row of df.
+    # Daily rollups and term buckets are maintained for every document the call created,
+    # so the dashboards (visualization/analysis.py) never scan the index itself.
+    rows = [row.dropna().to_dict() for _, row in df.iterrows()]
+    acked = []
+    for i in range(0, len(rows), BULK_SIZE):
+        chunk = rows[i:i + BULK_SIZE]
+        actions = [
+            {"_index": index, "_id": str(doc[id_field]),
+             "_source": json.loads(json.dumps(doc, default=_json_default))}
+            for doc in chunk
+        ]
+        try:
+            _, errors = bulk_with_rollups(es, actions, chunk_size=BULK_SIZE)
+            failed_ids = {next(iter(item.values())).get("_id") for item in errors}
+            acked.extend(action["_id"] not in failed_ids for action in actions)
+        except Exception as e:
+            print(f"[Error] _bulk to {index} failed: {e}")
+            acked.extend([False] * len(chunk))
+    print(f"{index}: {sum(acked)} indexed, {len(acked) - sum(acked)} failed")
+    return acked
 
-    # Upload comments
-    for _, row in comments_df.iterrows():
-        doc = row.dropna().to_dict()
-        url = f"{host}/housing_comments/_doc/{doc['comment_id']}"
-        res = requests.put(url, json=doc)
-        print(f"PUT {url} → {res.status_code} {res.text}") # debugging
+def upload(host, posts_df, comments_df):
+    # === Step 5: Upload to Elasticsearch ===
+    # Returns the rows that were not acknowledged, per kind
+    es = Elasticsearch(host.rstrip("/"))
+    ensure_rollup_index(es)
+    failed = {}
 
     # post topic from comments
     # if "topic" in comments_df:
@@ -116,12 +197,149 @@ def main():
     # posts_df["topic"]       = posts_df.get("topic", 0).fillna(0).astype(int)
     # posts_df["topic_label"] = posts_df.get("topic_label", "default").fillna("default")
 
-    # Upload posts
-    for _, row in posts_df.iterrows():
-        doc = row.dropna().to_dict()
-        url = f"{host}/housing_posts/_doc/{doc['post_id']}"
-        res = requests.put(url, json=doc)
-        print(f"PUT {url} → {res.status_code} {res.text}") # debugging
+    for kind, df in (("comments", comments_df), ("posts", posts_df)):
+        if df.empty:
+            failed[kind] = df
+            continue
+        index, id_field = TARGETS[kind]
+        acked = bulk_upload(es, index, df, id_field)
+        failed[kind] = df[[not ok for ok in acked]]
+    return failed
+
+# === Incremental mode ===
+# One control document per (platform, state, kind) holding the (created_at ms, id) of the
+# last record known to be in ES. The harvesters run concurrently per state, so each state's
+# stream advances its own watermark: a slower state is never filtered out by a faster one.
+# A run only cleans, scores and uploads records past their source's watermark, and the
+# watermark only moves up to just before the first record whose write was not
+# acknowledged, so a failed write is retried on the next run. Records that arrive later
+# with an older created_at than their own source's watermark are not picked up.
+
+def record_keys(df, id_field):
+    # (created_at ms, id) per row; ids compare as strings only to break created_at ties
+    created = (pd.to_datetime(df["created_at"], utc=True) - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(milliseconds=1)
+    return list(zip(created.tolist(), df[id_field].astype(str).tolist()))
+
+def sources(df):
+    # (platform, state) per row; merged lines always carry both (processor/main.py tags them)
+    def column(name):
+        return df[name].fillna("unknown").astype(str).tolist() if name in df.columns else ["unknown"] * len(df)
+    return list(zip(column("platform"), column("state")))
+
+def load_watermarks(host):
+    host = host.rstrip("/")
+    res = requests.get(f"{host}/{CONTROL_INDEX}/_search", json={"size": 1000, "query": {"match_all": {}}})
+    if res.status_code == 404:
+        return {}
+    res.raise_for_status()
+    marks = {}
+    for hit in res.json()["hits"]["hits"]:
+        src = hit["_source"]
+        if "state" not in src:
+            # per-platform watermark from before marks were kept per state; records it
+            # covered are re-sent once and overwrite themselves (same _id)
+            continue
+        marks[(src["platform"], src["state"], src["kind"])] = (int(src["created_at"]), str(src["last_id"]))
+    return marks
+
+def beyond_watermark(df, kind, marks):
+    # Rows of a raw (not yet prepared) frame past their source's watermark
+    if df.empty:
+        return df
+    keys = record_keys(df, TARGETS[kind][1])
+    keep = [
+        key > marks.get(source + (kind,), (-1, ""))
+        for key, source in zip(keys, sources(df))
+    ]
+    return df[keep]
+
+def next_watermarks(kind, candidates, failed, marks):
+    # Highest candidate key per (platform, state) that is below every unacknowledged key
+    # of that source; candidates dropped by prepare() (low-quality comments) count as done.
+    # prepare() keeps the row labels, so failed rows are matched to candidates by label.
+    keys = record_keys(candidates, TARGETS[kind][1])
+    rows = list(zip(candidates.index, keys, sources(candidates)))
+    failed_labels = set(failed.index)
+    lowest_failed = {}
+    for label, key, source in rows:
+        if label in failed_labels and (source not in lowest_failed or key < lowest_failed[source]):
+            lowest_failed[source] = key
+    advanced = {}
+    for label, key, source in rows:
+        if source in lowest_failed and key >= lowest_failed[source]:
+            continue
+        current = advanced.get(source, marks.get(source + (kind,), (-1, "")))
+        if key > current:
+            advanced[source] = key
+    return advanced
+
+def save_watermarks(host, kind, advanced):
+    host = host.rstrip("/")
+    if not advanced:
+        return
+    now = pd.Timestamp.now(tz="UTC").isoformat()
+    body = "".join(
+        json.dumps({"index": {"_index": CONTROL_INDEX, "_id": f"{platform}-{state}-{kind}"}}) + "\n" +
+        json.dumps({"platform": platform, "state": state, "kind": kind, "created_at": key[0],
+                    "last_id": key[1], "timestamp": now}) + "\n"
+        for (platform, state), key in advanced.items()
+    )
+    res = requests.post(f"{host}/_bulk?refresh=true", data=body.encode("utf-8"),
+                        headers={"Content-Type": "application/x-ndjson"})
+    res.raise_for_status()
+    if res.json().get("errors"):
+        raise RuntimeError(f"Failed to save {kind} watermarks: {res.text}")
+    for (platform, state), key in advanced.items():
+        print(f"{platform} {state} {kind} watermark → {key[0]} / {key[1]}")
+
+def upload_incremental(host, posts_df, comments_df, topic_model=None):
+    marks = load_watermarks(host)
+    candidates = {
+        "posts":    beyond_watermark(posts_df, "posts", marks),
+        "comments": beyond_watermark(comments_df, "comments", marks),
+    }
+    print(f"Incremental: {len(candidates['posts'])}/{len(posts_df)} posts, "
+          f"{len(candidates['comments'])}/{len(comments_df)} comments past the watermark")
+
+    posts_ready, comments_ready = prepare(candidates["posts"].copy(), candidates["comments"].copy(), topic_model)
+    failed = upload(host, posts_ready, comments_ready)
+
+    for kind, rows in candidates.items():
+        if rows.empty:
+            continue
+        save_watermarks(host, kind, next_watermarks(kind, rows, failed[kind], marks))
+    return failed
+
+def upload_lines(host, post_lines, comment_lines, incremental=False, topic_model=None):
+    # Clean, score and upload a batch of merged JSON lines (used by processor/main.py while harvesting).
+    # Returns the lines whose write was not acknowledged, per kind, so the caller can send them again;
+    # frames_from_lines labels rows by line position and prepare() keeps the labels.
+    lines = {"posts": post_lines, "comments": comment_lines}
+    posts_df, comments_df = frames_from_lines(post_lines), frames_from_lines(comment_lines)
+    if incremental:
+        failed = upload_incremental(host, posts_df, comments_df, topic_model)
+    else:
+        posts_df, comments_df = prepare(posts_df, comments_df, topic_model)
+        failed = upload(host, posts_df, comments_df)
+    return {kind: [lines[kind][label] for label in failed[kind].index] for kind in lines}
+
+def main():
+    args = parse_args()
+
+    # === Step 1: Load data ===
+    posts_df    = pd.read_json(args.posts,    lines=True)
+    comments_df = pd.read_json(args.comments, lines=True)
+
+    print("Posts columns:", posts_df.columns.tolist())
+    print("Comments columns:", comments_df.columns.tolist())
+
+    topic_model = online_topic_model() if args.online_topics else None
+    if args.incremental:
+        upload_incremental(args.es_host, posts_df, comments_df, topic_model)
+    else:
+        posts_df, comments_df = prepare(posts_df, comments_df, topic_model)
+        upload(args.es_host, posts_df, comments_df)
+    publish_topic_model(args.es_host, topic_model)
 
     print("Insert completed")
 
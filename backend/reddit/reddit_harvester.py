@@ -18,6 +18,11 @@ import urllib3
 from flask import jsonify
 from typing import Optional, Dict, List
 import logging
+from common import metrics
+from common.dedup import Deduplicator
+from common.geo import UNKNOWN, classify_state
+from common.partitions import partition_index, ensure_partition_template
+from common.rollups import bulk_with_rollups, ensure_rollup_index
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -26,6 +31,18 @@ def config(key: str) -> str:
     with open(f'/configs/default/shared-data-reddit/{key}', 'r') as f:
         return f.read().strip()
 
+def optional_config(key: str) -> Optional[str]:
+    # ConfigMap keys that may be absent (e.g. PUSHGATEWAY)
+    try:
+        return config(key) or None
+    except OSError:
+        return None
+
+def dedup_reference_only() -> bool:
+    # DEDUP_REFERENCE_ONLY=true indexes reposts and copy-pasted comments as a duplicate_of
+    # reference without their content; by default they keep it and only gain the reference
+    return (optional_config('DEDUP_REFERENCE_ONLY') or '').lower() in ('1', 'true', 'yes')
+
 SUBREDDITS = ['Australia', 'Melbourne', 'housing', 'AusFinance', 'Sydney', 'Brisbane', 'Perth', 'Adelaide']
 KEYWORDS = ['housing', 'house prices', 'affordability', 'rent', 'mortgage', 'rental', 'property']
 USER_AGENT = 'HousingSentimentBot/0.1 by u/Emotional-Exam-3670'
@@ -40,14 +57,31 @@ class ESManager:
             verify_certs=False,
             http_auth=(config("ES_USERNAME"), config("ES_PASSWORD"))
         )
+        # Posts and comments are written to monthly partitions of these families,
+        # with daily rollups upserted for every newly created document
+        try:
+            ensure_partition_template(self.es, 'reddit-posts', 'posts')
+            ensure_partition_template(self.es, 'reddit-comments', 'comments')
+            ensure_rollup_index(self.es)
+        except Exception as e:
+            logger.error(f"Failed to install partition templates: {e}")
     
-    def bulk_check_exists(self, index: str, ids: List[str]) -> set:
-        # Check if documents with given IDs exist in the specified Elasticsearch index
-        if not ids:
+    def bulk_check_exists(self, index: str, docs: Dict[str, datetime]) -> set:
+        # Check which ids (id -> created_at) exist in the legacy index or their monthly partition.
+        # mget is realtime, so documents indexed since the last refresh are found too.
+        if not docs:
             return set()
         try:
-            result = self.es.mget(index=index, body={"ids": ids}, _source=False)
-            return {doc['_id'] for doc in result.get('docs', []) if doc.get('found', False)}
+            found = set()
+            items = list(docs.items())
+            for i in range(0, len(items), 500):
+                refs = []
+                for doc_id, created in items[i:i + 500]:
+                    refs.append({'_index': partition_index(index, created), '_id': doc_id})
+                    refs.append({'_index': index, '_id': doc_id})
+                result = self.es.mget(docs=refs, _source=False)
+                found.update(doc['_id'] for doc in result.get('docs', []) if doc.get('found', False))
+            return found
         except Exception:
             return set()
     
@@ -80,12 +114,12 @@ class ESManager:
             logger.error(f"Failed to update timestamp: {e}")
     
     def bulk_index(self, actions: List[Dict]):
-        # Perform bulk indexing of documents into Elasticsearch
+        # Perform bulk indexing of documents into Elasticsearch and roll up the new ones
         try:
             for action in actions:
                 action['_op_type'] = 'create'
             
-            success, errors = helpers.bulk(self.es, actions, chunk_size=50, raise_on_error=False, timeout='30s')
+            success, errors = bulk_with_rollups(self.es, actions, chunk_size=50, timeout='30s')
             
             duplicate_count = sum(1 for error in errors if 'already_exists' in str(error) or 'version_conflict' in str(error))
             if duplicate_count > 0:
@@ -131,6 +165,7 @@ class RedisStreamManager:
                 {self.stream_name: '>'}, count=1, block=1000
             )
             
+            self._observe_stream()
             if messages and messages[0][1]:
                 message_id, fields = messages[0][1][0]
                 task = json.loads(fields['task_data'])
@@ -142,10 +177,18 @@ class RedisStreamManager:
             logger.error(f"Failed to consume: {e}")
             return None
     
+    def _observe_stream(self):
+        # Lag and pending count of the consumer group for the metrics
+        try:
+            metrics.observe_stream(self.redis_client, self.stream_name, self.consumer_group)
+        except Exception as e:
+            logger.warning(f"Failed to read stream metrics: {e}")
+    
     def _claim_abandoned_messages(self):
         # Claim abandoned messages in the Redis stream for reprocessing
         try:
             pending = self.redis_client.xpending_range(self.stream_name, self.consumer_group, min='-', max='+', count=10)
+            metrics.observe_oldest_pending(self.stream_name, self.consumer_group, max((m['time_since_delivered'] for m in pending), default=0))
             for msg in pending:
                 message_id, consumer, idle_time, delivery_count = msg
                 if idle_time > 60000:  
@@ -178,19 +221,30 @@ class RedditHarvester:
         )
         self.es_manager = ESManager()
         self.queue_manager = RedisStreamManager()
+        # Band index shared with the other harvester pods through the stream's Redis
+        redis_client = self.queue_manager.redis_client
+        reference_only = dedup_reference_only()
+        self.post_dedup = Deduplicator('reddit-posts', redis=redis_client, reference_only=reference_only)
+        self.comment_dedup = Deduplicator('reddit-comments', redis=redis_client, reference_only=reference_only)
 
     def reddit_safe_call(self, func, *args, retries=5, **kwargs):
         # Safely call a Reddit API function with retry logic for rate limits and errors
+        endpoint = getattr(func, '__name__', 'call')
         for attempt in range(retries):
+            started = time.perf_counter()
             try:
-                return func(*args, **kwargs)
+                result = func(*args, **kwargs)
+                metrics.observe_request('reddit', endpoint, 200, time.perf_counter() - started)
+                return result
             except prawcore.TooManyRequests as e:
+                metrics.observe_request('reddit', endpoint, 429, time.perf_counter() - started)
                 wait = int(e.response.headers.get('Retry-After', 60))
                 logger.warning(f"Reddit 429, sleeping {wait}s")
-                time.sleep(wait)
+                metrics.rate_limited('reddit', wait)
             except Exception:
+                metrics.observe_request('reddit', endpoint, 'error', time.perf_counter() - started)
                 if attempt < retries - 1:
-                    time.sleep(2 ** attempt)
+                    metrics.sleep('reddit', 2 ** attempt)
                 else:
                     raise
         raise RuntimeError(f"Reddit call failed: {func.__name__}")
@@ -237,8 +291,8 @@ class RedditHarvester:
             submission_list = sorted(list(submissions), key=lambda x: x.created_utc, reverse=True)
             
             # Collect IDs for bulk check
-            post_ids = []
-            comment_ids = []
+            post_ids = {}
+            comment_ids = {}
             submission_data = []
             
             for submission in submission_list:
@@ -251,12 +305,13 @@ class RedditHarvester:
                 if created < effective_start:
                     continue  # Too old, skip
                 
-                post_ids.append(submission.id)
+                post_ids[submission.id] = created
                 submission_data.append((submission, created))
                 
                 try:
                     submission.comments.replace_more(limit=3)
-                    comment_ids.extend([c.id for c in submission.comments.list()[:50]])
+                    comment_ids.update((c.id, datetime.fromtimestamp(c.created_utc, timezone.utc))
+                                       for c in submission.comments.list()[:50])
                 except Exception:
                     pass
             
@@ -278,16 +333,19 @@ class RedditHarvester:
                     earliest_time = created
                 
                 content = submission.title + (" " + submission.selftext if submission.selftext else "")
+                canonical = self.post_dedup.canonical(submission.id, content)
+                state = classify_state(content, subreddit=subreddit)
                 
                 actions.append({
-                    '_index': 'reddit-posts',
+                    '_index': partition_index('reddit-posts', created),
                     '_id': submission.id,
-                    '_source': {
+                    '_source': self.post_dedup.link({
                         'post_id': submission.id,
                         'platform': 'reddit',
                         'author': str(submission.author) if submission.author else '[deleted]',
                         'content': content,
                         'created_at': created.isoformat(),
+                        'state': state,
                         'tags': [subreddit, keyword],
                         'subreddit': subreddit,
                         'keyword': keyword,
@@ -295,7 +353,7 @@ class RedditHarvester:
                         'num_comments': submission.num_comments,
                         'task_id': task.get('task_id', ''),
                         'collection_mode': 'historical'
-                    }
+                    }, canonical)
                 })
                 posts_processed += 1
                 
@@ -304,18 +362,25 @@ class RedditHarvester:
                     submission.comments.replace_more(limit=2)
                     for comment in submission.comments.list():
                         if comment.id not in existing_comments:
+                            comment_created = datetime.fromtimestamp(comment.created_utc, timezone.utc)
+                            canonical = self.comment_dedup.canonical(comment.id, comment.body)
+                            # Comments inherit the post's state unless it is unknown
+                            comment_state = state
+                            if state == UNKNOWN:
+                                comment_state = classify_state(comment.body, subreddit=subreddit)
                             actions.append({
-                                '_index': 'reddit-comments',
+                                '_index': partition_index('reddit-comments', comment_created),
                                 '_id': comment.id,
-                                '_source': {
+                                '_source': self.comment_dedup.link({
                                     'comment_id': comment.id,
                                     'post_id': submission.id,
                                     'platform': 'reddit',
                                     'author': str(comment.author) if comment.author else '[deleted]',
                                     'content': comment.body,
-                                    'created_at': datetime.fromtimestamp(comment.created_utc, timezone.utc).isoformat(),
+                                    'created_at': comment_created.isoformat(),
+                                    'state': comment_state,
                                     'collection_mode': 'historical'
-                                }
+                                }, canonical)
                             })
                 except Exception:
                     pass
@@ -334,6 +399,8 @@ class RedditHarvester:
                 logger.info(f"Updated timestamp to {earliest_time.isoformat()} (historical progression towards 2019)")
             elif posts_processed == 0:
                 logger.info(f"No new posts found in window {effective_start.isoformat()} to {effective_end.isoformat()}")
+            logger.info(self.post_dedup.summary())
+            logger.info(self.comment_dedup.summary())
             
             return {
                 'status': 'success',
@@ -343,6 +410,7 @@ class RedditHarvester:
                 'posts_processed': posts_processed,
                 'time_window': f"{effective_start.isoformat()} to {effective_end.isoformat()}",
                 'earliest_processed': earliest_time.isoformat() if posts_processed > 0 else None,
+                'duplicates': {'posts': self.post_dedup.report(), 'comments': self.comment_dedup.report()},
                 'collection_mode': 'historical',
                 'completed_at': datetime.now(timezone.utc).isoformat()
             }
@@ -423,5 +491,8 @@ class HarvestController:
             }), 500
 
 def main():
-    # Fission function entry point
-    return HarvestController().handle_request()
+    # Fission function entry point; metrics are pushed since the pod may be gone before a scrape
+    try:
+        return HarvestController().handle_request()
+    finally:
+        metrics.push('reddit-harvester', optional_config('PUSHGATEWAY'))
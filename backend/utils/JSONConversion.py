@@ -1,19 +1,123 @@
-# COMP90024 Team 75 
+# COMP90024 Team 75
 # Linying Wei (1638206)
 # Wangyang Wu (1641248)
 # Ziyu Wang (1560831)
 # Roger Zhang (1079986)
 
+"""
+	Convert a JSON array dump to NDJSON without loading it: the top-level array is parsed
+	one element at a time from a sliding text buffer and each element is written as a line.
+	Inputs / outputs ending in .zst are decompressed / compressed on the fly.
+
+	python JSONConversion.py reddit-melbourne-submissions.json reddit-melbourne-submissions.ndjson
+	python JSONConversion.py reddit-Auspol-submissions.json.zst reddit-Auspol-submissions.ndjson.zst
+"""
+
+import argparse
+import io
 import json
-import ndjson
-import os
- 
-filePath =  r"E:\Unimelb Extras\reddit\subreddits24\JSON\reddit-melbourne-submissions.json"
+import logging.handlers
+from typing import Iterator
+
+import zstandard
+
+log = logging.getLogger("bot")
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+READ_SIZE = 2**20
+WHITESPACE = " \t\n\r"
+
+
+def open_text(path, mode):
+	"""Text stream over a plain or .zst file."""
+	if not path.endswith(".zst"):
+		return open(path, mode, encoding="utf-8")
+	if mode == "r":
+		raw = zstandard.ZstdDecompressor(max_window_size=2**31).stream_reader(open(path, "rb"), closefd=True)
+	else:
+		raw = zstandard.ZstdCompressor(level=10).stream_writer(open(path, "wb"), closefd=True)
+	return io.TextIOWrapper(raw, encoding="utf-8")
+
+
+def iter_array(stream, read_size=READ_SIZE) -> Iterator:
+	"""Yield the elements of a top-level JSON array read incrementally from a text stream.
+	Memory is bounded by the largest element plus read_size."""
+	decoder = json.JSONDecoder()
+	buffer = ""
+	pos = 0
+	eof = False
+
+	def fill():
+		nonlocal buffer, pos, eof
+		chunk = stream.read(read_size)
+		if not chunk:
+			eof = True
+		buffer = buffer[pos:] + chunk
+		pos = 0
+
+	def skip(chars):
+		nonlocal pos
+		while True:
+			while pos < len(buffer) and buffer[pos] in chars:
+				pos += 1
+			if pos < len(buffer) or eof:
+				return
+			fill()
+
+	skip(WHITESPACE)
+	if buffer[pos:pos + 1] != "[":
+		raise ValueError("Input is not a JSON array")
+	pos += 1
+
+	while True:
+		skip(WHITESPACE + ",")
+		if pos >= len(buffer):
+			raise ValueError("Unterminated JSON array")
+		if buffer[pos] == "]":
+			return
+		try:
+			element, end = decoder.raw_decode(buffer, pos)
+		except json.JSONDecodeError:
+			if eof:
+				raise
+			fill()
+			continue
+		# a valid element is followed by whitespace, "," or "]"; anything else (or nothing yet)
+		# means it was cut off by the buffer end, e.g. the number 12 of 12.5
+		if end >= len(buffer) or buffer[end] not in WHITESPACE + ",]":
+			if eof:
+				raise ValueError(f"Unexpected data after array element at character {end}")
+			fill()
+			continue
+		pos = end
+		yield element
+		if pos > read_size:
+			buffer = buffer[pos:]
+			pos = 0
+
+
+def convert(input_path, output_path, read_size=READ_SIZE) -> int:
+	count = 0
+	with open_text(input_path, "r") as source, open_text(output_path, "w") as target:
+		for element in iter_array(source, read_size):
+			target.write(json.dumps(element))
+			target.write("\n")
+			count += 1
+			if count % 100000 == 0:
+				log.info(f"{count:,} elements")
+	log.info(f"Complete : {count:,} elements written to {output_path}")
+	return count
+
 
-outputDir = r"E:\Unimelb Extras\reddit\subreddits24\NDJSON"
+def parse_args():
+	p = argparse.ArgumentParser(description="Convert a JSON array dump to NDJSON with bounded memory")
+	p.add_argument("input", help="JSON array file (.json or .json.zst)")
+	p.add_argument("output", help="NDJSON file (.ndjson or .ndjson.zst)")
+	p.add_argument("--read-size", type=int, default=READ_SIZE, help="Characters read per step (default: 1Mi)")
+	return p.parse_args()
 
-with open(filePath, 'r') as file:
-	data = json.load(file)
 
-	with open(os.path.join(outputDir, "reddit-sydney-comments.ndjson"), "w") as f:
-		ndjson.dump(data, f)
+if __name__ == "__main__":
+	args = parse_args()
+	convert(args.input, args.output, args.read_size)
@@ -1,29 +1,176 @@
-# COMP90024 Team 75 
+# COMP90024 Team 75
 # Linying Wei (1638206)
 # Wangyang Wu (1641248)
 # Ziyu Wang (1560831)
 # Roger Zhang (1079986)
 
+"""
+	Split a large NDJSON file into parts by size, line count or number of shards.
+	Boundaries are found by seeking to the approximate offset and scanning to the next
+	newline (with --bulk, to the next bulk action line, so an action is never separated
+	from its document). Parts are byte-range copies done in parallel with
+	os.copy_file_range / sendfile, falling back to mmap slices.
+
+	python NDJSONSplitter.py reddit-AusFinance-comments.ndjson --bytes 256M --bulk
+	python NDJSONSplitter.py reddit-AusFinance-comments.ndjson --lines 100000
+	python NDJSONSplitter.py reddit-AusFinance-comments.ndjson --shards 8 --jobs 8
+"""
+
+import argparse
+import mmap
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+ACTION_PREFIXES = (b'{"index"', b'{"create"', b'{"update"', b'{"delete"')
+COUNT_BLOCK = 2**23
+COPY_BLOCK = 2**26
+SIZE_UNITS = {"K": 2**10, "M": 2**20, "G": 2**30}
+
+
+def parse_size(value: str) -> int:
+	value = value.strip().upper().rstrip("B")
+	if value and value[-1] in SIZE_UNITS:
+		return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+	return int(value)
+
+
+def is_action(mm, pos) -> bool:
+	return any(mm[pos:pos + len(prefix)] == prefix for prefix in ACTION_PREFIXES)
+
+def next_boundary(mm, pos, bulk=False) -> int:
+	"""First line start at or after pos (the file size when there is none)."""
+	size = len(mm)
+	if pos <= 0:
+		return 0
+	if mm[pos - 1:pos] != b"\n":
+		end = mm.find(b"\n", pos)
+		pos = size if end == -1 else end + 1
+	while bulk and pos < size and not is_action(mm, pos):
+		end = mm.find(b"\n", pos)
+		pos = size if end == -1 else end + 1
+	return pos
+
+
+def boundaries_by_bytes(mm, part_bytes, bulk=False) -> List[int]:
+	size = len(mm)
+	points = [0]
+	while points[-1] < size:
+		points.append(max(next_boundary(mm, points[-1] + part_bytes, bulk), points[-1] + 1))
+	points[-1] = min(points[-1], size)
+	return points
+
+def boundaries_by_lines(mm, lines_per_file) -> List[int]:
+	"""Every lines_per_file-th line start; newlines are counted per block, not per line."""
+	size = len(mm)
+	points = [0]
+	pos = 0
+	remaining = lines_per_file
+	while pos < size:
+		block_end = min(pos + COUNT_BLOCK, size)
+		count = mm[pos:block_end].count(b"\n")
+		if count < remaining:
+			remaining -= count
+			pos = block_end
+			continue
+		for _ in range(remaining):
+			pos = mm.find(b"\n", pos) + 1
+		if pos < size:
+			points.append(pos)
+		remaining = lines_per_file
+	points.append(size)
+	return points
+
+
+def copy_range(src_fd, dst_fd, offset, length):
+	"""Copy [offset, offset + length) of src_fd to dst_fd inside the kernel when possible."""
+	copied = 0
+	if hasattr(os, "copy_file_range"):
+		try:
+			while copied < length:
+				n = os.copy_file_range(src_fd, dst_fd, length - copied, offset + copied)
+				if n == 0:
+					break
+				copied += n
+			return
+		except OSError:
+			pass
+	if hasattr(os, "sendfile"):
+		try:
+			while copied < length:
+				n = os.sendfile(dst_fd, src_fd, offset + copied, length - copied)
+				if n == 0:
+					break
+				copied += n
+			return
+		except OSError:
+			pass
+	with mmap.mmap(src_fd, 0, access=mmap.ACCESS_READ) as mm:
+		while copied < length:
+			chunk = mm[offset + copied:offset + min(length, copied + COPY_BLOCK)]
+			os.write(dst_fd, chunk)
+			copied += len(chunk)
+
+
+def write_part(input_file, out_path, start, end):
+	src_fd = os.open(input_file, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+	dst_fd = os.open(out_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+	try:
+		copy_range(src_fd, dst_fd, start, end - start)
+	finally:
+		os.close(dst_fd)
+		os.close(src_fd)
+	return out_path
+
+
+def split_file(input_file, output_dir, prefix=None, part_bytes=None, lines_per_file=None,
+			   shards=None, bulk=False, jobs=4) -> List[Tuple[str, int]]:
+	"""Split input_file into <prefix>-part_N.ndjson; returns (path, size) per part."""
+	os.makedirs(output_dir, exist_ok=True)
+	prefix = prefix or os.path.splitext(os.path.basename(input_file))[0]
+	size = os.stat(input_file).st_size
+	if size == 0:
+		return []
+
+	with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+		if lines_per_file:
+			if bulk and lines_per_file % 2:
+				lines_per_file += 1
+			points = boundaries_by_lines(mm, lines_per_file)
+		else:
+			if shards:
+				part_bytes = -(-size // shards)
+			points = boundaries_by_bytes(mm, part_bytes, bulk)
+
+	ranges = [(a, b) for a, b in zip(points, points[1:]) if b > a]
+	paths = [os.path.join(output_dir, f'{prefix}-part_{n}.ndjson') for n in range(len(ranges))]
+	with ThreadPoolExecutor(max_workers=jobs) as pool:
+		list(pool.map(lambda args: write_part(input_file, *args),
+					  [(path, a, b) for path, (a, b) in zip(paths, ranges)]))
+	return [(path, b - a) for path, (a, b) in zip(paths, ranges)]
+
 
 def split_ndjson(input_file, lines_per_file, output_dir):
-	if not os.path.exists(output_dir):
-		os.makedirs(output_dir)
-	with open(input_file, 'r', encoding='utf-8') as infile:
-		file_count = 0
-		lines = []
-		for line_num, line in enumerate(infile, 1):
-			lines.append(line)
-			if line_num % lines_per_file == 0:
-				out_path = os.path.join(output_dir, f'reddit-AusFinance-comments-part_{file_count}.ndjson')
-				with open(out_path, 'w', encoding='utf-8') as outfile:
-					outfile.writelines(lines)
-				lines = []
-				file_count += 1
-		if lines:
-			out_path = os.path.join(output_dir, f'reddit-AusFinance-comments-part_{file_count}.ndjson')
-			with open(out_path, 'w', encoding='utf-8') as outfile:
-				outfile.writelines(lines)
-
-
-split_ndjson(r'E:\Unimelb Extras\reddit\subreddits24\NDJSON\reddit-Finance-comments.ndjson', 100000, r'E:\Unimelb Extras\reddit\subreddits24\NDJSON')
\ No newline at end of file
+	return split_file(input_file, output_dir, lines_per_file=lines_per_file)
+
+
+def parse_args():
+	p = argparse.ArgumentParser(description="Split an NDJSON file into parts")
+	p.add_argument("input")
+	p.add_argument("--output-dir", help="Default: the input file's directory")
+	p.add_argument("--prefix", help="Parts are <prefix>-part_N.ndjson (default: input file name)")
+	mode = p.add_mutually_exclusive_group(required=True)
+	mode.add_argument("--bytes", type=parse_size, help="Target part size, e.g. 256M")
+	mode.add_argument("--lines", type=int, help="Lines per part")
+	mode.add_argument("--shards", type=int, help="Number of roughly equal parts")
+	p.add_argument("--bulk", action="store_true", help="Input is an _bulk file: keep each action with its document")
+	p.add_argument("--jobs", type=int, default=4, help="Parts written concurrently (default: 4)")
+	return p.parse_args()
+
+
+if __name__ == "__main__":
+	args = parse_args()
+	parts = split_file(args.input, args.output_dir or os.path.dirname(os.path.abspath(args.input)), args.prefix,
+					   args.bytes, args.lines, args.shards, args.bulk, args.jobs)
+	for path, size in parts:
+		print(f"{path} : {size:,} bytes")
@@ -7,8 +7,15 @@
 import zstandard
 import os
 import json
-import ndjson
 import sys
+import argparse
+import multiprocessing
+import queue
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, tzinfo
 import logging.handlers
 import re
@@ -16,45 +23,230 @@ from typing import Optional, Dict, List, Tuple
 from bs4 import BeautifulSoup
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common import metrics
+from common.dedup import Deduplicator, enrich_once
+from common.geo import classify_state
+from common.partitions import partition_index
+
 
 log = logging.getLogger("bot")
 log.setLevel(logging.DEBUG)
 log.addHandler(logging.StreamHandler())
 
 
-def read_and_decode(reader, chunk_size, max_window_size, previous_chunk=None, bytes_read=0):
-	chunk = reader.read(chunk_size)
-	bytes_read += chunk_size
-	if previous_chunk is not None:
-		chunk = previous_chunk + chunk
-	try:
-		return chunk.decode()
-	except UnicodeDecodeError:
-		if bytes_read > max_window_size:
-			raise UnicodeError(f"Unable to decode frame after reading {bytes_read:,} bytes")
-		log.info(f"Decoding error with {bytes_read:,} bytes, reading another chunk")
-		return read_and_decode(reader, chunk_size, max_window_size, chunk, bytes_read)
-
-
-def read_lines_zst(file_name):
-	with open(file_name, 'rb') as file_handle:
-		buffer = ''
-		reader = zstandard.ZstdDecompressor(max_window_size=2**31).stream_reader(file_handle)
-		while True:
-			chunk = read_and_decode(reader, 2**27, (2**29) * 2)
-
-			if not chunk:
-				break
-			lines = (buffer + chunk).split("\n")
-
-			for line in lines[:-1]:
-				yield line, file_handle.tell()
-
-			buffer = lines[-1]
-
-		reader.close()
+class ZstLineReader:
+	"""Iterates (line, compressed_offset, uncompressed_offset) over a zst archive in bounded memory.
+	Lines are raw bytes without the newline, sliced straight out of read_size chunks; only a line
+	that spans chunks is joined. uncompressed_offset is the position just past the line, so it can
+	be passed back as start_offset to resume after that line. Progress is kept on the reader."""
+
+	def __init__(self, file_name, start_offset=0, read_size=2**20):
+		self.file_name = file_name
+		self.start_offset = start_offset
+		self.read_size = read_size
+		self.compressed_size = os.stat(file_name).st_size
+		self.compressed_offset = 0
+		self.uncompressed_offset = 0
+		self.lines = 0
+
+	def progress(self) -> float:
+		return self.compressed_offset / self.compressed_size * 100 if self.compressed_size else 100.0
+
+	def __iter__(self):
+		with open(self.file_name, 'rb') as file_handle:
+			reader = zstandard.ZstdDecompressor(max_window_size=2**31).stream_reader(file_handle, read_size=self.read_size)
+			offset = 0
+			while offset < self.start_offset:
+				skipped = reader.read(min(self.read_size, self.start_offset - offset))
+				if not skipped:
+					break
+				offset += len(skipped)
+			self.uncompressed_offset = offset
+
+			# pieces of a line that has not been terminated yet
+			pending = []
+			while True:
+				chunk = reader.read(self.read_size)
+				if not chunk:
+					break
+				self.compressed_offset = file_handle.tell()
+				start = 0
+				end = chunk.find(b"\n")
+				if end != -1 and pending:
+					pending.append(chunk[:end])
+					line = b"".join(pending)
+					pending = []
+					offset += len(line) + 1
+					self.lines += 1
+					self.uncompressed_offset = offset
+					yield line, self.compressed_offset, offset
+					start = end + 1
+					end = chunk.find(b"\n", start)
+				while end != -1:
+					line = chunk[start:end]
+					offset += end - start + 1
+					self.lines += 1
+					self.uncompressed_offset = offset
+					yield line, self.compressed_offset, offset
+					start = end + 1
+					end = chunk.find(b"\n", start)
+				if start < len(chunk):
+					pending.append(chunk[start:] if start else chunk)
+
+			reader.close()
+
+
+def read_lines_zst(file_name, start_offset=0, read_size=2**20):
+	"""Yield (line, compressed_offset, uncompressed_offset) for every line of a zst archive."""
+	return iter(ZstLineReader(file_name, start_offset, read_size))
+
+
+class RotatingNDJSONWriter:
+	"""Buffered NDJSON writer that starts a new part file once the current one reaches max_bytes.
+	Records are written whole, so an action line and its document never end up in different parts."""
+
+	def __init__(self, output_dir, name, max_bytes=0, part=0, part_bytes=0, buffer_size=2**20):
+		self.output_dir = output_dir
+		self.name = name
+		self.max_bytes = max_bytes
+		self.buffer_size = buffer_size
+		self.records = 0
+		self._open(part, part_bytes)
+
+	def path(self, part):
+		if not self.max_bytes:
+			return os.path.join(self.output_dir, f"{self.name}.ndjson")
+		return os.path.join(self.output_dir, f"{self.name}-part_{part}.ndjson")
+
+	def _open(self, part, part_bytes):
+		path = self.path(part)
+		# on resume, drop whatever was written after the last checkpoint
+		mode = 'r+b' if part_bytes and os.path.exists(path) else 'wb'
+		self.file = open(path, mode, buffering=self.buffer_size)
+		self.file.truncate(part_bytes)
+		self.file.seek(part_bytes)
+		self.part = part
+		self.part_bytes = part_bytes
+
+	def write(self, record: bytes):
+		if self.max_bytes and self.part_bytes and self.part_bytes + len(record) > self.max_bytes:
+			self.file.close()
+			self._open(self.part + 1, 0)
+		self.file.write(record)
+		self.part_bytes += len(record)
+		self.records += 1
+
+	def state(self) -> Dict:
+		"""Flush to disk and return the position to resume writing from."""
+		self.file.flush()
+		os.fsync(self.file.fileno())
+		return {"part": self.part, "part_bytes": self.part_bytes}
+
+	def close(self):
+		self.file.close()
+
+
+class ESBulkWriter:
+	"""Sends records (action + document lines) to Elasticsearch as _bulk requests on a thread
+	pool and rolls up the documents each request created. state() waits for every request in
+	flight, so a checkpoint taken after it never covers unacknowledged documents."""
+
+	def __init__(self, es, chunk_size=500, threads=4, indexed=0, errors=0):
+		from common.rollups import DailyRollup, document_dims
+		from common.terms import DailyTerms
+
+		self.es = es
+		self.chunk_size = chunk_size
+		self.pool = ThreadPoolExecutor(max_workers=threads)
+		self.max_in_flight = threads * 2
+		self.chunk = []
+		self.in_flight = deque()
+		self.records = 0
+		self.indexed = indexed
+		self.errors = errors
+		self.rollup = DailyRollup()
+		self.terms = DailyTerms()
+		self.document_dims = document_dims
+
+	def write(self, record: bytes):
+		self.chunk.append(record)
+		self.records += 1
+		if len(self.chunk) >= self.chunk_size:
+			self._submit()
+
+	def _submit(self):
+		chunk, self.chunk = self.chunk, []
+		self.in_flight.append((chunk, time.perf_counter(), self.pool.submit(self.es.bulk, operations=chunk)))
+		while len(self.in_flight) >= self.max_in_flight:
+			self._collect()
+
+	def _collect(self):
+		chunk, submitted, future = self.in_flight.popleft()
+		response = future.result()
+		# latency from submission, so it includes time queued behind other requests
+		metrics.observe_bulk("pushshift", len(chunk), time.perf_counter() - submitted,
+							 [item for item in response["items"] if next(iter(item.values())).get("status", 500) >= 300])
+		for record, item in zip(chunk, response["items"]):
+			info = next(iter(item.values()))
+			if info.get("status", 500) >= 300:
+				self.errors += 1
+				if self.errors <= 10:
+					log.info(f"Bulk error for {info.get('_id')}: {info.get('error')}")
+				continue
+			self.indexed += 1
+			if info.get("result") == "created":
+				source = json.loads(record.split(b"\n", 1)[1])
+				self.rollup.add(info["_index"], source)
+				self.terms.add(*self.document_dims(info["_index"], source), source.get("content") or "")
+
+	def state(self) -> Dict:
+		if self.chunk:
+			self._submit()
+		while self.in_flight:
+			self._collect()
+		self.rollup.flush(self.es)
+		self.terms.flush(self.es)
+		return {"indexed": self.indexed, "errors": self.errors}
+
+	def close(self):
+		self.state()
+		self.pool.shutdown()
+
+
+class CountingWriter:
+	"""Dry-run writer: counts the records that would be indexed, per target index."""
+
+	def __init__(self, counts=None):
+		self.records = 0
+		self.counts = Counter(counts or {})
+
+	def write(self, record: bytes):
+		self.records += 1
+		self.counts[json.loads(record.split(b"\n", 1)[0])["index"]["_index"]] += 1
+
+	def state(self) -> Dict:
+		return {"counts": dict(self.counts)}
+
+	def close(self):
+		for index, count in sorted(self.counts.items()):
+			log.info(f"  {index}: {count:,}")
+
+
+def load_checkpoint(path) -> Optional[Dict]:
+	if not os.path.exists(path):
+		return None
+	with open(path) as f:
+		return json.load(f)
+
+def save_checkpoint(path, state: Dict):
+	tmp = path + ".tmp"
+	with open(tmp, "w") as f:
+		json.dump(state, f)
+	os.replace(tmp, path)
 
 # Clean data
+@metrics.timed_stage("clean_content")
 def clean_content(text: str) -> str:
     if not text:
         return ""
@@ -69,12 +261,17 @@ def clean_content(text: str) -> str:
 
 # Sentiment score
 analyzer = SentimentIntensityAnalyzer()
+@metrics.timed_stage("analyze_sentiment")
 def analyze_sentiment(text: str) -> Tuple[float, str]:
      vs = analyzer.polarity_scores(text)
      score = vs["compound"]
      label = "positive" if score >= 0.05 else ("negative" if score <= -0.05 else "neutral")
      return score, label
 
+def sentiment_fields(text: str) -> Dict:
+	score, sentiment = analyze_sentiment(text)
+	return {'sentiment': sentiment, 'sentiment_score': score}
+
 
 def KeyWordsPresenceInSubmission(submission, keywords):
 	"""Check if any of the keywords are present in the title or text of the submission."""
@@ -101,14 +298,152 @@ def KeyWordsPresenceInComment(comment, keywords):
 		return True
 	return False
 
-def ConvertSubmissionToStandardFormat(submission):
-	"""Convert the line of data to the standard format."""
+# Text fields the keyword checks above look at, per archive kind
+KEYWORD_FIELDS = {"submissions": (b"title", b"selftext_html"), "comments": (b"body",)}
+
+class KeywordPrefilter:
+	"""Rejects raw lines before JSON decoding when no keyword occurs inside the raw value of
+	any keyword field. Searching the raw field values (not the whole line, where e.g.
+	"parent_id" contains "rent") only ever lets extra lines through, never drops a match."""
+
+	def __init__(self, kind, keywords):
+		self.fields = [b'"' + field + b'"' for field in KEYWORD_FIELDS[kind]]
+		self.keywords = [keyword.encode("ascii") for keyword in keywords]
+		self.value = re.compile(rb'\s*:\s*"([^"\\]*(?:\\.[^"\\]*)*)"')
+
+	def __call__(self, line: bytes) -> bool:
+		for field in self.fields:
+			pos = line.find(field)
+			while pos != -1:
+				match = self.value.match(line, pos + len(field))
+				if match:
+					start, end = match.span(1)
+					for keyword in self.keywords:
+						if line.find(keyword, start, end) != -1:
+							return True
+				pos = line.find(field, pos + 1)
+		return False
+
+_prefilters = {}
+
+def get_prefilter(kind, keywords) -> Optional[KeywordPrefilter]:
+	"""Prefilter for the keywords, or None when a keyword could be JSON-escaped in the raw line."""
+	key = (kind, tuple(keywords))
+	if key not in _prefilters:
+		safe = all(k and k.isascii() and k.isprintable() and not set(k) & set('"\\/') for k in keywords)
+		_prefilters[key] = KeywordPrefilter(kind, keywords) if safe else None
+	return _prefilters[key]
+
+# Fields the keyword checks and the standard-format conversion read, per archive kind
+RECORD_FIELDS = {
+	"submissions": ("id", "title", "selftext", "selftext_html", "author", "created_utc", "subreddit"),
+	"comments": ("id", "body", "author", "created_utc", "parent_id", "link_id", "subreddit"),
+}
+
+_STRING_VALUE = re.compile(rb'"([^"\\]*(?:\\.[^"\\]*)*)"')
+_SCALAR_VALUE = re.compile(rb'-?\d+(\.\d+)?([eE][+-]?\d+)?|null|true|false')
+_SCALARS = {b"null": None, b"true": True, b"false": False}
+_field_patterns = {}
+
+def decode_record(line: bytes, kind: str) -> Dict:
+	"""Decode only the RECORD_FIELDS of a raw Pushshift line; other fields are skipped unparsed.
+	Lines where a wanted key repeats (e.g. in a nested crosspost) or holds an object/array
+	fall back to json.loads, so the result always matches the top-level values."""
+
+	fields = RECORD_FIELDS[kind]
+	pattern = _field_patterns.get(kind)
+	if pattern is None:
+		names = b"|".join(re.escape(field.encode("ascii")) for field in fields)
+		pattern = _field_patterns[kind] = re.compile(rb'"(' + names + rb')"\s*:\s*')
+
+	record = {}
+	for match in pattern.finditer(line):
+		key = match.group(1).decode("ascii")
+		if key in record or line[match.start() - 1:match.start()] == b"\\":
+			return json.loads(line)
+		pos = match.end()
+		if line[pos:pos + 1] == b'"':
+			value = _STRING_VALUE.match(line, pos)
+			if value is None:
+				raise ValueError(f"Unterminated string for {key}")
+			raw = value.group(1)
+			record[key] = json.loads(value.group(0)) if b"\\" in raw else raw.decode("utf-8")
+		else:
+			value = _SCALAR_VALUE.match(line, pos)
+			if value is None:
+				return json.loads(line)
+			token = value.group(0)
+			if token in _SCALARS:
+				record[key] = _SCALARS[token]
+			else:
+				record[key] = float(token) if value.group(1) or value.group(2) else int(token)
+	return record
+
+_LINK_ID = re.compile(rb'"link_id"\s*:\s*"t3_([0-9a-z]+)"')
+
+class ThreadIds:
+	"""Compact set of submission ids: base36 ids decoded to a sorted int64 array, looked up
+	with bisect (O(log n), 8 bytes per id instead of a set of str)."""
+
+	def __init__(self, ids: Optional[array] = None):
+		self.ids = array('q', sorted(ids)) if ids else array('q')
+
+	def __len__(self):
+		return len(self.ids)
+
+	def __contains__(self, id36) -> bool:
+		value = int(id36, 36)
+		i = bisect_left(self.ids, value)
+		return i < len(self.ids) and self.ids[i] == value
+
+	@property
+	def nbytes(self) -> int:
+		return self.ids.itemsize * len(self.ids)
+
+	def save(self, path):
+		with open(path, 'wb') as f:
+			self.ids.tofile(f)
+
+	@classmethod
+	def load(cls, path) -> "ThreadIds":
+		thread_ids = cls()
+		with open(path, 'rb') as f:
+			thread_ids.ids.frombytes(f.read())
+		return thread_ids
+
+def collect_thread_ids(zst_path, keywords, prefilter=True) -> ThreadIds:
+	"""Phase one of the thread join: ids of the submissions matching the keywords.
+	Only the keyword fields are decoded; nothing is converted or scored."""
+	ids = array('q')
+	matcher = get_prefilter("submissions", keywords) if prefilter else None
+	for line, _, _ in read_lines_zst(zst_path):
+		if matcher is not None and not matcher(line):
+			continue
+		try:
+			submission = decode_record(line, "submissions")
+			if KeyWordsPresenceInSubmission(submission, keywords):
+				ids.append(int(submission["id"], 36))
+		except (KeyError, ValueError, TypeError) as err:
+			continue
+	return ThreadIds(ids)
+
+def linked_submission(line: bytes) -> Optional[str]:
+	"""Base36 id of the submission a raw comment line belongs to, read without decoding the body."""
+	matches = _LINK_ID.findall(line)
+	if len(matches) == 1:
+		return matches[0].decode("ascii")
+	link_id = decode_record(line, "comments").get("link_id") or ""
+	return link_id[3:] if link_id.startswith("t3_") else None
+
+def ConvertSubmissionToStandardFormat(submission, dedup=None):
+	"""Convert the line of data to the standard format. With a Deduplicator, near-duplicates
+	reuse the sentiment of their canonical submission and are linked to it."""
 	
-	state = 'UNKNOWN'  # Default state, can be updated based on submission data
+	state = classify_state(submission["title"] + " " + (submission.get("selftext") or ""), subreddit=submission.get("subreddit"))
 	text =  submission["title"] + " " + clean_content(submission["selftext_html"])
 	# score = 0.0
 	# sentiment = 'neutral'
-	score, sentiment = analyze_sentiment(text)
+	enrichment, canonical = enrich_once(dedup, submission['id'], text, sentiment_fields)
 	
 	# prepare post action with unique _id
 	standardDict = {
@@ -119,97 +454,349 @@ def ConvertSubmissionToStandardFormat(submission):
 			'created_at': datetime.fromtimestamp(int(submission['created_utc'])).isoformat(),
 			'tags': submission['subreddit'],
 			'state': state,
-			'sentiment': sentiment,
-			'sentiment_score': score
+			'sentiment': enrichment['sentiment'],
+			'sentiment_score': enrichment['sentiment_score']
 		}
 
-	return standardDict
+	return dedup.link(standardDict, canonical) if dedup is not None else standardDict
 
-def ConvertCommentToStandardFormat(comment):
-	"""Convert the line of data to the standard format."""
+def ConvertCommentToStandardFormat(comment, dedup=None):
+	"""Convert the line of data to the standard format. With a Deduplicator, near-duplicates
+	reuse the sentiment of their canonical comment and are linked to it."""
 	
-	state = 'UNKNOWN'  # Default state, can be updated based on comment data
+	state = classify_state(comment["body"], subreddit=comment.get("subreddit"))
 	text = clean_content(comment["body"])
 	# score = 0.0
 	# sentiment = 'neutral'
-	score, sentiment = analyze_sentiment(text)
+	enrichment, canonical = enrich_once(dedup, comment['id'], text, sentiment_fields)
 	
 	# prepare post action with unique _id
 	standardDict = {
-			'post_id': comment['id'],
+			'comment_id': comment['id'],
 			'post_id': comment['parent_id'],
 			'platform': 'reddit',
 			'author': comment['author'],
 			'content': text,
 			'created_at': datetime.fromtimestamp(int(comment['created_utc'])).isoformat(),
 			'state': state,
-			'sentiment': sentiment,
-			'sentiment_score': score
+			'sentiment': enrichment['sentiment'],
+			'sentiment_score': enrichment['sentiment_score']
 	}
 
-	return standardDict
-
-
-if __name__ == "__main__":
-
+	return dedup.link(standardDict, canonical) if dedup is not None else standardDict
+
+
+# Bulk actions route each document to the monthly partition of its created_at
+POST_INDEX = "housing-posts"
+COMMENT_INDEX = "housing-comments"
+KEYWORDS = ['housing', 'affordability', 'rent', 'mortgage']
+
+
+def convert_line(line, kind, keywords, prefilter=True, thread_ids=None, dedup=None):
+	"""Bulk action and document lines (bytes) for a matching record, None when it is filtered out.
+	With thread_ids, comments are kept by the submission they belong to instead of by keyword.
+	dedup is the Deduplicator for this kind of record, if any.
+	Raises KeyError / ValueError for malformed candidate lines."""
+
+	if kind == "comments" and thread_ids is not None:
+		link = linked_submission(line)
+		if link is None or link not in thread_ids:
+			return None
+		standardised = ConvertCommentToStandardFormat(decode_record(line, kind), dedup)
+		return bulk_record(COMMENT_INDEX, standardised)
+	if prefilter:
+		matcher = get_prefilter(kind, keywords)
+		if matcher is not None and not matcher(line):
+			return None
+	obj = decode_record(line, kind)
+	if kind == "submissions":
+		if not KeyWordsPresenceInSubmission(obj, keywords):
+			return None
+		standardised = ConvertSubmissionToStandardFormat(obj, dedup)
+		index = POST_INDEX
+	else:
+		if not KeyWordsPresenceInComment(obj, keywords):
+			return None
+		standardised = ConvertCommentToStandardFormat(obj, dedup)
+		index = COMMENT_INDEX
+	return bulk_record(index, standardised)
+
+
+def bulk_record(index, standardised):
+	if standardised is None:
+		return None
+	# the Reddit id as _id makes re-running a backfill overwrite instead of duplicating
+	doc_id = standardised.get("comment_id", standardised["post_id"])
+	action = {"index": {"_index": partition_index(index, standardised["created_at"]), "_id": doc_id}}
+	return (json.dumps(action) + "\n" + json.dumps(standardised) + "\n").encode("utf-8")
+
+
+def dedup_options(args) -> Optional[Dict]:
+	# Plain settings rather than Deduplicators, so they can be handed to worker processes
+	if not args.dedup:
+		return None
+	return {"redis_url": args.dedup_redis, "reference_only": args.dedup_reference_only, "threshold": args.dedup_threshold}
+
+def make_dedups(options) -> Dict[str, Deduplicator]:
+	"""One Deduplicator per archive kind, in this process; empty when deduplication is off."""
+	if not options:
+		return {}
+	redis_client = None
+	if options["redis_url"]:
+		import redis
+		redis_client = redis.Redis.from_url(options["redis_url"], decode_responses=True)
+	return {
+		kind: Deduplicator(index, threshold=options["threshold"], redis=redis_client, reference_only=options["reference_only"])
+		for kind, index in (("submissions", POST_INDEX), ("comments", COMMENT_INDEX))
+	}
 
 
+def checkpoint_path(args, name):
+	suffix = "dry-run" if args.dry_run else args.target
+	return os.path.join(args.output_dir, f"{name}.{suffix}-checkpoint.json")
+
+def make_writer(args, name, checkpoint):
+	if args.dry_run:
+		return CountingWriter(checkpoint.get("counts"))
+	if args.target == "es":
+		return ESBulkWriter(args.es, args.bulk_size, args.bulk_threads, checkpoint.get("indexed", 0), checkpoint.get("errors", 0))
+	return RotatingNDJSONWriter(args.output_dir, name, args.max_bytes, checkpoint.get("part", 0), checkpoint.get("part_bytes", 0))
+
+def open_output(args, name):
+	"""Writer and input offset for one archive, picking up from its checkpoint when resuming.
+	Returns (None, None) when the checkpoint says the archive is already converted."""
+	checkpoint = load_checkpoint(checkpoint_path(args, name)) if args.resume else None
+	if checkpoint is None:
+		return make_writer(args, name, {}), 0
+	if checkpoint.get("done"):
+		log.info(f"{name} already converted, skipping")
+		return None, None
+	log.info(f"Resuming {name} at input byte {checkpoint['input_offset']:,} (compressed {checkpoint.get('compressed_offset', 0):,})")
+	return make_writer(args, name, checkpoint), checkpoint["input_offset"]
+
+def progress(name, lines, bad_lines, writer, started, compressed_offset=None, file_size=None):
+	elapsed = max(time.monotonic() - started, 1e-9)
+	percent = f" : {(compressed_offset / file_size) * 100:.0f}%" if file_size else ""
+	log.info(f"{name} : {lines:,} lines : {bad_lines:,} bad : {writer.records:,} written : {lines / elapsed:,.0f} lines/s{percent}")
+
+
+def convert_archive(args, zst_path, kind, name):
+	"""Stream one archive into rotating NDJSON files, checkpointing every checkpoint_every lines."""
+	writer, start_offset = open_output(args, name)
+	if writer is None:
+		return
+	checkpoint = checkpoint_path(args, name)
+	file_size = os.stat(zst_path).st_size
 	file_lines = 0
-	file_bytes_processed = 0
 	bad_lines = 0
-	
-	keywords = ['housing', 'affordability', 'rent', 'mortgage']
-
-	SubmissionZstPath = r"E:\Unimelb Extras\reddit\subreddits24\AusFinance_submissions.zst"
-	CommentsZstPath = r"E:\Unimelb Extras\reddit\subreddits24\AusFinance_comments.zst"
-
-	outputDir = r"E:\Unimelb Extras\reddit\subreddits24\NDJSON"
-
-	outputSubmissionList = []
-	outputCommentList = []
-
-	postCommand = {"index": {"_index": "housing-posts"}}
-	commentCommand = {"index": {"_index": "housing-comments"}}
+	input_offset = start_offset
+	file_bytes_processed = 0
+	started = time.monotonic()
+	dedup = make_dedups(dedup_options(args)).get(kind)
 
-	for line, file_bytes_processed in read_lines_zst(SubmissionZstPath):
+	for line, file_bytes_processed, input_offset in read_lines_zst(zst_path, start_offset):
 		try:
-			obj = json.loads(line)
-			if (KeyWordsPresenceInSubmission(obj, keywords)):
-				standardised =  ConvertSubmissionToStandardFormat(obj)
-				if (standardised is not None):
-					outputSubmissionList.append(postCommand)
-					outputSubmissionList.append(standardised)
-		except (KeyError, json.JSONDecodeError) as err:
+			record = convert_line(line, kind, args.keywords, not args.no_prefilter, args.thread_ids, dedup)
+			if record is not None:
+				writer.write(record)
+		except (KeyError, ValueError, TypeError) as err:
 			bad_lines += 1
 		file_lines += 1
-		if file_lines % 100000 == 0:
-			log.info(f"{file_lines:,} : {bad_lines:,} : {file_bytes_processed:,}%")
-
-	
-	for line, file_bytes_processed in read_lines_zst(CommentsZstPath):
+		if file_lines % args.checkpoint_every == 0:
+			save_checkpoint(checkpoint, {"input_offset": input_offset, "compressed_offset": file_bytes_processed, **writer.state()})
+			progress(name, file_lines, bad_lines, writer, started, file_bytes_processed, file_size)
+
+	save_checkpoint(checkpoint, {"input_offset": input_offset, "compressed_offset": file_bytes_processed, "done": True, **writer.state()})
+	writer.close()
+	progress(f"{name} complete", file_lines, bad_lines, writer, started)
+	if dedup is not None:
+		log.info(dedup.summary())
+
+
+def reader_process(kind, zst_path, start_offset, batch_lines, task_queue, result_queue):
+	"""Pipeline stage 1: decompress one archive and cut it into numbered line batches."""
+	seq = 0
+	batch = []
+	for line, compressed, offset in read_lines_zst(zst_path, start_offset):
+		batch.append(line)
+		if len(batch) >= batch_lines:
+			task_queue.put((kind, seq, batch, (offset, compressed)))
+			seq += 1
+			batch = []
+	if batch:
+		task_queue.put((kind, seq, batch, (offset, compressed)))
+		seq += 1
+	result_queue.put((kind, "done", seq))
+
+
+def worker_process(keywords, prefilter, thread_ids, dedup, metrics_port, task_queue, result_queue):
+	"""Pipeline stage 2: parse, filter and enrich batches until a None sentinel arrives.
+	dedup holds the deduplication options; each worker keeps its own band index
+	(shared between workers only through Redis). Enrichment metrics are served on
+	metrics_port (0 = off), since they are recorded in the worker."""
+	metrics.serve(metrics_port)
+	dedups = make_dedups(dedup)
+	while True:
+		task = task_queue.get()
+		if task is None:
+			for kind_dedup in dedups.values():
+				log.info(kind_dedup.summary())
+			break
+		kind, seq, lines, offsets = task
+		records = []
+		bad_lines = 0
+		for line in lines:
+			try:
+				record = convert_line(line, kind, keywords, prefilter, thread_ids, dedups.get(kind))
+				if record is not None:
+					records.append(record)
+			except (KeyError, ValueError, TypeError) as err:
+				bad_lines += 1
+		result_queue.put((kind, "batch", (seq, records, len(lines), bad_lines, offsets)))
+
+
+def convert_pipeline(args, archives):
+	"""Convert every archive at once: one reader process per archive, a pool of worker
+	processes, and this process writing each archive's batches back in input order."""
+	ctx = multiprocessing.get_context()
+	task_queue = ctx.Queue(maxsize=args.workers * 4)
+	result_queue = ctx.Queue()
+
+	outputs = {}
+	readers = []
+	for zst_path, kind, name in archives:
+		writer, start_offset = open_output(args, name)
+		if writer is None:
+			continue
+		outputs[kind] = {"name": name, "writer": writer, "next": 0, "pending": {}, "total": None,
+						 "lines": 0, "bad": 0, "checkpoint": checkpoint_path(args, name),
+						 "size": os.stat(zst_path).st_size}
+		readers.append(ctx.Process(target=reader_process, daemon=True,
+								   args=(kind, zst_path, start_offset, args.batch_lines, task_queue, result_queue)))
+	if not outputs:
+		return
+
+	# worker i serves its metrics on --metrics-port + 1 + i
+	workers = [ctx.Process(target=worker_process, daemon=True,
+						   args=(args.keywords, not args.no_prefilter, args.thread_ids, dedup_options(args),
+								 args.metrics_port + 1 + i if args.metrics_port else 0, task_queue, result_queue))
+			   for i in range(args.workers)]
+	for process in readers + workers:
+		process.start()
+	started = time.monotonic()
+
+	def finished(out):
+		return out["total"] is not None and out["next"] == out["total"]
+
+	while not all(finished(out) for out in outputs.values()):
 		try:
-			obj = json.loads(line)
-			if (KeyWordsPresenceInComment(obj, keywords)):
-				standardised = ConvertCommentToStandardFormat(obj)
-				if (standardised is not None):
-					outputCommentList.append(commentCommand)
-					outputCommentList.append(standardised)
-		except (KeyError, json.JSONDecodeError) as err:
-			bad_lines += 1
-		file_lines += 1
-		if file_lines % 100000 == 0:
-			log.info(f"{file_lines:,} : {bad_lines:,} : {file_bytes_processed:,}%")
+			kind, message, payload = result_queue.get(timeout=10)
+		except queue.Empty:
+			if any(p.exitcode not in (None, 0) for p in readers + workers):
+				raise RuntimeError("A conversion process exited unexpectedly")
+			continue
+
+		out = outputs[kind]
+		if message == "done":
+			out["total"] = payload
+		else:
+			out["pending"][payload[0]] = payload
+
+		# write batches strictly in input order so offsets in the checkpoint stay contiguous
+		while out["next"] in out["pending"]:
+			_, records, line_count, bad_lines, (offset, compressed) = out["pending"].pop(out["next"])
+			for record in records:
+				out["writer"].write(record)
+			out["next"] += 1
+			out["lines"] += line_count
+			out["bad"] += bad_lines
+			if out["next"] % max(args.checkpoint_every // args.batch_lines, 1) == 0:
+				save_checkpoint(out["checkpoint"], {"input_offset": offset, "compressed_offset": compressed, **out["writer"].state()})
+				progress(out["name"], out["lines"], out["bad"], out["writer"], started, compressed, out["size"])
+			out["offsets"] = {"input_offset": offset, "compressed_offset": compressed}
+
+		if finished(out):
+			state = out["writer"].state()
+			if "offsets" in out:
+				save_checkpoint(out["checkpoint"], {**out["offsets"], "done": True, **state})
+			else:
+				checkpoint = load_checkpoint(out["checkpoint"]) or {"input_offset": 0}
+				save_checkpoint(out["checkpoint"], {**checkpoint, "done": True, **state})
+			out["writer"].close()
+			progress(f"{out['name']} complete", out["lines"], out["bad"], out["writer"], started)
+
+	for _ in workers:
+		task_queue.put(None)
+	for process in readers + workers:
+		process.join()
+
+
+def parse_args():
+	p = argparse.ArgumentParser(description="Convert Pushshift subreddit dumps to bulk NDJSON or index them directly")
+	p.add_argument("--submissions", required=True, help="Pushshift submissions archive, e.g. AusFinance_submissions.zst")
+	p.add_argument("--comments", required=True, help="Pushshift comments archive, e.g. AusFinance_comments.zst")
+	p.add_argument("--output-dir", default="NDJSON", help="NDJSON output and checkpoint directory (default: ./NDJSON)")
+	p.add_argument("--target", choices=["ndjson", "es"], default="ndjson", help="Write NDJSON files or _bulk straight into Elasticsearch")
+	p.add_argument("--dry-run", action="store_true", help="Only count the documents that would be written, per index")
+	p.add_argument("--prefix", default="reddit-AusFinance", help="Output files are <prefix>-submissions / <prefix>-comments")
+	p.add_argument("--keywords", nargs="+", default=KEYWORDS)
+	p.add_argument("--no-prefilter", action="store_true", help="JSON-decode every line instead of prefiltering raw bytes")
+	p.add_argument("--join-threads", action="store_true",
+				   help="Keep every comment on a matching submission instead of keyword-matching comment bodies")
+	p.add_argument("--max-bytes", type=int, default=0, help="Rotate output files at this size (default: 0, one file per archive)")
+	p.add_argument("--checkpoint-every", type=int, default=100000, help="Lines between checkpoints (default: 100000)")
+	p.add_argument("--resume", action="store_true", help="Continue from the checkpoints left by a previous run")
+	p.add_argument("--workers", type=int, default=0, help="Worker processes; 0 converts the archives one after the other in this process")
+	p.add_argument("--batch-lines", type=int, default=2000, help="Lines per pipeline batch (default: 2000)")
+	p.add_argument("--dedup", action="store_true", help="Detect near-duplicate records (MinHash/LSH) and reuse their canonical record's sentiment")
+	p.add_argument("--dedup-threshold", type=float, default=0.8, help="Estimated Jaccard similarity for a near-duplicate (default: 0.8)")
+	p.add_argument("--dedup-reference-only", action="store_true", help="Write near-duplicates as a duplicate_of reference without their content")
+	p.add_argument("--dedup-redis", help="Redis URL to share the band index with other runs, e.g. redis://localhost:6379/0")
+	p.add_argument("--metrics-port", type=int, default=0,
+				   help="Serve Prometheus metrics on this port (pipeline workers on the following ports; default: 0, off)")
+	p.add_argument("--es-host", default="https://localhost:9200")
+	p.add_argument("--username", default="elastic")
+	p.add_argument("--password", default="elastic")
+	p.add_argument("--bulk-size", type=int, default=500, help="Documents per _bulk request (default: 500)")
+	p.add_argument("--bulk-threads", type=int, default=4, help="Concurrent _bulk requests (default: 4)")
+	return p.parse_args()
 
-	outputSubmissionList.append("")
-	outputCommentList.append("")
 
-	with open(os.path.join(outputDir, "reddit-AusFinance-submissions.ndjson"), "w") as final:
-		ndjson.dump(outputSubmissionList, final)
-
-	with open(os.path.join(outputDir, "reddit-Finance-comments.ndjson"), "w") as final:
-		ndjson.dump(outputCommentList, final)
-
-	# except Exception as err:
-	# 	log.info(err)
-
-	log.info(f"Complete : {file_lines:,} : {bad_lines:,}")
\ No newline at end of file
+if __name__ == "__main__":
+	args = parse_args()
+	os.makedirs(args.output_dir, exist_ok=True)
+	if metrics.serve(args.metrics_port):
+		log.info(f"Serving metrics on :{args.metrics_port}/metrics")
+
+	if args.target == "es" and not args.dry_run:
+		from elasticsearch import Elasticsearch
+		from common.partitions import ensure_partition_template
+		from common.rollups import ensure_rollup_index
+
+		args.es = Elasticsearch(hosts=args.es_host, verify_certs=False, http_auth=(args.username, args.password))
+		for base in (POST_INDEX, COMMENT_INDEX):
+			ensure_partition_template(args.es, base)
+		ensure_rollup_index(args.es)
+
+	args.thread_ids = None
+	if args.join_threads:
+		ids_path = os.path.join(args.output_dir, f"{args.prefix}-submissions.ids")
+		if args.resume and os.path.exists(ids_path):
+			args.thread_ids = ThreadIds.load(ids_path)
+		else:
+			args.thread_ids = collect_thread_ids(args.submissions, args.keywords, not args.no_prefilter)
+			args.thread_ids.save(ids_path)
+		log.info(f"Joining comments on {len(args.thread_ids):,} submissions ({args.thread_ids.nbytes:,} bytes)")
+
+	archives = [
+		(args.submissions, "submissions", f"{args.prefix}-submissions"),
+		(args.comments, "comments", f"{args.prefix}-comments"),
+	]
+
+	if args.workers > 0:
+		convert_pipeline(args, archives)
+	else:
+		for zst_path, kind, name in archives:
+			convert_archive(args, zst_path, kind, name)
+
+	log.info("Complete")
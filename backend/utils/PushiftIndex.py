@@ -0,0 +1,266 @@
+# COMP90024 Team 75
+# Linying Wei (1638206)
+# Wangyang Wu (1641248)
+# Ziyu Wang (1560831)
+# Roger Zhang (1079986)
+
+"""
+	Time-range index over Pushshift archives
+	Pushshift dumps are a single zstd frame, so any window means decompressing from the start.
+	`index` re-frames an archive into independent frames of ~frame_bytes decompressed data and
+	writes a sidecar (<archive>.idx.json) with each frame's compressed offset, length and
+	created_utc range. `read_window` then decompresses only the frames overlapping a window, and
+	`answer_task` serves the harvester's start_time/end_time tasks from local archives.
+
+	python PushiftIndex.py index --input AusFinance_submissions.zst --output AusFinance_submissions.seekable.zst
+	python PushiftIndex.py window --input AusFinance_submissions.seekable.zst --start 2024-01-01 --end 2024-01-15
+	python PushiftIndex.py task --archive-dir archives --task '{"subreddit": "AusFinance", "keyword": "rent", ...}'
+"""
+
+import argparse
+import json
+import logging.handlers
+import os
+import re
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional
+
+import zstandard
+
+from PushiftConversion import decode_record, read_lines_zst
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.geo import UNKNOWN, classify_state
+from common.partitions import as_utc_datetime, partition_index
+
+
+log = logging.getLogger("bot")
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+INDEX_SUFFIX = ".idx.json"
+
+# every created_utc on the line, nested ones included, so a frame's range can only be too wide
+_CREATED_UTC = re.compile(rb'"created_utc"\s*:\s*"?(\d+)')
+
+
+def index_path(zst_path):
+	return zst_path + INDEX_SUFFIX
+
+def load_index(zst_path) -> Dict:
+	with open(index_path(zst_path)) as f:
+		return json.load(f)
+
+
+def build_index(input_path, output_path, frame_bytes=2**23, level=3):
+	"""Re-frame input_path into output_path as independent frames and write its sidecar index."""
+	compressor = zstandard.ZstdCompressor(level=level, write_content_size=True)
+	frames = []
+	lines = 0
+
+	with open(output_path, 'wb') as out:
+		chunk = []
+		chunk_bytes = 0
+		low = high = None
+
+		def flush():
+			nonlocal chunk, chunk_bytes, low, high
+			if not chunk:
+				return
+			data = compressor.compress(b"".join(chunk))
+			frames.append({"offset": out.tell(), "length": len(data), "lines": len(chunk),
+						   "min_created_utc": low, "max_created_utc": high})
+			out.write(data)
+			chunk, chunk_bytes, low, high = [], 0, None, None
+
+		for line, file_bytes_processed, _ in read_lines_zst(input_path):
+			stamps = [int(s) for s in _CREATED_UTC.findall(line)]
+			if stamps:
+				low = min(stamps) if low is None else min(low, *stamps)
+				high = max(stamps) if high is None else max(high, *stamps)
+			chunk.append(line + b"\n")
+			chunk_bytes += len(line) + 1
+			lines += 1
+			if chunk_bytes >= frame_bytes:
+				flush()
+				if len(frames) % 100 == 0:
+					log.info(f"{lines:,} lines : {len(frames):,} frames : {file_bytes_processed:,} bytes read")
+		flush()
+
+	index = {"source": os.path.basename(input_path), "lines": lines, "frame_bytes": frame_bytes, "frames": frames}
+	with open(index_path(output_path), 'w') as f:
+		json.dump(index, f)
+	log.info(f"Indexed {lines:,} lines into {len(frames):,} frames : {output_path}")
+	return index
+
+
+def overlapping_frames(index: Dict, start: int, end: int) -> List[Dict]:
+	"""Frames that may hold records with start <= created_utc < end. Frames without any
+	timestamp are always read."""
+	return [
+		frame for frame in index["frames"]
+		if frame["min_created_utc"] is None or (frame["max_created_utc"] >= start and frame["min_created_utc"] < end)
+	]
+
+
+def read_window(zst_path, start, end, kind="submissions", index=None) -> Iterator[Dict]:
+	"""Yield the decoded records of a re-framed archive with start <= created_utc < end,
+	decompressing only the frames that overlap the window."""
+	start = int(as_utc_datetime(start).timestamp())
+	end = int(as_utc_datetime(end).timestamp())
+	index = index or load_index(zst_path)
+	decompressor = zstandard.ZstdDecompressor(max_window_size=2**31)
+
+	with open(zst_path, 'rb') as f:
+		for frame in overlapping_frames(index, start, end):
+			f.seek(frame["offset"])
+			data = decompressor.decompress(f.read(frame["length"]))
+			for line in data.split(b"\n"):
+				if not line:
+					continue
+				try:
+					record = decode_record(line, kind)
+					created = int(record["created_utc"])
+				except (KeyError, ValueError, TypeError):
+					continue
+				if start <= created < end:
+					yield record
+
+
+def archive_paths(archive_dir, subreddit) -> Dict[str, str]:
+	return {
+		"submissions": os.path.join(archive_dir, f"{subreddit}_submissions.seekable.zst"),
+		"comments": os.path.join(archive_dir, f"{subreddit}_comments.seekable.zst"),
+	}
+
+
+def answer_task(task: Dict, archive_dir, comment_days=30) -> List[Dict]:
+	"""Bulk actions answering a harvester task from local archives: submissions of the task's
+	subreddit in [start_time, end_time) mentioning the keyword (case-insensitive, like Reddit
+	search), and their comments made up to comment_days after end_time. Unlike the API the
+	archive is not capped, so max_posts is not applied."""
+	subreddit = task["subreddit"]
+	keyword = task["keyword"].lower()
+	start = as_utc_datetime(task["start_time"])
+	end = as_utc_datetime(task.get("end_time", task["start_time"]))
+	paths = archive_paths(archive_dir, subreddit)
+
+	actions = []
+	post_states = {}
+	for submission in read_window(paths["submissions"], start, end, "submissions"):
+		title = submission.get("title") or ""
+		selftext = submission.get("selftext") or ""
+		if keyword not in title.lower() and keyword not in selftext.lower():
+			continue
+		created = datetime.fromtimestamp(int(submission["created_utc"]), timezone.utc)
+		content = title + (" " + selftext if selftext else "")
+		post_states[submission["id"]] = classify_state(content, subreddit=subreddit)
+		actions.append({
+			'_index': partition_index('reddit-posts', created),
+			'_id': submission["id"],
+			'_source': {
+				'post_id': submission["id"],
+				'platform': 'reddit',
+				'author': submission.get("author") or '[deleted]',
+				'content': content,
+				'created_at': created.isoformat(),
+				'state': post_states[submission["id"]],
+				'tags': [subreddit, task["keyword"]],
+				'subreddit': subreddit,
+				'keyword': task["keyword"],
+				'task_id': task.get('task_id', ''),
+				'collection_mode': 'archive'
+			}
+		})
+
+	if post_states and os.path.exists(paths["comments"]):
+		for comment in read_window(paths["comments"], start, end + timedelta(days=comment_days), "comments"):
+			post_id = (comment.get("link_id") or "")[3:]
+			if post_id not in post_states:
+				continue
+			created = datetime.fromtimestamp(int(comment["created_utc"]), timezone.utc)
+			body = comment.get("body") or ""
+			# Comments inherit the post's state unless it is unknown
+			state = post_states[post_id]
+			if state == UNKNOWN:
+				state = classify_state(body, subreddit=subreddit)
+			actions.append({
+				'_index': partition_index('reddit-comments', created),
+				'_id': comment["id"],
+				'_source': {
+					'comment_id': comment["id"],
+					'post_id': post_id,
+					'platform': 'reddit',
+					'author': comment.get("author") or '[deleted]',
+					'content': body,
+					'created_at': created.isoformat(),
+					'state': state,
+					'collection_mode': 'archive'
+				}
+			})
+	return actions
+
+
+def parse_args():
+	p = argparse.ArgumentParser(description="Time-range index over Pushshift archives")
+	sub = p.add_subparsers(dest="command", required=True)
+
+	build = sub.add_parser("index", help="Re-frame an archive and write its sidecar index")
+	build.add_argument("--input", required=True)
+	build.add_argument("--output", required=True)
+	build.add_argument("--frame-bytes", type=int, default=2**23, help="Decompressed bytes per frame (default: 8 MiB)")
+	build.add_argument("--level", type=int, default=3)
+
+	window = sub.add_parser("window", help="Print the records of a re-framed archive inside a time window")
+	window.add_argument("--input", required=True)
+	window.add_argument("--start", required=True)
+	window.add_argument("--end", required=True)
+	window.add_argument("--kind", choices=["submissions", "comments"], default="submissions")
+	window.add_argument("--count", action="store_true", help="Only print the number of records")
+
+	answer = sub.add_parser("task", help="Answer harvester tasks from re-framed archives")
+	answer.add_argument("--archive-dir", required=True, help="Directory of <subreddit>_{submissions,comments}.seekable.zst")
+	answer.add_argument("--task", action="append", required=True, help="Task JSON as queued by task_producer.py (repeatable)")
+	answer.add_argument("--es-host", help="Index the answers here; without it only counts are printed")
+	answer.add_argument("--username", default="elastic")
+	answer.add_argument("--password", default="elastic")
+	return p.parse_args()
+
+
+if __name__ == "__main__":
+	args = parse_args()
+
+	if args.command == "index":
+		build_index(args.input, args.output, args.frame_bytes, args.level)
+
+	elif args.command == "window":
+		count = 0
+		for record in read_window(args.input, args.start, args.end, args.kind):
+			count += 1
+			if not args.count:
+				print(json.dumps(record))
+		log.info(f"{count:,} records")
+
+	else:
+		es = None
+		if args.es_host:
+			from elasticsearch import Elasticsearch
+			from common.partitions import ensure_partition_template
+			from common.rollups import bulk_with_rollups, ensure_rollup_index
+
+			es = Elasticsearch(hosts=args.es_host, verify_certs=False, http_auth=(args.username, args.password))
+			ensure_partition_template(es, 'reddit-posts', 'posts')
+			ensure_partition_template(es, 'reddit-comments', 'comments')
+			ensure_rollup_index(es)
+
+		for task_json in args.task:
+			task = json.loads(task_json)
+			started = datetime.now(timezone.utc)
+			actions = answer_task(task, args.archive_dir)
+			posts = sum(1 for a in actions if a['_index'].startswith('reddit-posts'))
+			if es is not None:
+				success, errors = bulk_with_rollups(es, actions, chunk_size=500)
+				log.info(f"{task.get('task_id', '')} : indexed {success:,}, {len(errors):,} errors")
+			elapsed = (datetime.now(timezone.utc) - started).total_seconds()
+			log.info(f"{task.get('task_id', '')} : {posts:,} posts, {len(actions) - posts:,} comments in {elapsed:.1f}s")
@@ -4,59 +4,56 @@
 # Ziyu Wang (1560831)
 # Roger Zhang (1079986)
 
+import os
+import sys
 from elasticsearch import Elasticsearch
 import pandas as pd
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.rollups import query_rollups
+from common.terms import top_terms
+
 # Connect to local Elasticsearch
 es = Elasticsearch("http://localhost:9200")
 
 # === Settings ===
+# upload_to_es.py / bulk_insert_to_es.py maintain the rollups and term buckets of this index
 index_name = "housing_comments"
-query = {
-    "query": {
-        "match_all": {}
-    },
-    "size": 10000
-}
+datasets = (index_name,)
 
 # === Fetch data ===
-res = es.search(index=index_name, body=query, scroll="2m")
-scroll_id = res["_scroll_id"]
-hits = res["hits"]["hits"]
-
-while True:
-    scroll_res = es.scroll(scroll_id=scroll_id, scroll="2m")
-    scroll_hits = scroll_res["hits"]["hits"]
-    if not scroll_hits:
-        break
-    hits.extend(scroll_hits)
+# Counts and sentiment come from the daily rollups (all time, comments only), terms from
+# the daily term buckets - the cost depends on days x groups, never on the document count
+by_sentiment = query_rollups(es, "sentiment", start_days=None, kind="comments", datasets=datasets)
+by_state = query_rollups(es, ("state", "sentiment"), start_days=None, kind="comments", datasets=datasets)
 
-records = []
-for hit in hits:
-    source = hit["_source"]
-    records.append({
-        "sentiment_score": source.get("sentiment_score", None),
-        "sentiment": source.get("sentiment", None),
-        "topic": source.get("topic", None),
-        "topic_label": source.get("topic_label", None),
-        "state": source.get("state", None)
-    })
+df = pd.DataFrame(
+    [{"state": state, "sentiment": sentiment, **row} for (state, sentiment), row in by_state.items()],
+    columns=["state", "sentiment", "count", "scored", "mean", "std"]
+)
 
-df = pd.DataFrame(records)
+def score_summary(rows):
+    count = sum(r["count"] for r in rows)
+    scored = sum(r["scored"] for r in rows)
+    total = sum(r["mean"] * r["scored"] for r in rows)
+    total_sq = sum((r["std"] ** 2 + r["mean"] ** 2) * r["scored"] for r in rows)
+    mean = total / scored if scored else 0.0
+    std = max(total_sq / scored - mean * mean, 0.0) ** 0.5 if scored else 0.0
+    return count, scored, mean, std
 
 # === Basic Statistics ===
-print("Total comments:", len(df))
+total, scored, mean, std = score_summary(list(by_sentiment.values()))
+if not total:
+    sys.exit(f"No rollups for {index_name}: upload with processor/upload_to_es.py or bulk_insert_to_es.py first")
+print("Total comments:", total)
 print("\nSentiment distribution:")
-print(df["sentiment"].value_counts())
+print(pd.Series({label: row["count"] for label, row in by_sentiment.items()}).sort_values(ascending=False))
 
 print("\nSentiment score (summary):")
-print(df["sentiment_score"].describe())
-
-print("\nTop 10 topics:")
-print(df["topic"].value_counts().head(10))
+print(pd.Series({"count": scored, "mean": mean, "std": std}))
 
-print("\nTop 10 topic labels:")
-print(df["topic_label"].value_counts().head(10))
+print("\nTop 10 terms:")
+print(pd.Series(dict(top_terms(es, start_days=None, k=10, datasets=datasets, kind="comments")), dtype="int64"))
 
 print("\n=== State-wise Statistics ===")
 
@@ -65,10 +62,9 @@ print("Unique states detected:", states)
 
 for state in sorted(states):
     state_df = df[df["state"] == state]
+    count, _, mean, _ = score_summary(state_df.to_dict("records"))
     print(f"\nState: {state}")
-    print(f" Total comments: {len(state_df)}")
+    print(f" Total comments: {count}")
     print(" Sentiment distribution:")
-    print(state_df["sentiment"].value_counts())
-    print(" Average sentiment score:", round(state_df["sentiment_score"].mean(), 3))
-    print(" Top topic labels:")
-    print(state_df["topic_label"].value_counts().head(3))
\ No newline at end of file
+    print(state_df.set_index("sentiment")["count"].sort_values(ascending=False))
+    print(" Average sentiment score:", round(mean, 3))
@@ -8,16 +8,27 @@ from elasticsearch import Elasticsearch, helpers
 import urllib3
 from urllib3.exceptions import InsecureRequestWarning
 from flask import jsonify
-from typing import Tuple
+from typing import Optional, Tuple
 import re
 from bs4 import BeautifulSoup
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+from common import metrics
+from common.partitions import partition_index, ensure_partition_template
+from common.rollups import bulk_with_rollups, ensure_rollup_index
+from common.topic_store import ESModelStore, TopicTagger
 
 # Read configuration from ConfigMap
 def config(key: str) -> str:
     with open(f'/configs/default/shared-data/{key}', 'r') as f:
         return f.read().strip()
 
+# Optional ConfigMap keys (PUSHGATEWAY): None when the key is not set
+def optional_config(key: str) -> Optional[str]:
+    try:
+        return config(key) or None
+    except OSError:
+        return None
+
 # Initialize Elasticsearch client globally
 es = Elasticsearch(
     hosts="https://elasticsearch-master.elastic.svc.cluster.local:9200",
@@ -25,10 +36,14 @@ es = Elasticsearch(
     http_auth=(config("ES_USERNAME"), config("ES_PASSWORD"))
 )
 
+# Comment topics come from the latest published model (loaded once per process)
+topic_tagger = TopicTagger(ESModelStore(es), "comments")
+
 # Disable SSL warnings
 urllib3.disable_warnings(category=InsecureRequestWarning)
 
 # Clean data
+@metrics.timed_stage("clean_content")
 def clean_content(text: str) -> str:
     if not text:
         return ""
@@ -43,6 +58,7 @@ def clean_content(text: str) -> str:
 
 # Sentiment score
 analyzer = SentimentIntensityAnalyzer()
+@metrics.timed_stage("analyze_sentiment")
 def analyze_sentiment(text: str) -> Tuple[float, str]:
     vs = analyzer.polarity_scores(text)
     score = vs["compound"]
@@ -59,19 +75,26 @@ def main():
     actions = []
     BULK = 100
 
+    # Sources are read across the legacy index and its monthly partitions,
+    # destinations are partitioned by created_at and rolled up per day
+    ensure_partition_template(es, post_dst, "posts")
+    ensure_partition_template(es, comment_dst, "comments")
+    ensure_rollup_index(es)
+
     # Posts
-    for doc in helpers.scan(es, index=post_src, query={"query": {"match_all": {}}}):
+    for doc in helpers.scan(es, index=f"{post_src}*", query={"query": {"match_all": {}}}):
         _id = doc["_id"]
-        if es.exists(index=post_dst, id=_id):
+        src = doc["_source"]
+        dst = partition_index(post_dst, src["created_at"])
+        if es.exists(index=dst, id=_id):
             continue
 
-        src = doc["_source"]
         cleaned = clean_content(src.get("content",""))
         score, label = analyze_sentiment(cleaned)
 
         actions.append({
             "_op_type": "index",
-            "_index": post_dst,
+            "_index": dst,
             "_id": _id,
             "_source": {
                 **src,
@@ -82,27 +105,28 @@ def main():
         })
 
         if len(actions) >= BULK:
-            helpers.bulk(es, actions, chunk_size=BULK, raise_on_error=False)
+            bulk_with_rollups(es, actions, chunk_size=BULK)
             actions.clear()
 
     # Flush any remaining actions
     if actions:
-        helpers.bulk(es, actions, chunk_size=BULK, raise_on_error=False)
+        bulk_with_rollups(es, actions, chunk_size=BULK)
         actions.clear()
 
     # Comments
-    for doc in helpers.scan(es, index=comment_src, query={"query": {"match_all": {}}}):
+    for doc in helpers.scan(es, index=f"{comment_src}*", query={"query": {"match_all": {}}}):
         _id = doc["_id"]
-        if es.exists(index=comment_dst, id=_id):
+        src = doc["_source"]
+        dst = partition_index(comment_dst, src["created_at"])
+        if es.exists(index=dst, id=_id):
             continue
 
-        src = doc["_source"]
         cleaned = clean_content(src.get("content",""))
         score, label = analyze_sentiment(cleaned)
 
         actions.append({
             "_op_type": "index",
-            "_index": comment_dst,
+            "_index": dst,
             "_id": _id,
             "_source": {
                 **src,
@@ -113,11 +137,14 @@ def main():
         })
 
         if len(actions) >= BULK:
-            helpers.bulk(es, actions, chunk_size=BULK, raise_on_error=False)
+            topic_tagger.tag_actions(actions, comment_dst)
+            bulk_with_rollups(es, actions, chunk_size=BULK)
             actions.clear()
 
     if actions:
-        helpers.bulk(es, actions, chunk_size=BULK, raise_on_error=False)
+        topic_tagger.tag_actions(actions, comment_dst)
+        bulk_with_rollups(es, actions, chunk_size=BULK)
         actions.clear()
 
+    metrics.push("reindex", optional_config("PUSHGATEWAY"))
     return jsonify({"message": "Reindex completed"}), 200
\ No newline at end of file